@@ -1,5 +1,6 @@
 """Точка входа для запуска через python -m (из корня backend)"""
 import uvicorn
+from src.core.config import settings
 from src.main import app
 
 if __name__ == "__main__":
@@ -7,6 +8,7 @@ if __name__ == "__main__":
         "src.main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True
+        reload=True,
+        ws_max_size=settings.WS_MAX_MESSAGE_SIZE
     )
 
@@ -0,0 +1,347 @@
+"""
+Нагрузочный тест без обращений к OpenAI: python -m src.bench (из корня backend).
+
+Без --url поднимает сервер (python -m src.server) с LLM_BACKEND=fake на свободном
+порту и отдельной базой (по умолчанию SQLite во временном каталоге, --database-url
+для локального Postgres). Каждый смоделированный пользователь регистрируется,
+входит (/auth/sign_in), создаёт чат (/chat/new_chat), отправляет сообщения через
+/ws/{chat_id} и читает /chat/{id}/history.
+
+Отчёт: число операций, ошибки, пропускная способность, p50/p95/p99 по каждой
+операции и время до первого токена. Результат сохраняется в JSON
+(.cache/bench/ или --output), --compare сравнивает с предыдущим запуском.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Dict, List, Optional
+import httpx
+from websockets.asyncio.client import connect as ws_connect
+
+# Корень backend; src.core.config не импортируется: настройки нужны только серверу
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+PROMPTS = (
+    "Мне тревожно перед экзаменом, не могу уснуть",
+    "Как справиться с паникой в транспорте?",
+    "После аварии я постоянно вспоминаю произошедшее",
+    "Чувствую себя одиноким после переезда",
+    "Как поддержать друга, который потерял близкого?",
+    "На работе постоянный стресс, я выгораю",
+    "Не могу сосредоточиться, мысли путаются",
+    "Как перестать винить себя за ошибку?",
+)
+
+# Операции в порядке вывода отчёта (ttft - время до первого фрагмента ответа)
+OPERATIONS = ("register", "sign_in", "new_chat", "ws_connect", "message", "ttft", "history")
+
+# Переопределённые в окружении параметры fake-моделей сохраняются вместе с результатом
+FAKE_SETTINGS = (
+    "FAKE_LLM_LATENCY", "FAKE_LLM_TOKENS_PER_SECOND", "FAKE_LLM_RESPONSE_TOKENS",
+    "FAKE_LLM_USE_TOOLS", "FAKE_EMBEDDING_LATENCY", "FAKE_EMBEDDING_SIZE",
+)
+
+class BenchError(Exception):
+    """Операция завершилась ошибкой: HTTP статус, кадр error или таймаут"""
+
+class Stats():
+    """Длительности и ошибки по операциям"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {name: [] for name in OPERATIONS}
+        self.errors: Dict[str, int] = {name: 0 for name in OPERATIONS}
+        self.error_examples: Dict[str, str] = {}
+
+    def record(self, operation: str, seconds: float) -> None:
+        self.samples[operation].append(seconds)
+
+    def fail(self, operation: str, error: BaseException) -> None:
+        self.errors[operation] += 1
+        self.error_examples.setdefault(operation, str(error)[:200] or type(error).__name__)
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        result = {}
+        for name in OPERATIONS:
+            values = sorted(self.samples[name])
+            result[name] = {
+                "count": len(values),
+                "errors": self.errors[name],
+                "throughput": round(len(values) / elapsed, 3) if elapsed else 0.0,
+                "mean": round(sum(values) / len(values), 4) if values else None,
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": round(values[-1], 4) if values else None,
+            }
+        return result
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Перцентиль отсортированного списка с линейной интерполяцией"""
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return round(values[lower] + (values[upper] - values[lower]) * (position - lower), 4)
+
+async def timed(stats: Stats, operation: str, awaitable: Awaitable):
+    """Выполнить операцию и записать её длительность; при ошибке - BenchError"""
+    started = time.perf_counter()
+    try:
+        result = await awaitable
+        if isinstance(result, httpx.Response) and result.status_code >= 400:
+            raise BenchError(f"HTTP {result.status_code}: {result.text[:200]}")
+    except Exception as e:
+        stats.fail(operation, e)
+        raise BenchError(operation) from e
+    stats.record(operation, time.perf_counter() - started)
+    return result
+
+# --- Смоделированный пользователь ---
+
+async def open_chat(url: str):
+    """WebSocket соединение с чатом, готовое после кадра connected"""
+    websocket = await ws_connect(url, max_size=None)
+    frame = json.loads(await websocket.recv())
+    if frame.get("type") != "connected":
+        await websocket.close()
+        raise BenchError(f"unexpected frame {frame.get('type')}")
+    return websocket
+
+async def exchange(websocket, text: str, stats: Stats) -> None:
+    """Отправить сообщение и дождаться ai_response; первый фрагмент ответа - ttft"""
+    started = time.perf_counter()
+    first_token = None
+    await websocket.send(json.dumps({"type": "user_message", "message": text}, ensure_ascii=False))
+    while True:
+        frame = json.loads(await websocket.recv())
+        kind = frame.get("type")
+        if kind == "ping":
+            await websocket.send(json.dumps({"type": "pong"}))
+        elif kind == "error":
+            raise BenchError(frame.get("message") or "error frame")
+        elif kind in ("ai_streaming", "ai_response") and first_token is None:
+            first_token = time.perf_counter() - started
+        if kind == "ai_response":
+            break
+    stats.record("ttft", first_token)
+
+async def simulate_user(index: int, args: argparse.Namespace, run_id: str, stats: Stats) -> None:
+    # Сообщения зависят только от номера пользователя: запуски сравнимы
+    rng = random.Random(index)
+    username = f"bench_{run_id}_{index}"
+    password = "bench-password"
+    ws_url = "ws" + args.url[len("http"):]
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        try:
+            await timed(stats, "register", client.post(
+                "/auth/register", json={"username": username, "password": password}
+            ))
+            response = await timed(stats, "sign_in", client.post(
+                "/auth/sign_in", data={"username": username, "password": password}
+            ))
+            token = response.json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            response = await timed(stats, "new_chat", client.post(
+                "/chat/new_chat", json={"name": f"Bench {index}"}, headers=headers
+            ))
+            chat_id = response.json()["chat_id"]
+
+            websocket = await timed(stats, "ws_connect", asyncio.wait_for(
+                open_chat(f"{ws_url}/ws/{chat_id}?token={token}"), args.timeout
+            ))
+            try:
+                for _ in range(args.messages):
+                    if args.think_time:
+                        await asyncio.sleep(rng.uniform(0, 2 * args.think_time))
+                    await timed(stats, "message", asyncio.wait_for(
+                        exchange(websocket, rng.choice(PROMPTS), stats), args.timeout
+                    ))
+            finally:
+                await websocket.close()
+
+            await timed(stats, "history", client.get(f"/chat/{chat_id}/history", headers=headers))
+        except BenchError:
+            # Ошибка уже учтена, остальные шаги этого пользователя пропускаются
+            pass
+
+async def run_load(args: argparse.Namespace) -> dict:
+    stats = Stats()
+    run_id = datetime.now().strftime("%H%M%S") + f"{random.randrange(1000):03d}"
+
+    async def start_user(index: int) -> None:
+        if args.ramp_up:
+            await asyncio.sleep(args.ramp_up * index / args.users)
+        await simulate_user(index, args, run_id, stats)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(start_user(index) for index in range(args.users)))
+    elapsed = time.perf_counter() - started
+    return {
+        "elapsed": round(elapsed, 3),
+        "operations": stats.summary(elapsed),
+        "error_examples": stats.error_examples,
+    }
+
+# --- Сервер под нагрузкой ---
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(args: argparse.Namespace, workdir: str) -> subprocess.Popen:
+    """python -m src.server с fake-моделями; индекс и кеш эмбеддингов - во временном каталоге"""
+    port = free_port()
+    args.url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        LLM_BACKEND="fake",
+        DATABASE_URL=args.database_url or f"sqlite://{os.path.join(workdir, 'bench.sqlite3')}",
+        VECTOR_STORE_DIR=os.path.join(workdir, "vector_store"),
+        EMBEDDING_CACHE_PATH=os.path.join(workdir, "embeddings.sqlite3"),
+        WEB_HOST="127.0.0.1",
+        WEB_PORT=str(port),
+        WEB_WORKERS=str(args.workers),
+    )
+    env.setdefault("SECRET_KEY", "bench-secret")
+    env.setdefault("OPENAI_API_KEY", "bench")
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    return subprocess.Popen(
+        [sys.executable, "-m", "src.server"], cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+async def wait_ready(url: str, server: Optional[subprocess.Popen], timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url, timeout=5) as client:
+        while time.monotonic() < deadline:
+            if server is not None and server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            try:
+                if (await client.get("/ready")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {url} is not ready after {timeout:.0f}s")
+
+def stop_server(server: subprocess.Popen) -> None:
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+# --- Отчёт ---
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.1f}ms"
+
+def print_report(result: dict, previous: Optional[dict] = None) -> None:
+    print(f"\n{result['users']} users x {result['messages']} messages in {result['elapsed']:.1f}s")
+    header = f"{'operation':<12}{'count':>7}{'errors':>8}{'req/s':>9}{'p50':>11}{'p95':>11}{'p99':>11}"
+    if previous:
+        header += f"{'p50 Δ':>10}{'p95 Δ':>10}{'req/s Δ':>10}"
+    print(header)
+    for name, op in result["operations"].items():
+        line = (
+            f"{name:<12}{op['count']:>7}{op['errors']:>8}{op['throughput']:>9.2f}"
+            f"{format_seconds(op['p50']):>11}{format_seconds(op['p95']):>11}{format_seconds(op['p99']):>11}"
+        )
+        before = (previous or {}).get("operations", {}).get(name)
+        if before:
+            line += "".join(
+                f"{change(before.get(key), op.get(key)):>10}" for key in ("p50", "p95", "throughput")
+            )
+        print(line)
+    for name, example in result["error_examples"].items():
+        print(f"  {name}: {example}")
+
+def change(before: Optional[float], after: Optional[float]) -> str:
+    """Относительное изменение метрики между запусками"""
+    if not before or after is None:
+        return "-"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+def default_output() -> str:
+    name = datetime.now().strftime("bench-%Y%m%d-%H%M%S.json")
+    return os.path.join(BASE_DIR, ".cache", "bench", name)
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m src.bench", description="Offline load test with fake models")
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--messages", type=int, default=3, help="chat messages per user")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="seconds to start all users")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause before each message")
+    parser.add_argument("--timeout", type=float, default=60.0, help="timeout of a single operation")
+    parser.add_argument("--url", help="benchmark a running server instead of starting one")
+    parser.add_argument("--database-url", help="database of the started server (default: temporary SQLite)")
+    parser.add_argument("--workers", type=int, default=1, help="workers of the started server (more than one needs REDIS_URL)")
+    parser.add_argument("--output", default=None, help="where to save results (JSON)")
+    parser.add_argument("--compare", help="previous results to compare with")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    server = None
+    with tempfile.TemporaryDirectory(prefix="deepchat-bench-") as workdir:
+        if args.url is None:
+            server = start_server(args, workdir)
+        else:
+            args.url = args.url.rstrip("/")
+        try:
+            asyncio.run(wait_ready(args.url, server, timeout=120))
+            load = asyncio.run(run_load(args))
+        except RuntimeError as e:
+            if server is not None:
+                with open(os.path.join(workdir, "server.log"), errors="replace") as log:
+                    sys.stderr.write(log.read()[-4000:])
+            sys.exit(str(e))
+        finally:
+            if server is not None:
+                stop_server(server)
+
+    result = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "url": None if server is not None else args.url,
+        "database": None if server is None else (args.database_url or "sqlite").split(":")[0],
+        "workers": args.workers if server is not None else None,
+        "users": args.users,
+        "messages": args.messages,
+        "ramp_up": args.ramp_up,
+        "think_time": args.think_time,
+        "fake_settings": {name: os.environ[name] for name in FAKE_SETTINGS if name in os.environ},
+        **load,
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            previous = json.load(file)
+    print_report(result, previous)
+
+    output = args.output or default_output()
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(result, file, ensure_ascii=False, indent=2)
+    print(f"\nResults saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,207 @@
+import os
 from envparse import env
 
 env.read_envfile()
 
+# Корень backend-проекта (каталог с pyproject.toml)
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+def env_choice(name: str, default: str, choices: tuple) -> str:
+    """Строковая настройка из фиксированного набора значений"""
+    value = env.str(name, default=default)
+    if value not in choices:
+        raise ValueError(f"{name} must be one of {', '.join(choices)}, got {value!r}")
+    return value
+
 class Settings():
     DATABASE_URL: str = env.str("DATABASE_URL")
     SECRET_KEY: str = env.str("SECRET_KEY")
     ALGORITHM: str = env.str("ALGORITHM", default="HS256")
 
-settings = Settings()
\ No newline at end of file
+    # База знаний: каталог с документами и каталог сохранённых индексов
+    KNOWLEDGE_BASE_DIR: str = env.str(
+        "KNOWLEDGE_BASE_DIR", default=os.path.join(BASE_DIR, "src", "prompts")
+    )
+    EMBEDDING_MODEL: str = env.str("EMBEDDING_MODEL", default="text-embedding-ada-002")
+    VECTOR_STORE_DIR: str = env.str(
+        "VECTOR_STORE_DIR", default=os.path.join(BASE_DIR, ".cache", "vector_store")
+    )
+
+    # Индекс FAISS: flat (точный), ivfpq или hnsw. Сжатые индексы строятся, начиная
+    # с VECTOR_INDEX_MIN_SIZE векторов (меньшие базы знаний остаются flat),
+    # и загружаются через mmap: страницы читаются с диска по мере обращения
+    # и общие для воркеров
+    VECTOR_INDEX_TYPE: str = env.str("VECTOR_INDEX_TYPE", default="flat")
+    VECTOR_INDEX_MIN_SIZE: int = env.int("VECTOR_INDEX_MIN_SIZE", default=10000)
+    VECTOR_INDEX_MMAP: bool = env.bool("VECTOR_INDEX_MMAP", default=True)
+    # IVF-PQ: число кластеров (0 - 4*sqrt(N)), кластеров на запрос,
+    # подвекторов PQ (0 - размерность/16, по байту на подвектор) и во сколько раз
+    # больше кандидатов переранжируется по точным векторам (0 - без уточнения)
+    VECTOR_INDEX_NLIST: int = env.int("VECTOR_INDEX_NLIST", default=0)
+    VECTOR_INDEX_NPROBE: int = env.int("VECTOR_INDEX_NPROBE", default=16)
+    VECTOR_INDEX_PQ_M: int = env.int("VECTOR_INDEX_PQ_M", default=0)
+    VECTOR_INDEX_REFINE: int = env.int("VECTOR_INDEX_REFINE", default=16)
+    # HNSW: связей на узел, ширина поиска при построении и при запросе
+    VECTOR_INDEX_HNSW_M: int = env.int("VECTOR_INDEX_HNSW_M", default=32)
+    VECTOR_INDEX_EF_CONSTRUCTION: int = env.int("VECTOR_INDEX_EF_CONSTRUCTION", default=200)
+    VECTOR_INDEX_EF_SEARCH: int = env.int("VECTOR_INDEX_EF_SEARCH", default=64)
+
+    # Документы пользователей: каталог с файлами и индексами коллекций,
+    # максимальный размер файла в байтах и число файлов у пользователя,
+    # сколько чанков всех коллекций держать в памяти (LRU по пользователям)
+    USER_DOCUMENTS_DIR: str = env.str(
+        "USER_DOCUMENTS_DIR", default=os.path.join(BASE_DIR, ".cache", "user_documents")
+    )
+    USER_DOCUMENTS_MAX_FILE_SIZE: int = env.int("USER_DOCUMENTS_MAX_FILE_SIZE", default=1024 * 1024)
+    USER_DOCUMENTS_MAX_FILES: int = env.int("USER_DOCUMENTS_MAX_FILES", default=100)
+    USER_DOCUMENTS_CACHE_CHUNKS: int = env.int("USER_DOCUMENTS_CACHE_CHUNKS", default=200000)
+
+    # Кеш эмбеддингов: файл SQLite, LRU запросов в памяти и на диске (записей)
+    EMBEDDING_CACHE_PATH: str = env.str(
+        "EMBEDDING_CACHE_PATH", default=os.path.join(BASE_DIR, ".cache", "embeddings.sqlite3")
+    )
+    EMBEDDING_QUERY_CACHE_SIZE: int = env.int("EMBEDDING_QUERY_CACHE_SIZE", default=2048)
+    EMBEDDING_QUERY_DISK_SIZE: int = env.int("EMBEDDING_QUERY_DISK_SIZE", default=100000)
+
+    # Стриминг ответа: фрейм отправляется, когда накопилось STREAM_MIN_CHARS
+    # символов или прошло STREAM_FLUSH_INTERVAL секунд с прошлой отправки
+    STREAM_MIN_CHARS: int = env.int("STREAM_MIN_CHARS", default=24)
+    STREAM_FLUSH_INTERVAL: float = env.float("STREAM_FLUSH_INTERVAL", default=0.05)
+
+    # Контекст диалога: бюджет токенов на историю (вместе с резюме),
+    # максимум последних сообщений в контексте и размер резюме
+    CONTEXT_TOKEN_BUDGET: int = env.int("CONTEXT_TOKEN_BUDGET", default=2000)
+    CONTEXT_MAX_MESSAGES: int = env.int("CONTEXT_MAX_MESSAGES", default=20)
+    SUMMARY_MAX_TOKENS: int = env.int("SUMMARY_MAX_TOKENS", default=400)
+
+    # Семантический кеш ответов: включение, режим (return - отдать готовый ответ,
+    # seed - передать его агенту как ориентир), общие для всех пользователей ответы
+    # на первое сообщение чата (остальные записи видны только их пользователю),
+    # размер, время жизни и порог близости
+    ANSWER_CACHE_ENABLED: bool = env.bool("ANSWER_CACHE_ENABLED", default=False)
+    ANSWER_CACHE_MODE: str = env_choice("ANSWER_CACHE_MODE", "return", ("return", "seed"))
+    ANSWER_CACHE_SHARED: bool = env.bool("ANSWER_CACHE_SHARED", default=True)
+    ANSWER_CACHE_SIZE: int = env.int("ANSWER_CACHE_SIZE", default=1000)
+    ANSWER_CACHE_TTL: float = env.float("ANSWER_CACHE_TTL", default=24 * 3600.0)
+    ANSWER_CACHE_THRESHOLD: float = env.float("ANSWER_CACHE_THRESHOLD", default=0.95)
+
+    # Пагинация истории чата
+    HISTORY_PAGE_SIZE: int = env.int("HISTORY_PAGE_SIZE", default=50)
+    HISTORY_MAX_PAGE_SIZE: int = env.int("HISTORY_MAX_PAGE_SIZE", default=200)
+
+    # Список чатов: размер страницы, длина превью последнего ответа
+    # и кеш страниц на пользователя (сброс рассылается всем воркерам через брокер)
+    CHAT_LIST_PAGE_SIZE: int = env.int("CHAT_LIST_PAGE_SIZE", default=50)
+    CHAT_LIST_MAX_PAGE_SIZE: int = env.int("CHAT_LIST_MAX_PAGE_SIZE", default=200)
+    CHAT_PREVIEW_LENGTH: int = env.int("CHAT_PREVIEW_LENGTH", default=100)
+    CHAT_LIST_CACHE_TTL: float = env.float("CHAT_LIST_CACHE_TTL", default=30.0)
+    CHAT_LIST_CACHE_SIZE: int = env.int("CHAT_LIST_CACHE_SIZE", default=10000)
+
+    # Поиск по сообщениям: размер страницы, максимальная длина запроса
+    # и число терминов запроса (для SQLite FTS5)
+    CHAT_SEARCH_PAGE_SIZE: int = env.int("CHAT_SEARCH_PAGE_SIZE", default=20)
+    CHAT_SEARCH_MAX_PAGE_SIZE: int = env.int("CHAT_SEARCH_MAX_PAGE_SIZE", default=100)
+    CHAT_SEARCH_MAX_QUERY_LENGTH: int = env.int("CHAT_SEARCH_MAX_QUERY_LENGTH", default=200)
+    CHAT_SEARCH_MAX_TERMS: int = env.int("CHAT_SEARCH_MAX_TERMS", default=16)
+
+    # Кеш проверенных токенов и пользователей (в пределах процесса). Сброс после смены
+    # пароля доходит до других воркеров через REDIS_URL, без него - через AUTH_CACHE_TTL
+    AUTH_CACHE_TTL: float = env.float("AUTH_CACHE_TTL", default=60.0)
+    AUTH_CACHE_SIZE: int = env.int("AUTH_CACHE_SIZE", default=10000)
+
+    # Диспетчер вызовов LLM: одновременных вызовов на процесс, размер очередей
+    # и подсказка клиенту, через сколько секунд повторить отклонённый запрос
+    LLM_MAX_CONCURRENCY: int = env.int("LLM_MAX_CONCURRENCY", default=8)
+    LLM_MAX_QUEUE_PER_USER: int = env.int("LLM_MAX_QUEUE_PER_USER", default=2)
+    LLM_MAX_QUEUE_TOTAL: int = env.int("LLM_MAX_QUEUE_TOTAL", default=100)
+    LLM_BUSY_RETRY_AFTER: float = env.float("LLM_BUSY_RETRY_AFTER", default=5.0)
+
+    # Фоновые задачи после хода чата: число обработчиков и размер очереди на процесс,
+    # повторы с экспоненциальной задержкой, таймаут одной попытки и сколько
+    # дорабатывать очередь при остановке
+    BACKGROUND_WORKERS: int = env.int("BACKGROUND_WORKERS", default=2)
+    BACKGROUND_QUEUE_SIZE: int = env.int("BACKGROUND_QUEUE_SIZE", default=1000)
+    BACKGROUND_RETRIES: int = env.int("BACKGROUND_RETRIES", default=2)
+    BACKGROUND_RETRY_DELAY: float = env.float("BACKGROUND_RETRY_DELAY", default=1.0)
+    BACKGROUND_TASK_TIMEOUT: float = env.float("BACKGROUND_TASK_TIMEOUT", default=60.0)
+    BACKGROUND_DRAIN_TIMEOUT: float = env.float("BACKGROUND_DRAIN_TIMEOUT", default=10.0)
+
+    # Запись сообщений чата: sync - отдельной транзакцией до ответа; group - пачкой,
+    # ответ после фиксации пачки; async - пачкой после ответа (при падении процесса
+    # теряются сообщения последнего интервала). Пачка пишется при MESSAGE_BATCH_SIZE
+    # сообщений или раз в MESSAGE_FLUSH_INTERVAL секунд; при MESSAGE_MAX_PENDING
+    # несохранённых ход сам ждёт записи. id резервируются блоками.
+    # async - только с одним воркером, group на SQLite - тоже. В режиме async
+    # сообщение, которое БД отвергает (IntegrityError), выбрасывается после
+    # MESSAGE_WRITE_RETRIES повторов; при недоступной БД повторы не ограничены
+    MESSAGE_PERSISTENCE: str = env_choice("MESSAGE_PERSISTENCE", "sync", ("sync", "group", "async"))
+    MESSAGE_BATCH_SIZE: int = env.int("MESSAGE_BATCH_SIZE", default=200)
+    MESSAGE_FLUSH_INTERVAL: float = env.float("MESSAGE_FLUSH_INTERVAL", default=0.1)
+    MESSAGE_MAX_PENDING: int = env.int("MESSAGE_MAX_PENDING", default=10000)
+    MESSAGE_ID_BLOCK_SIZE: int = env.int("MESSAGE_ID_BLOCK_SIZE", default=100)
+    MESSAGE_WRITE_RETRIES: int = env.int("MESSAGE_WRITE_RETRIES", default=3)
+
+    # Production сервер (python -m src.server): адрес, число воркеров (0 - по числу
+    # CPU и памяти; без REDIS_URL воркер один), оценка памяти на воркер и время
+    # на мягкую остановку воркера
+    WEB_HOST: str = env.str("WEB_HOST", default="0.0.0.0")
+    WEB_PORT: int = env.int("WEB_PORT", default=8000)
+    WEB_WORKERS: int = env.int("WEB_WORKERS", default=0)
+    WEB_WORKER_MEMORY_MB: int = env.int("WEB_WORKER_MEMORY_MB", default=300)
+    WEB_GRACEFUL_TIMEOUT: float = env.float("WEB_GRACEFUL_TIMEOUT", default=30.0)
+
+    # Рассылка WebSocket событий между воркерами: без REDIS_URL - в пределах процесса
+    REDIS_URL: str = env.str("REDIS_URL", default="")
+    REDIS_CHANNEL: str = env.str("REDIS_CHANNEL", default="deepchat:events")
+
+    # WebSocket: интервал ping и время ожидания ответа (0 - без heartbeat),
+    # закрытие соединения без сообщений пользователя (0 - без ограничения),
+    # максимальный размер сообщения в байтах и лимит соединений на процесс
+    WS_PING_INTERVAL: float = env.float("WS_PING_INTERVAL", default=20.0)
+    WS_PONG_TIMEOUT: float = env.float("WS_PONG_TIMEOUT", default=20.0)
+    WS_IDLE_TIMEOUT: float = env.float("WS_IDLE_TIMEOUT", default=30 * 60.0)
+    WS_MAX_MESSAGE_SIZE: int = env.int("WS_MAX_MESSAGE_SIZE", default=16 * 1024)
+    WS_MAX_CONNECTIONS: int = env.int("WS_MAX_CONNECTIONS", default=1000)
+
+    # Модели: openai или fake - детерминированные локальные замены для нагрузочного
+    # тестирования (задержка до первого токена, скорость генерации, длина ответа,
+    # вызов поиска по базе знаний; задержка и размерность эмбеддингов)
+    LLM_BACKEND: str = env.str("LLM_BACKEND", default="openai")
+    FAKE_LLM_LATENCY: float = env.float("FAKE_LLM_LATENCY", default=0.2)
+    FAKE_LLM_TOKENS_PER_SECOND: float = env.float("FAKE_LLM_TOKENS_PER_SECOND", default=50.0)
+    FAKE_LLM_RESPONSE_TOKENS: int = env.int("FAKE_LLM_RESPONSE_TOKENS", default=60)
+    FAKE_LLM_USE_TOOLS: bool = env.bool("FAKE_LLM_USE_TOOLS", default=True)
+    FAKE_EMBEDDING_LATENCY: float = env.float("FAKE_EMBEDDING_LATENCY", default=0.02)
+    FAKE_EMBEDDING_SIZE: int = env.int("FAKE_EMBEDDING_SIZE", default=256)
+
+    # Доля запросов и ходов чата, для которых спаны этапов пишутся в лог "trace"
+    TRACE_SAMPLE_RATE: float = env.float("TRACE_SAMPLE_RATE", default=0.0)
+
+    # Пул потоков для bcrypt: число потоков и сколько задач может ждать в очереди,
+    # прежде чем новые запросы будут отклонены с 503
+    PASSWORD_HASH_WORKERS: int = env.int("PASSWORD_HASH_WORKERS", default=2)
+    PASSWORD_HASH_QUEUE_SIZE: int = env.int("PASSWORD_HASH_QUEUE_SIZE", default=32)
+
+    # Поиск по базе знаний: документов на запрос, минимальная релевантность FAISS (0..1)
+    # и число потоков для поиска FAISS
+    RETRIEVAL_K: int = env.int("RETRIEVAL_K", default=3)
+    RETRIEVAL_SCORE_THRESHOLD: float = env.float("RETRIEVAL_SCORE_THRESHOLD", default=0.0)
+    RETRIEVAL_WORKERS: int = env.int("RETRIEVAL_WORKERS", default=2)
+
+    # Гибридный поиск: константа RRF и условие, при котором уверенного
+    # лексического совпадения достаточно и эмбеддинг запроса не нужен
+    # (все термины запроса в лучшем документе и отрыв от второго в N раз).
+    # HYBRID_LEXICAL_MIN_COVERAGE - минимальная доля терминов запроса в документе BM25
+    HYBRID_RRF_K: int = env.int("HYBRID_RRF_K", default=60)
+    HYBRID_LEXICAL_SHORTCUT: bool = env.bool("HYBRID_LEXICAL_SHORTCUT", default=True)
+    HYBRID_LEXICAL_CONFIDENCE_RATIO: float = env.float("HYBRID_LEXICAL_CONFIDENCE_RATIO", default=1.5)
+    HYBRID_LEXICAL_MIN_COVERAGE: float = env.float("HYBRID_LEXICAL_MIN_COVERAGE", default=0.0)
+
+    # Индексация: чанков в одном запросе эмбеддингов и число параллельных запросов
+    INGEST_BATCH_SIZE: int = env.int("INGEST_BATCH_SIZE", default=64)
+    INGEST_CONCURRENCY: int = env.int("INGEST_CONCURRENCY", default=4)
+
+    # Пользователи с доступом к административным эндпоинтам
+    ADMIN_USERNAMES: list = env.list("ADMIN_USERNAMES", default=[])
+
+settings = Settings()
@@ -1,13 +1,93 @@
-from tortoise.contrib.fastapi import register_tortoise
-from fastapi import FastAPI
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from tortoise import Tortoise, connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.exceptions import DoesNotExist, IntegrityError
 from src.core.config import settings
+from src.core.metrics import histogram
+from src.core.schema import upgrade_schema
+import functools
+import time
+
+db_query_seconds = histogram("db_query_seconds", "Time spent executing a single SQL statement")
+
+QUERY_METHODS = ("execute_insert", "execute_many", "execute_query", "execute_query_dict", "execute_script")
+
+
+class QueryCounter():
+    """Число SQL запросов в рамках HTTP запроса или хода чата"""
+
+    def __init__(self):
+        self.count = 0
+
+
+_query_counter: ContextVar[Optional[QueryCounter]] = ContextVar("query_counter", default=None)
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryCounter]:
+    counter = QueryCounter()
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
+
+
+def _instrument(method):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        counter = _query_counter.get()
+        if counter is not None:
+            counter.count += 1
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            db_query_seconds.observe(time.perf_counter() - started)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def instrument_db() -> None:
+    """Подсчёт запросов во всех загруженных клиентах Tortoise (и их транзакциях)"""
+    classes = [BaseDBAsyncClient]
+    while classes:
+        cls = classes.pop()
+        classes.extend(cls.__subclasses__())
+        for name in QUERY_METHODS:
+            method = cls.__dict__.get(name)
+            if method is not None and not getattr(method, "instrumented", False):
+                setattr(cls, name, _instrument(method))
+
+
+async def init_db() -> None:
+    """Подключение Tortoise ORM (вызывается из lifespan приложения)"""
+    await Tortoise.init(db_url=settings.DATABASE_URL, modules={"models": ["src.models"]})
+    instrument_db()
+    # Столбцы, добавленные в модели после создания базы, - до индексов generate_schemas
+    await upgrade_schema()
+    await Tortoise.generate_schemas()
+
+
+async def close_db() -> None:
+    await connections.close_all()
 
 
 def register_db(app: FastAPI):
-    register_tortoise(
-        app,
-        db_url=settings.DATABASE_URL,
-        modules={"models": ["src.models"]},
-        generate_schemas=True,
-        add_exception_handlers=True
-    )
\ No newline at end of file
+    """Обработчики ошибок ORM (как add_exception_handlers в register_tortoise)"""
+
+    @app.exception_handler(DoesNotExist)
+    async def doesnotexist_exception_handler(request: Request, exc: DoesNotExist):
+        return JSONResponse(status_code=404, content={"detail": str(exc)})
+
+    @app.exception_handler(IntegrityError)
+    async def integrityerror_exception_handler(request: Request, exc: IntegrityError):
+        return JSONResponse(
+            status_code=422,
+            content={"detail": [{"loc": [], "msg": str(exc), "type": "IntegrityError"}]},
+        )
@@ -0,0 +1,63 @@
+"""
+Метрики в формате Prometheus на prometheus_client.
+
+Под prefork-сервером (src.server) задан PROMETHEUS_MULTIPROC_DIR: каждый воркер
+пишет значения в свои файлы в этом каталоге, и /metrics любого воркера отдаёт
+сумму по всем живым воркерам. Без него (uvicorn напрямую, скрипты) метрики
+хранятся в памяти процесса.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Sequence
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client import generate_latest, multiprocess
+from src.core.prefork import METRICS_DIR_ENV
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Метрики по имени: модуль, импортированный повторно, получает уже созданную метрику
+registry: Dict[str, object] = {}
+
+def counter(name: str, description: str, labelnames: Sequence[str] = ()) -> Counter:
+    metric = registry.get(name)
+    if metric is None:
+        metric = registry[name] = Counter(name, description, labelnames)
+    return metric
+
+def gauge(name: str, description: str, labelnames: Sequence[str] = ()) -> Gauge:
+    metric = registry.get(name)
+    if metric is None:
+        # livesum: значение - сумма по живым воркерам, данные упавших не учитываются
+        metric = registry[name] = Gauge(name, description, labelnames, multiprocess_mode="livesum")
+    return metric
+
+def histogram(
+    name: str,
+    description: str,
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+    labelnames: Sequence[str] = ()
+) -> Histogram:
+    metric = registry.get(name)
+    if metric is None:
+        metric = registry[name] = Histogram(name, description, labelnames, buckets=buckets)
+    return metric
+
+@contextmanager
+def timer(metric: Histogram) -> Iterator[None]:
+    """Записать длительность блока в гистограмму"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.observe(time.perf_counter() - started)
+
+def render() -> bytes:
+    """Все метрики в формате Prometheus: сумма по воркерам или метрики процесса"""
+    if os.environ.get(METRICS_DIR_ENV):
+        collected = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collected)
+        return generate_latest(collected)
+    return generate_latest(REGISTRY)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
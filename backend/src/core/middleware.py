@@ -0,0 +1,48 @@
+import time
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.core.database import count_queries
+from src.core.metrics import histogram
+from src.core.tracing import trace
+
+http_request_seconds = histogram(
+    "http_request_seconds", "HTTP request latency by route",
+    labelnames=("method", "route", "status")
+)
+http_request_db_queries = histogram(
+    "http_request_db_queries", "SQL statements executed per HTTP request",
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100), labelnames=("method", "route")
+)
+
+class MetricsMiddleware():
+    """
+    Длительность и число SQL запросов для каждого HTTP запроса.
+    Чистый ASGI middleware: не буферизует ответ и не трогает WebSocket
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        with count_queries() as queries, trace("http") as current:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # Шаблон пути (/chat/{chat_id}/history), а не сам путь - иначе метки не ограничены
+                route = getattr(scope.get("route"), "path", "unmatched")
+                if current is not None:
+                    current.name = f"{scope['method']} {route}"
+                http_request_seconds.labels(scope["method"], route, status).observe(time.perf_counter() - started)
+                http_request_db_queries.labels(scope["method"], route).observe(queries.count)
@@ -0,0 +1,12 @@
+"""
+Общее для prefork сервера (src.server) и приложения в его воркерах:
+приложению не нужно импортировать сам сервер
+"""
+
+# Переменная окружения воркера с pid родителя: через неё воркер
+# может попросить родителя о перезапуске (например, после переиндексации)
+PARENT_PID_ENV = "DEEPCHAT_SERVER_PID"
+
+# Каталог, через который воркеры складывают метрики prometheus_client:
+# /metrics любого воркера отдаёт сумму по всем
+METRICS_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
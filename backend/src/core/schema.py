@@ -0,0 +1,88 @@
+"""
+Обновление схемы существующей базы при старте.
+
+Миграций в проекте нет: generate_schemas создаёт недостающие таблицы и индексы,
+но не добавляет столбцы в существующие таблицы (и падает на индексе по такому
+столбцу). Столбцы chats, появившиеся после первой версии, добавляются здесь
+до generate_schemas и заполняются по chatmessages; повторный запуск ничего не меняет
+"""
+import logging
+from typing import List, Set
+from tortoise import connections, timezone
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+from src.models.chat import Chat
+
+# Столбец -> определение для Postgres и для SQLite. SQLite не разрешает в ADD COLUMN
+# непостоянное значение по умолчанию: last_activity_at заполняется ниже
+CHAT_COLUMNS = {
+    "summary": ("TEXT NOT NULL DEFAULT ''", "TEXT NOT NULL DEFAULT ''"),
+    "summarized_until": ("INT NOT NULL DEFAULT 0", "INT NOT NULL DEFAULT 0"),
+    "answer_cache_enabled": ("BOOL NOT NULL DEFAULT TRUE", "INT NOT NULL DEFAULT 1"),
+    "message_count": ("INT NOT NULL DEFAULT 0", "INT NOT NULL DEFAULT 0"),
+    "last_message_at": ("TIMESTAMPTZ", "TIMESTAMP"),
+    "last_message_preview": ("VARCHAR(255) NOT NULL DEFAULT ''", "VARCHAR(255) NOT NULL DEFAULT ''"),
+    "last_activity_at": (
+        "TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP",
+        "TIMESTAMP NOT NULL DEFAULT '1970-01-01 00:00:00+00:00'"
+    ),
+}
+
+# Ключ advisory lock: воркеры и узлы обновляют схему Postgres по очереди
+UPGRADE_LOCK_KEY = 724301
+
+async def _chat_columns(connection: BaseDBAsyncClient, dialect: str) -> Set[str]:
+    """Столбцы существующей таблицы chats (пусто - таблицы ещё нет)"""
+    if dialect == "postgres":
+        rows = await connection.execute_query_dict(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = 'chats'"
+        )
+        return {row["column_name"] for row in rows}
+    rows = await connection.execute_query_dict('PRAGMA table_info("chats")')
+    return {row["name"] for row in rows}
+
+async def _backfill(connection: BaseDBAsyncClient, added: List[str]) -> None:
+    if "message_count" in added or "last_message_at" in added:
+        await connection.execute_script(
+            'UPDATE chats SET '
+            'message_count = (SELECT COUNT(*) FROM chatmessages m WHERE m.chat_id = chats.id), '
+            'last_message_at = (SELECT MAX(m.time) FROM chatmessages m WHERE m.chat_id = chats.id)'
+        )
+    if "last_activity_at" in added:
+        # Время создания старых чатов неизвестно: чат без сообщений - как созданный сейчас
+        await Chat.filter(last_message_at__isnull=False).using_db(connection).update(
+            last_activity_at=F("last_message_at")
+        )
+        await Chat.filter(last_message_at__isnull=True).using_db(connection).update(
+            last_activity_at=timezone.now()
+        )
+    if "last_message_preview" in added:
+        from src.services.chat_list import make_preview
+        rows = await connection.execute_query_dict(
+            "SELECT chat_id, bot_response FROM chatmessages "
+            "WHERE id IN (SELECT MAX(id) FROM chatmessages GROUP BY chat_id)"
+        )
+        for row in rows:
+            await Chat.filter(id=row["chat_id"]).using_db(connection).update(
+                last_message_preview=make_preview(row["bot_response"])
+            )
+
+async def upgrade_schema() -> None:
+    """Добавить недостающие столбцы chats и заполнить их (до generate_schemas)"""
+    dialect = connections.get("default").capabilities.dialect
+    if dialect not in ("postgres", "sqlite"):
+        return
+    async with in_transaction() as connection:
+        if dialect == "postgres":
+            await connection.execute_query("SELECT pg_advisory_xact_lock($1)", [UPGRADE_LOCK_KEY])
+        columns = await _chat_columns(connection, dialect)
+        added = [name for name in CHAT_COLUMNS if columns and name not in columns]
+        if not added:
+            return
+        logging.info(f"Adding columns to chats: {', '.join(added)}")
+        for name in added:
+            definition = CHAT_COLUMNS[name][0 if dialect == "postgres" else 1]
+            await connection.execute_script(f'ALTER TABLE chats ADD COLUMN "{name}" {definition}')
+        await _backfill(connection, added)
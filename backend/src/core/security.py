@@ -1,19 +1,71 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from fastapi import HTTPException
 from passlib.context import CryptContext
+from src.core.config import settings
+from src.core.metrics import counter, gauge, histogram
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def hash_password(password: str) -> str:
+# bcrypt выполняется в отдельном ограниченном пуле, чтобы не блокировать event loop
+_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="bcrypt"
+)
+_max_pending = settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE
+_pending = 0
+
+hash_queue_depth = gauge("password_hash_queue_depth", "Bcrypt tasks running or waiting in the pool")
+hash_rejected = counter("password_hash_rejected_total", "Bcrypt tasks rejected because the pool is full")
+hash_wait_seconds = histogram("password_hash_wait_seconds", "Time bcrypt tasks spend queued")
+hash_seconds = histogram("password_hash_seconds", "Time spent hashing or verifying a password")
+
+def _truncate(password: str) -> str:
     # bcrypt ограничивает пароль 72 байтами
     password_bytes = password.encode('utf-8')
     if len(password_bytes) > 72:
         password_bytes = password_bytes[:72]
         password = password_bytes.decode('utf-8', errors='ignore')
-    return pwd_context.hash(password)
+    return password
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(_truncate(password))
 
 def verify_password(password: str, hashed_password: str) -> bool:
-    # bcrypt ограничивает пароль 72 байтами
-    password_bytes = password.encode('utf-8')
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-        password = password_bytes.decode('utf-8', errors='ignore')
-    return pwd_context.verify(password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(_truncate(password), hashed_password)
+
+async def _run_in_pool(func: Callable, *args):
+    global _pending
+    if _pending >= _max_pending:
+        hash_rejected.inc()
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, try again later",
+            headers={"Retry-After": "1"}
+        )
+
+    submitted = time.perf_counter()
+
+    def timed():
+        started = time.perf_counter()
+        hash_wait_seconds.observe(started - submitted)
+        try:
+            return func(*args)
+        finally:
+            hash_seconds.observe(time.perf_counter() - started)
+
+    _pending += 1
+    hash_queue_depth.inc()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, timed)
+    finally:
+        _pending -= 1
+        hash_queue_depth.dec()
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_pool(hash_password, password)
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    return await _run_in_pool(verify_password, password, hashed_password)
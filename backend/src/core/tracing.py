@@ -0,0 +1,90 @@
+import contextvars
+import json
+import logging
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from src.core.config import settings
+from src.core.metrics import Histogram, histogram
+
+logger = logging.getLogger("trace")
+
+chat_stage_seconds = histogram(
+    "chat_stage_seconds", "Time spent in each stage of a chat turn", labelnames=("stage",)
+)
+
+class Trace():
+    """Спаны одного запроса; записываются в лог одной строкой JSON по завершении"""
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+
+    def dump(self) -> str:
+        return json.dumps({
+            "trace_id": self.id,
+            "name": self.name,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "spans": self.spans
+        }, ensure_ascii=False, default=str)
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_parent: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("span_parent", default=None)
+
+@contextmanager
+def trace(name: str) -> Iterator[Optional[Trace]]:
+    """
+    Корневой спан запроса. Записывается доля TRACE_SAMPLE_RATE запросов,
+    в остальных span() только пишет длительности в гистограммы
+    """
+    if _trace.get() is not None or random.random() >= settings.TRACE_SAMPLE_RATE:
+        yield None
+        return
+    current = Trace(name)
+    token = _trace.set(current)
+    try:
+        yield current
+    finally:
+        _trace.reset(token)
+        logger.info(current.dump())
+
+def stage(name: str, **attributes: Any):
+    """Спан этапа хода чата с гистограммой chat_stage_seconds{stage=name}"""
+    return span(name, chat_stage_seconds.labels(name), **attributes)
+
+@contextmanager
+def span(name: str, histogram: Optional[Histogram] = None, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Этап обработки: длительность пишется в histogram (если задана) всегда,
+    а в трассировку - только для выбранных сэмплированием запросов
+    """
+    current = _trace.get()
+    record: Dict[str, Any] = dict(attributes)
+    started = time.perf_counter()
+    token = None
+    if current is not None:
+        span_id = uuid.uuid4().hex[:8]
+        token = _parent.set(span_id)
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        if histogram is not None:
+            histogram.observe(duration)
+        if current is not None:
+            _parent.reset(token)
+            current.spans.append({
+                "id": span_id,
+                "parent": _parent.get(),
+                "name": name,
+                "start_ms": round((started - current.started) * 1000, 2),
+                "duration_ms": round(duration * 1000, 2),
+                **record
+            })
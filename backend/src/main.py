@@ -1,11 +1,49 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from src.routers import api_router
-from src.core.database import register_db
+from src.core.database import register_db, init_db, close_db
+from src.core.middleware import MetricsMiddleware
+from src.services.chat import init_agent, cancel_init
+from src.services.chat_search import ensure_search_index
+from src.services.background import background_tasks
+from src.services.message_writer import message_writer
+from src.core.config import settings
+from src.services.connections import connection_manager
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import logging
+
+
+async def warm_up() -> None:
+    try:
+        await init_agent()
+    except Exception as e:
+        # /ready остаётся 503, загрузка повторится при первом сообщении
+        logging.error(f"Failed to initialize agent: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+    await ensure_search_index()
+    # Служебные события других воркеров (сброс кешей) нужны и без WebSocket соединений
+    await connection_manager.start()
+    # Индекс и агент загружаются в фоне: /health отвечает сразу, /ready - после загрузки
+    warm_up_task = asyncio.create_task(warm_up())
+    try:
+        yield
+    finally:
+        warm_up_task.cancel()
+        cancel_init()
+        # Фоновые задачи пишут в БД и рассылают события - дорабатываем до закрытия
+        await background_tasks.drain(settings.BACKGROUND_DRAIN_TIMEOUT)
+        await connection_manager.close()
+        await message_writer.close()
+        await close_db()
 
 
 def create_app() -> FastAPI:
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
     register_db(app)
     app.include_router(api_router)
 
@@ -16,7 +54,8 @@ def create_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(MetricsMiddleware)
 
     return app
 
-app = create_app()
\ No newline at end of file
+app = create_app()
@@ -5,7 +5,20 @@ from tortoise import fields
 class Chat(Model):
     id = fields.IntField(pk=True)
     name = fields.CharField(max_length=100)
-    user = fields.ForeignKeyField(model_name="models.User", related_name="chats")
+    user = fields.ForeignKeyField(model_name="models.User", related_name="chats", on_delete=fields.CASCADE)
+    # Скользящее резюме старых сообщений и id последнего вошедшего в него сообщения
+    summary = fields.TextField(default="")
+    summarized_until = fields.IntField(default=0)
+    # Разрешено ли отвечать в этом чате из семантического кеша ответов
+    answer_cache_enabled = fields.BooleanField(default=True)
+    # Счётчик сообщений, время и начало последнего ответа, обновляются при сохранении сообщения
+    message_count = fields.IntField(default=0)
+    last_message_at = fields.DatetimeField(null=True)
+    last_message_preview = fields.CharField(max_length=255, default="")
+    # Время создания чата или последнего сообщения: порядок списка чатов
+    last_activity_at = fields.DatetimeField(auto_now_add=True)
 
     class Meta:
-        table = "chats"
\ No newline at end of file
+        table = "chats"
+        # Список чатов пользователя по последней активности
+        indexes = (("user_id", "last_activity_at", "id"),)
@@ -3,11 +3,15 @@ from tortoise import fields
 
 class ChatMessage(Model):
     id = fields.IntField(pk=True)
-    chat = fields.ForeignKeyField(model_name="models.Chat", related_name="messages")
-    user = fields.ForeignKeyField(model_name="models.User", related_name="chat_messages")
+    chat = fields.ForeignKeyField(model_name="models.Chat", related_name="messages", on_delete=fields.CASCADE)
+    user = fields.ForeignKeyField(
+        model_name="models.User", related_name="chat_messages", on_delete=fields.CASCADE, index=True
+    )
     user_message = fields.TextField()
     bot_response = fields.TextField()
     time = fields.DatetimeField(auto_now_add=True)
 
     class Meta:
-        table = "chatmessages"
\ No newline at end of file
+        table = "chatmessages"
+        # История чата по (time, id) и окно контекста по id
+        indexes = (("chat_id", "time", "id"), ("chat_id", "id"))
\ No newline at end of file
@@ -3,11 +3,19 @@ from src.routers.auth import router as auth_router
 from src.routers.user import router as user_router
 from src.routers.chat import router as chat_router
 from src.routers.websocket import router as websocket_router
+from src.routers.admin import router as admin_router
+from src.routers.documents import router as documents_router
+from src.routers.health import router as health_router
+from src.routers.metrics import router as metrics_router
 api_router = APIRouter()
 
 api_router.include_router(router=auth_router, prefix="/auth", tags=["Auth"])
 api_router.include_router(router=user_router, prefix="/user", tags=["User"])
 api_router.include_router(router=chat_router, prefix="/chat", tags=["Chat"])
 api_router.include_router(router=websocket_router, tags=["WebSocket"])
+api_router.include_router(router=admin_router, prefix="/admin", tags=["Admin"])
+api_router.include_router(router=documents_router, prefix="/documents", tags=["Documents"])
+api_router.include_router(router=health_router, tags=["Health"])
+api_router.include_router(router=metrics_router, tags=["Metrics"])
 
 __all__ = ["api_router"]
\ No newline at end of file
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends
+import os
+import signal
+from typing import Annotated
+from src.models.user import User
+from src.services.chat import get_knowledge_base
+from src.services.dependencies import get_admin_user
+from src.core.prefork import PARENT_PID_ENV
+
+router = APIRouter()
+
+@router.post("/reindex")
+async def reindex_knowledge_base(admin: Annotated[User, Depends(get_admin_user)]):
+    """Инкрементальная переиндексация базы знаний без перезапуска сервера"""
+    from src.utils.ingestion import sync_knowledge_base
+    
+    _, report = await sync_knowledge_base(await get_knowledge_base())
+    
+    # Под prefork сервером остальные воркеры получат новый индекс после перезапуска
+    parent_pid = os.environ.get(PARENT_PID_ENV)
+    if parent_pid and (report["added"] or report["changed"] or report["deleted"]):
+        os.kill(int(parent_pid), signal.SIGHUP)
+        report["workers_restarting"] = True
+    return report
@@ -4,11 +4,11 @@ from typing import Annotated
 from src.models.user import User
 from src.schemas.user import UserCreate
 from src.schemas.auth import ChangePassword
-from src.core.security import hash_password, verify_password
+from src.core.security import hash_password_async, verify_password_async
 from datetime import timedelta, datetime, timezone
 from jose import JWTError, jwt
 from src.core.config import settings
-from src.services.dependencies import get_current_user
+from src.services.dependencies import get_current_user, invalidate_user
 
 router = APIRouter()
 
@@ -25,13 +25,13 @@ async def register_new_user(user: UserCreate):
     if unique_user is not None:
         raise HTTPException(status_code=409, detail="this username already exist")
     user_model = await User.create(username=user.username,
-                                    hashed_password=hash_password(user.password))
+                                    hashed_password=await hash_password_async(user.password))
     return HTTPException(status_code=201, detail="Succsessfully register")
 
 @router.post("/sign_in")
 async def login_user(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
     user = await User.filter(username=form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail=f"Invalid data , {form_data.username}")
     
     token = create_access_token({"sub": user.username}, timedelta=timedelta(minutes=30))
@@ -45,8 +45,9 @@ async def change_user_password(form_data: ChangePassword, current_user: Annotate
     if not current_password or not new_password:
         raise HTTPException(status_code=401, detail="Invalid data")
     
-    if not verify_password(current_password, current_user.hashed_password):
+    if not await verify_password_async(current_password, current_user.hashed_password):
         raise  HTTPException(status_code=401, detail="Type a right current password")
     
-    current_user.hashed_password = hash_password(new_password)
-    await current_user.save()
\ No newline at end of file
+    current_user.hashed_password = await hash_password_async(new_password)
+    await current_user.save()
+    await invalidate_user(current_user.username)
\ No newline at end of file
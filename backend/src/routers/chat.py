@@ -1,20 +1,43 @@
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 from src.schemas.chat import CreateChat
 from src.services.dependencies import get_current_user
-from typing import Annotated
-from fastapi import Depends, HTTPException
+from typing import Annotated, Literal, Optional
+from fastapi import Depends, HTTPException, Query
+from tortoise.expressions import Q
+from src.core.config import settings
 from src.models.chat import Chat
 from src.models.message import ChatMessage
+from src.services.connections import connection_manager
+from src.services.chat_list import list_chats, invalidate_chat_list
+from src.services.chat_search import search_messages
+from src.services.message_writer import message_writer
+from src.utils.pagination import encode_cursor, decode_time_cursor
+import json
 
 router = APIRouter()
 
 @router.get("/my")
-async def get_user_chats(current_user: Annotated[dict, Depends(get_current_user)]):
-    chats = await Chat.filter(user=current_user).all()
-    if not chats:
-        raise HTTPException(status_code=404, detail="Not found any chats for this user")
-    
-    return chats
+async def get_user_chats(
+    current_user: Annotated[dict, Depends(get_current_user)],
+    limit: Annotated[int, Query(ge=1, le=settings.CHAT_LIST_MAX_PAGE_SIZE)] = settings.CHAT_LIST_PAGE_SIZE,
+    before: Optional[str] = None
+):
+    """Чаты по убыванию последней активности с превью; следующая страница - по курсору next"""
+    await message_writer.flush_user(current_user.id)
+    return await list_chats(current_user.id, limit, before)
+
+@router.get("/search")
+async def search_user_messages(
+    q: Annotated[str, Query(min_length=1, max_length=settings.CHAT_SEARCH_MAX_QUERY_LENGTH)],
+    current_user: Annotated[dict, Depends(get_current_user)],
+    chat_id: Optional[int] = None,
+    limit: Annotated[int, Query(ge=1, le=settings.CHAT_SEARCH_MAX_PAGE_SIZE)] = settings.CHAT_SEARCH_PAGE_SIZE,
+    before: Optional[str] = None
+):
+    """Полнотекстовый поиск по всем чатам пользователя (или по chat_id) с подсветкой"""
+    await message_writer.flush_user(current_user.id)
+    return await search_messages(current_user.id, q, limit, before, chat_id)
 
 @router.post("/new_chat")
 async def create_new_chat(chat: CreateChat, current_user: Annotated[dict, Depends(get_current_user)]):  
@@ -22,30 +45,90 @@ async def create_new_chat(chat: CreateChat, current_user: Annotated[dict, Depend
         name=chat.name or "New Chat",
         user=current_user
     )
+    await invalidate_chat_list(current_user.id)
     return {"chat_id": chat_model.id}
 
+def format_history_message(message: dict) -> list:
+    """Одна строка ChatMessage -> реплики пользователя и ассистента"""
+    timestamp = message["time"].isoformat()
+    return [
+        {
+            "id": f"{message['id']}_user",
+            "role": "user",
+            "content": message["user_message"],
+            "timestamp": timestamp
+        },
+        {
+            "id": f"{message['id']}_assistant",
+            "role": "assistant",
+            "content": message["bot_response"],
+            "timestamp": timestamp
+        }
+    ]
+
+def history_page_query(chat: Chat, before: Optional[str], after: Optional[str], descending: bool, limit: int):
+    """Keyset-выборка сообщений чата по (time, id) между курсорами"""
+    query = ChatMessage.filter(chat=chat)
+    if before:
+        time, id = decode_time_cursor(before)
+        query = query.filter(Q(time__lt=time) | Q(time=time, id__lt=id))
+    if after:
+        time, id = decode_time_cursor(after)
+        query = query.filter(Q(time__gt=time) | Q(time=time, id__gt=id))
+    order = ("-time", "-id") if descending else ("time", "id")
+    # limit до values(): у ValuesQuery нет limit()
+    return query.order_by(*order).limit(limit).values("id", "user_message", "bot_response", "time")
+
+async def stream_history(chat: Chat, before: Optional[str], after: Optional[str], batch_size: int):
+    """NDJSON-поток всей выбранной истории, читаемой из БД порциями"""
+    while True:
+        rows = await history_page_query(chat, before, after, descending=False, limit=batch_size)
+        for row in rows:
+            for item in format_history_message(row):
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        if len(rows) < batch_size:
+            break
+        after = encode_cursor(rows[-1]["time"], rows[-1]["id"])
+
 @router.get("/{chat_id}/history")
-async def get_chat_history(chat_id: int, current_user: Annotated[dict, Depends(get_current_user)]):
+async def get_chat_history(
+    chat_id: int,
+    current_user: Annotated[dict, Depends(get_current_user)],
+    limit: Annotated[int, Query(ge=1, le=settings.HISTORY_MAX_PAGE_SIZE)] = settings.HISTORY_PAGE_SIZE,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json"
+):
     chat = await Chat.get_or_none(id=chat_id, user=current_user)
     if not chat:
         raise HTTPException(status_code=404, detail=f"Chat with id: {chat_id} and this user: {current_user.username} not found")
+    # Сообщения, ещё не записанные этим процессом, должны попасть в историю
+    await message_writer.flush_chat(chat.id)
+    
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_history(chat, before, after, batch_size=limit),
+            media_type="application/x-ndjson"
+        )
+    
+    # Без курсора after отдаём последнюю страницу, листая назад от before
+    descending = after is None
+    rows = await history_page_query(chat, before, after, descending, limit=limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if descending:
+        rows.reverse()
     
-    messages = await ChatMessage.filter(chat=chat).order_by('time').all()
     formated_message = []
-    for message in messages:
-        formated_message.append({
-            "id": f"{message.id}_user",
-            "role": "user",
-            "content": message.user_message,
-            "timestamp": message.time.isoformat()
-        })
-        formated_message.append({
-            "id": f"{message.id}_assistant",
-            "role": "assistant",
-            "content": message.bot_response,
-            "timestamp": message.time.isoformat()
-        })
-    return formated_message
+    for row in rows:
+        formated_message.extend(format_history_message(row))
+    
+    return {
+        "messages": formated_message,
+        "has_more": has_more,
+        "before": encode_cursor(rows[0]["time"], rows[0]["id"]) if rows else None,
+        "after": encode_cursor(rows[-1]["time"], rows[-1]["id"]) if rows else None
+    }
  
 
 @router.patch("/rename_chat/{id}")
@@ -55,15 +138,35 @@ async def rename_user_chat(id: int, new_name: str, current_user: Annotated[dict,
         raise HTTPException(status_code=404, detail=f"Chat with id: {id} and this user: {get_current_user} not found")
     
     chat.name = new_name
-    await chat.save()
+    await chat.save(update_fields=["name"])
+    await invalidate_chat_list(current_user.id)
+    await connection_manager.send_to_user(chat.user_id, {
+        "type": "chat_renamed",
+        "chat_id": chat.id,
+        "chat_name": new_name
+    })
     
     return {"message": "chat renamed successfully", "chat_id": chat.id, "new_name": new_name}
                            
+@router.patch("/{id}/answer_cache")
+async def set_chat_answer_cache(id: int, enabled: bool, current_user: Annotated[dict, Depends(get_current_user)]):
+    """Включить или отключить ответы из семантического кеша для чата"""
+    chat = await Chat.get_or_none(id=id, user=current_user)
+    if not chat:
+        raise HTTPException(status_code=404, detail=f"Chat with id: {id} and this user: {current_user.username} not found")
+    
+    chat.answer_cache_enabled = enabled
+    await chat.save(update_fields=["answer_cache_enabled"])
+    
+    return {"chat_id": chat.id, "answer_cache_enabled": enabled}
+                           
 @router.delete("/delete_chat/{id}", status_code=204)
 async def delete_user_chat(id: int, current_user: Annotated[dict, Depends(get_current_user)]):
     chat = await Chat.get_or_none(id=id, user=current_user)
     if not chat:
         raise HTTPException(status_code=404, detail=f"Chat with id: {id} and this user: {get_current_user} not found")
     
-    await ChatMessage.filter(chat=chat).delete()
+    # Сообщения удаляются каскадно внешним ключом, несохранённые - из буфера записи
+    message_writer.discard_chat(chat.id)
     await chat.delete()
+    await invalidate_chat_list(current_user.id)
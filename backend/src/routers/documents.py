@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, HTTPException, UploadFile
+from typing import Annotated
+import os
+from src.core.config import settings
+from src.services.dependencies import get_current_user
+from src.services.user_documents import (
+    SOURCE_EXTENSIONS, delete_document, list_documents, save_document
+)
+
+router = APIRouter()
+
+def document_name(filename: str) -> str:
+    """Имя файла без каталогов; индексируются только текстовые форматы"""
+    name = os.path.basename(filename or "").strip()
+    if not name or name.startswith(".") or len(name) > 255:
+        raise HTTPException(status_code=400, detail="Invalid file name")
+    if not name.endswith(SOURCE_EXTENSIONS):
+        raise HTTPException(status_code=400, detail=f"Supported formats: {', '.join(SOURCE_EXTENSIONS)}")
+    return name
+
+@router.get("")
+async def get_user_documents(current_user: Annotated[dict, Depends(get_current_user)]):
+    """Личные документы пользователя, по которым агент ищет вместе с базой знаний"""
+    return {"documents": list_documents(current_user.id)}
+
+@router.post("")
+async def upload_user_document(file: UploadFile, current_user: Annotated[dict, Depends(get_current_user)]):
+    """Загрузить или заменить документ; индексируется только он, а не вся коллекция"""
+    name = document_name(file.filename)
+    content = await file.read(settings.USER_DOCUMENTS_MAX_FILE_SIZE + 1)
+    if len(content) > settings.USER_DOCUMENTS_MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail="File is too large")
+    try:
+        content.decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File must be UTF-8 text")
+
+    documents = list_documents(current_user.id)
+    if len(documents) >= settings.USER_DOCUMENTS_MAX_FILES and name not in {doc["name"] for doc in documents}:
+        raise HTTPException(status_code=409, detail="Too many documents")
+
+    report = await save_document(current_user.id, name, content)
+    return {"name": name, "chunks": report["chunks"]}
+
+@router.delete("/{name}", status_code=204)
+async def delete_user_document(name: str, current_user: Annotated[dict, Depends(get_current_user)]):
+    if not await delete_document(current_user.id, document_name(name)):
+        raise HTTPException(status_code=404, detail=f"Document {name} not found")
@@ -0,0 +1,27 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from tortoise import connections
+from src.services.chat import agent_status
+import logging
+
+router = APIRouter()
+
+@router.get("/health")
+async def health():
+    """Liveness: процесс жив и обрабатывает запросы"""
+    return {"status": "ok"}
+
+@router.get("/ready")
+async def ready():
+    """Readiness: база знаний и агент загружены, база данных отвечает"""
+    status = agent_status()
+    try:
+        await connections.get("default").execute_query("SELECT 1")
+        status["database"] = True
+    except Exception as e:
+        logging.error(f"Readiness database check failed: {e}")
+        status["database"] = False
+
+    is_ready = status["knowledge_base"] and status["agent"] and status["database"]
+    status["status"] = "ready" if is_ready else "starting"
+    return JSONResponse(status_code=200 if is_ready else 503, content=status)
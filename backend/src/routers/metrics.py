@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+from src.core.metrics import CONTENT_TYPE, render
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def metrics():
+    """Метрики в текстовом формате Prometheus, просуммированные по всем воркерам"""
+    return Response(render(), media_type=CONTENT_TYPE)
@@ -1,40 +1,117 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
-from fastapi.security import OAuth2PasswordBearer
-from typing import Dict, List
-from jose import jwt, JWTError
-from src.core.config import settings
-from src.models.user import User
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from src.services.dependencies import resolve_user
 from src.models.chat import Chat
-from src.models.message import ChatMessage
 from src.services.websocket_chat import WebSocketChatService
+from src.services.connections import connection_manager
+from src.core.config import settings
+from src.core.database import count_queries
+from src.core.metrics import counter, histogram
+from src.core.tracing import span, trace
+from typing import Optional
+import asyncio
 import json
 import logging
 
 router = APIRouter()
-oauth_bearer = OAuth2PasswordBearer("/auth/sign_in")
 
-# Хранилище активных WebSocket соединений
-active_connections: Dict[int, WebSocket] = {}
+websocket_rejected = counter("websocket_rejected_total", "WebSocket connections rejected by the connection cap")
+websocket_idle_reaped = counter("websocket_idle_reaped_total", "WebSocket connections closed after the idle timeout")
+websocket_heartbeat_reaped = counter("websocket_heartbeat_reaped_total", "WebSocket connections closed after a missed pong")
+websocket_oversized = counter("websocket_oversized_total", "WebSocket connections closed for an oversized message")
+chat_turn_seconds = histogram(
+    "chat_turn_seconds", "Time to process a chat message end to end",
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+)
+chat_turn_db_queries = histogram(
+    "chat_turn_db_queries", "SQL statements executed per chat message",
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+)
+
+class ConnectionClosed(Exception):
+    """Сервер закрывает соединение с указанным кодом"""
+
+    def __init__(self, code: int, reason: str):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+
+class ClientConnection():
+    """Чтение сообщений клиента с heartbeat, таймаутом простоя и лимитом размера"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.loop = asyncio.get_running_loop()
+        # last_seen - любой фрейм клиента (в том числе pong), last_active - сообщение
+        self.last_seen = self.last_active = 0.0
+
+    async def heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(settings.WS_PING_INTERVAL)
+            try:
+                await self.websocket.send_json({"type": "ping"})
+            except Exception:
+                # Соединение уже закрыто, его разберёт цикл чтения
+                return
+
+    def _deadline(self) -> Optional[float]:
+        deadlines = []
+        if settings.WS_PING_INTERVAL:
+            deadlines.append(self.last_seen + settings.WS_PING_INTERVAL + settings.WS_PONG_TIMEOUT)
+        if settings.WS_IDLE_TIMEOUT:
+            deadlines.append(self.last_active + settings.WS_IDLE_TIMEOUT)
+        return min(deadlines) if deadlines else None
+
+    async def _receive_text(self) -> str:
+        deadline = self._deadline()
+        timeout = None if deadline is None else max(deadline - self.loop.time(), 0)
+        try:
+            frame = await asyncio.wait_for(self.websocket.receive(), timeout=timeout)
+        except asyncio.TimeoutError:
+            if settings.WS_PING_INTERVAL and self.loop.time() >= self.last_seen + settings.WS_PING_INTERVAL + settings.WS_PONG_TIMEOUT:
+                websocket_heartbeat_reaped.inc()
+                raise ConnectionClosed(1001, "Heartbeat timeout")
+            websocket_idle_reaped.inc()
+            raise ConnectionClosed(1000, "Idle timeout")
+
+        if frame["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(frame.get("code", 1000))
+        self.last_seen = self.loop.time()
+
+        # Память ограничивает ws_max_size uvicorn; проверка здесь - для кода закрытия 1009
+        # при запуске без него
+        data = frame.get("text")
+        size = len(data.encode("utf-8")) if data is not None else len(frame.get("bytes") or b"")
+        if size > settings.WS_MAX_MESSAGE_SIZE:
+            websocket_oversized.inc()
+            raise ConnectionClosed(1009, "Message too big")
+        return data or ""
+
+    async def receive_message(self) -> dict:
+        """Следующее сообщение клиента; pong и некорректные фреймы пропускаются"""
+        # Пока обрабатывалось предыдущее сообщение, фреймы не читались:
+        # отсчёт простоя и ожидания pong начинается заново
+        self.last_seen = self.last_active = self.loop.time()
+        while True:
+            data = await self._receive_text()
+            try:
+                message = json.loads(data)
+            except ValueError:
+                await self.websocket.send_json({"type": "error", "message": "Некорректный формат сообщения"})
+                continue
+            if not isinstance(message, dict) or message.get("type") == "pong":
+                continue
+            return message
 
 async def get_user_from_token(token: str):
     """Получить пользователя из JWT токена для WebSocket"""
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if not username:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user = await User.filter(username=username).first()
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    return await resolve_user(token)
 
 @router.websocket("/ws/{chat_id}")
 async def websocket_endpoint(websocket: WebSocket, chat_id: int, token: str):
     """WebSocket эндпоинт для реал-тайм чата"""
     user = None
+    connected = False
+    heartbeat = None
     try:
         # Аутентификация через query параметр token
         user = await get_user_from_token(token)
@@ -46,7 +123,18 @@ async def websocket_endpoint(websocket: WebSocket, chat_id: int, token: str):
             return
             
         await websocket.accept()
-        active_connections[user.id] = websocket
+        if len(connection_manager) >= settings.WS_MAX_CONNECTIONS:
+            # 1013 Try Again Later: клиент переподключится позже или к другому воркеру
+            websocket_rejected.inc()
+            await websocket.close(code=1013, reason="Too many connections")
+            return
+        
+        # У пользователя может быть открыто несколько вкладок с одним чатом
+        await connection_manager.connect(websocket, user.id, chat_id)
+        connected = True
+        
+        async def send_to_chat(message: dict) -> None:
+            await connection_manager.send_to_chat(chat_id, message)
         
         # Отправка приветственного сообщения
         await websocket.send_json({
@@ -55,40 +143,45 @@ async def websocket_endpoint(websocket: WebSocket, chat_id: int, token: str):
             "chat_id": chat_id
         })
         
+        client = ClientConnection(websocket)
+        if settings.WS_PING_INTERVAL:
+            heartbeat = asyncio.create_task(client.heartbeat())
+        
         try:
             while True:
                 # Получение сообщения от клиента
-                data = await websocket.receive_text()
-                message_data = json.loads(data)
+                message_data = await client.receive_message()
                 
                 if message_data.get("type") == "user_message":
-                    user_message = message_data.get("message", "").strip()
-                    if not user_message:
+                    user_message = message_data.get("message")
+                    if not isinstance(user_message, str) or not user_message.strip():
                         continue
+                    user_message = user_message.strip()
                     
-                    # Отправка подтверждения получения сообщения
-                    await websocket.send_json({
+                    # Подтверждение получения видят все вкладки этого чата
+                    await send_to_chat({
                         "type": "message_received",
                         "message": user_message
                     })
                     
-                    # Обработка сообщения через WebSocketChatService
-                    try:
-                        chat_message = await WebSocketChatService.process_user_message(
-                            user_message=user_message,
-                            chat=chat,
-                            user=user,
-                            websocket_send_func=websocket.send_json
-                        )
-                        
-                        # Автоматическое обновление названия чата
-                        await WebSocketChatService.update_chat_title(chat, user_message)
-                        
-                    except Exception as e:
-                        logging.error(f"Error in WebSocket chat service: {e}")
+                    # Обработка сообщения через WebSocketChatService; название и резюме
+                    # обновляются в фоне, цикл сразу ждёт следующее сообщение
+                    with count_queries() as queries, trace("chat_turn"), span("turn", chat_turn_seconds):
+                        try:
+                            await WebSocketChatService.process_user_message(
+                                user_message=user_message,
+                                chat=chat,
+                                user=user,
+                                websocket_send_func=send_to_chat
+                            )
+                        except Exception as e:
+                            logging.error(f"Error in WebSocket chat service: {e}")
+                    chat_turn_db_queries.observe(queries.count)
                         
         except WebSocketDisconnect:
             pass
+        except ConnectionClosed as e:
+            await websocket.close(code=e.code, reason=e.reason)
             
     except Exception as e:
         logging.error(f"WebSocket connection error: {e}")
@@ -97,9 +190,11 @@ async def websocket_endpoint(websocket: WebSocket, chat_id: int, token: str):
         except:
             pass
     finally:
+        if heartbeat:
+            heartbeat.cancel()
         # Удаление из активных соединений
-        if user and user.id in active_connections:
-            del active_connections[user.id]
+        if connected:
+            connection_manager.disconnect(websocket, user.id, chat_id)
 
 @router.websocket("/ws/new")
 async def websocket_new_chat(websocket: WebSocket, token: str):
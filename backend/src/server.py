@@ -0,0 +1,319 @@
+"""
+Production запуск: python -m src.server (из корня backend).
+
+Родительский процесс один раз загружает приложение (индекс базы знаний
+и агента), открывает сокет и форкает воркеры uvicorn. Загруженные до
+fork данные воркеры делят copy-on-write, поэтому память и время старта
+не растут с числом воркеров.
+
+Сигналы родителю: SIGHUP - перечитать базу знаний и поочерёдно
+перезапустить воркеры без простоя, SIGTERM/SIGINT - остановка.
+"""
+import asyncio
+import gc
+import logging
+import math
+import os
+import select
+import shutil
+import signal
+import tempfile
+import time
+from typing import Dict, List, Optional
+import uvicorn
+from src.core.config import settings
+from src.core.prefork import METRICS_DIR_ENV, PARENT_PID_ENV
+
+def available_cpus() -> int:
+    """Доступные процессу CPU с учётом affinity и квоты cgroup"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as file:
+            quota, period = file.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+def available_memory() -> Optional[int]:
+    """Доступная память в байтах: лимит cgroup или MemAvailable"""
+    try:
+        with open("/sys/fs/cgroup/memory.max") as file:
+            limit = file.read().strip()
+        if limit != "max":
+            return int(limit)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def autotune_workers() -> int:
+    """По воркеру на CPU, но не больше, чем помещается в память"""
+    workers = available_cpus()
+    memory = available_memory()
+    if memory:
+        workers = min(workers, memory // (settings.WEB_WORKER_MEMORY_MB * 1024 * 1024))
+    return max(1, workers)
+
+def resolve_workers() -> int:
+    """
+    Число воркеров. События между воркерами (вкладки чата, сброс кешей
+    авторизации и списка чатов) идут через REDIS_URL, без него - один воркер
+    """
+    if not settings.REDIS_URL:
+        if settings.WEB_WORKERS > 1:
+            raise ValueError("WEB_WORKERS > 1 needs REDIS_URL: without a broker events stay inside one worker")
+        return 1
+    return settings.WEB_WORKERS or autotune_workers()
+
+class WorkerServer(uvicorn.Server):
+    """uvicorn в воркере: сообщает родителю о готовности принимать запросы"""
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None) -> None:
+        await super().startup(sockets=sockets)
+        if self.started:
+            os.write(self.ready_fd, b"1")
+        os.close(self.ready_fd)
+
+class Arbiter():
+    """Родительский процесс: запускает воркеры, перезапускает упавшие и по SIGHUP"""
+
+    def __init__(self, config: uvicorn.Config, workers: int):
+        self.config = config
+        self.workers = workers
+        self.sockets = []
+        self.children: Dict[int, float] = {}
+        self.running = True
+        self.reload = False
+
+    def spawn(self) -> int:
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            # Обработчики родителя воркеру не нужны, uvicorn ставит свои
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            code = 0
+            try:
+                WorkerServer(self.config, ready_w).run(sockets=self.sockets)
+            except BaseException as e:
+                logging.exception(f"Worker {os.getpid()} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+
+        os.close(ready_w)
+        self.children[pid] = time.monotonic()
+        ready = self.wait_ready(ready_r)
+        os.close(ready_r)
+        logging.info(f"Worker {pid} {'started' if ready else 'did not report readiness'}")
+        return pid
+
+    def wait_ready(self, fd: int) -> bool:
+        deadline = time.monotonic() + settings.WEB_GRACEFUL_TIMEOUT
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return False
+            try:
+                readable, _, _ = select.select([fd], [], [], timeout)
+            except InterruptedError:
+                continue
+            # Пустое чтение - воркер завершился, не успев стартовать
+            return bool(readable) and os.read(fd, 1) == b"1"
+
+    def stop(self, pids: List[int]) -> None:
+        """SIGTERM и ожидание завершения; не успевшие за WEB_GRACEFUL_TIMEOUT - SIGKILL"""
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + settings.WEB_GRACEFUL_TIMEOUT
+        remaining = set(pids)
+        while remaining:
+            for pid in list(remaining):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    remaining.discard(pid)
+                    self.children.pop(pid, None)
+                    forget_worker_metrics(pid)
+            if remaining and time.monotonic() > deadline:
+                for pid in remaining:
+                    logging.warning(f"Worker {pid} did not stop in time, killing")
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                deadline = float("inf")
+            time.sleep(0.1)
+
+    def reap(self) -> None:
+        """Подобрать завершившиеся воркеры и запустить замену"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            started = self.children.pop(pid, None)
+            if started is None:
+                continue
+            forget_worker_metrics(pid)
+            logging.warning(f"Worker {pid} exited with status {status}")
+            if self.running:
+                # Не перезапускаем в цикле воркер, падающий сразу при старте
+                if time.monotonic() - started < 1.0:
+                    time.sleep(1.0)
+                self.spawn()
+
+    def rolling_restart(self) -> None:
+        """Новая копия базы знаний и поочерёдная замена воркеров"""
+        logging.info("Rolling restart")
+        try:
+            refresh_preloaded()
+        except Exception as e:
+            logging.error(f"Failed to refresh knowledge base, restarting with the current one: {e}")
+        for pid in list(self.children):
+            # Новый воркер стартует до остановки старого, сокет не простаивает
+            self.spawn()
+            self.stop([pid])
+
+    def run(self) -> None:
+        self.sockets = [self.config.bind_socket()]
+        os.environ[PARENT_PID_ENV] = str(os.getpid())
+
+        def on_stop(signum, frame):
+            self.running = False
+
+        def on_reload(signum, frame):
+            self.reload = True
+
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+        signal.signal(signal.SIGHUP, on_reload)
+
+        logging.info(f"Starting {self.workers} workers on {self.config.host}:{self.config.port}")
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.running:
+            if self.reload:
+                self.reload = False
+                self.rolling_restart()
+            self.reap()
+            time.sleep(0.5)
+
+        logging.info("Stopping workers")
+        self.stop(list(self.children))
+        for sock in self.sockets:
+            sock.close()
+
+async def prepare_database() -> None:
+    """
+    Схема и индекс поиска - один раз до fork: воркеры стартуют одновременно,
+    и DDL в каждом из них мешал бы друг другу. В воркерах те же шаги уже ничего не меняют
+    """
+    from src.core.database import init_db, close_db
+    from src.services.chat_search import ensure_search_index
+
+    await init_db()
+    try:
+        await ensure_search_index()
+    finally:
+        await close_db()
+
+def preload():
+    """Загрузка приложения в родителе: схема БД, индекс и агент - до fork"""
+    from src.main import app
+    from src.services.chat import init_agent
+
+    asyncio.run(prepare_database())
+    asyncio.run(init_agent())
+    return app
+
+def refresh_preloaded() -> None:
+    from src.services.chat import get_knowledge_base
+    from src.utils.ingestion import sync_knowledge_base
+
+    async def refresh() -> None:
+        await sync_knowledge_base(await get_knowledge_base())
+
+    asyncio.run(refresh())
+    gc.collect()
+    gc.freeze()
+
+def prepare_metrics() -> Optional[str]:
+    """
+    Каталог, через который воркеры складывают метрики. Задаётся до импорта
+    prometheus_client: хранилище значений выбирается при импорте.
+    Возвращает каталог, если он создан здесь и его нужно удалить при остановке
+    """
+    path = os.environ.get(METRICS_DIR_ENV)
+    if not path:
+        path = tempfile.mkdtemp(prefix="deepchat-metrics-")
+        os.environ[METRICS_DIR_ENV] = path
+        return path
+    # Файлы прошлого запуска попали бы в сумму
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith(".db"):
+            os.remove(os.path.join(path, name))
+    return None
+
+def forget_worker_metrics(pid: int) -> None:
+    """Убрать завершившийся воркер из суммы gauge-метрик"""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(pid)
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    metrics_dir = prepare_metrics()
+
+    from src.services.message_writer import check_workers
+
+    workers = resolve_workers()
+    check_workers(settings.MESSAGE_PERSISTENCE, workers, settings.DATABASE_URL)
+    app = preload()
+
+    # Объекты, созданные до fork, не трогает сборщик мусора в воркерах,
+    # иначе страницы с ними перестают быть общими
+    gc.collect()
+    gc.freeze()
+
+    config = uvicorn.Config(
+        app,
+        host=settings.WEB_HOST,
+        port=settings.WEB_PORT,
+        proxy_headers=True,
+        # Фрейм больше лимита отклоняет сам uvicorn, не читая его в память целиком
+        ws_max_size=settings.WS_MAX_MESSAGE_SIZE,
+        log_level="info"
+    )
+    try:
+        Arbiter(config, workers).run()
+    finally:
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
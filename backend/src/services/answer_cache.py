@@ -0,0 +1,111 @@
+import hashlib
+import json
+import time
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from src.core.config import settings
+from src.core.metrics import counter, gauge
+
+answer_cache_hits = counter("answer_cache_hits_total", "Chat turns answered from the semantic cache")
+answer_cache_misses = counter("answer_cache_misses_total", "Chat turns that missed the semantic cache")
+answer_cache_size = gauge("answer_cache_entries", "Entries in the semantic answer cache")
+
+def context_fingerprint(user_id: int, chat_history: List[Dict[str, str]]) -> str:
+    """
+    Отпечаток контекста ответа. Первый ход чата (без истории и резюме) при
+    ANSWER_CACHE_SHARED общий для всех пользователей: ответ зависит только
+    от текста сообщения и общей базы знаний (с личными документами кеш
+    не используется). Похожий первый вопрос другого пользователя получает
+    этот ответ, и в нём могут быть пересказаны детали исходного сообщения.
+    Дальше ответ опирается на рассказанное пользователем и переиспользуется
+    только им самим при том же контексте
+    """
+    if not chat_history and settings.ANSWER_CACHE_SHARED:
+        return "first-turn"
+    raw = json.dumps([user_id, chat_history], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class AnswerCache():
+    """
+    Небольшой локальный векторный индекс ответов агента.
+    Сообщение ищется среди записей с тем же отпечатком (см. context_fingerprint) по косинусной
+    близости; записи живут ANSWER_CACHE_TTL секунд, при переполнении
+    вытесняется давно не использованная
+    """
+
+    def __init__(self, max_size: int, ttl: float, threshold: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.vectors: Optional[np.ndarray] = None
+        self.answers: List[Optional[str]] = [None] * max_size
+        self.fingerprints: List[Optional[str]] = [None] * max_size
+        # Отпечаток -> его слоты: поиск не перебирает весь кеш
+        self.slots: Dict[str, Set[int]] = {}
+        self.created = np.zeros(max_size)
+        self.last_used = np.zeros(max_size)
+
+    def _valid(self) -> np.ndarray:
+        return self.created > time.time() - self.ttl
+
+    async def embed(self, message: str) -> np.ndarray:
+        from src.utils.vector_store import get_embeddings
+        vector = np.asarray((await get_embeddings().aembed_queries([message]))[0], dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, vector: np.ndarray, fingerprint: str) -> Optional[str]:
+        best = None
+        if self.vectors is not None:
+            slots = np.fromiter(self.slots.get(fingerprint, ()), dtype=np.int64)
+            candidates = slots[self.created[slots] > time.time() - self.ttl]
+            if len(candidates):
+                scores = self.vectors[candidates] @ vector
+                i = int(np.argmax(scores))
+                if scores[i] >= self.threshold:
+                    best = int(candidates[i])
+
+        if best is None:
+            answer_cache_misses.inc()
+            return None
+        answer_cache_hits.inc()
+        self.last_used[best] = time.time()
+        return self.answers[best]
+
+    def store(self, vector: np.ndarray, fingerprint: str, answer: str) -> None:
+        if self.vectors is None:
+            self.vectors = np.zeros((self.max_size, len(vector)), dtype=np.float32)
+
+        # Свободный или просроченный слот, иначе - давно не использованный
+        expired = np.flatnonzero(~self._valid())
+        slot = int(expired[0]) if len(expired) else int(np.argmin(self.last_used))
+
+        previous = self.fingerprints[slot]
+        if previous is not None:
+            self.slots[previous].discard(slot)
+            if not self.slots[previous]:
+                del self.slots[previous]
+        self.slots.setdefault(fingerprint, set()).add(slot)
+
+        now = time.time()
+        self.vectors[slot] = vector
+        self.answers[slot] = answer
+        self.fingerprints[slot] = fingerprint
+        self.created[slot] = now
+        self.last_used[slot] = now
+        answer_cache_size.set(int(self._valid().sum()))
+
+answer_cache = AnswerCache(
+    max_size=settings.ANSWER_CACHE_SIZE,
+    ttl=settings.ANSWER_CACHE_TTL,
+    threshold=settings.ANSWER_CACHE_THRESHOLD
+)
+
+async def lookup_answer(
+    user_id: int,
+    message: str,
+    chat_history: List[Dict[str, str]]
+) -> Tuple[Optional[str], np.ndarray, str]:
+    """Ответ из кеша (или None), а также вектор и отпечаток для последующего store"""
+    fingerprint = context_fingerprint(user_id, chat_history)
+    vector = await answer_cache.embed(message)
+    return answer_cache.lookup(vector, fingerprint), vector, fingerprint
@@ -0,0 +1,138 @@
+"""
+Фоновые задачи после хода чата (название чата, резюме): цикл WebSocket
+не ждёт их и сразу читает следующее сообщение пользователя
+"""
+import asyncio
+import contextvars
+import logging
+import time
+import weakref
+from typing import Any, Awaitable, Callable, List, NamedTuple, Optional, Set
+from src.core.config import settings
+from src.core.metrics import counter, gauge, histogram
+
+background_queued = gauge("background_tasks_queued", "Background tasks waiting for a worker")
+background_running = gauge("background_tasks_running", "Background tasks currently running")
+background_completed = counter("background_tasks_completed_total", "Background tasks finished successfully", labelnames=("task",))
+background_failed = counter("background_tasks_failed_total", "Background tasks failed after all retries", labelnames=("task",))
+background_retried = counter("background_tasks_retried_total", "Background task attempts retried after an error", labelnames=("task",))
+background_coalesced = counter("background_tasks_coalesced_total", "Background tasks merged into an identical queued task")
+background_dropped = counter("background_tasks_dropped_total", "Background tasks dropped because the queue is full or closed")
+background_task_seconds = histogram("background_task_seconds", "Time to run a background task", labelnames=("task",))
+
+class Job(NamedTuple):
+    name: str
+    key: Optional[str]
+    factory: Callable[[], Awaitable[Any]]
+
+class BackgroundTasks():
+    """
+    Очередь задач процесса с ограниченным числом обработчиков.
+    Задача - фабрика корутины (повторная попытка создаёт корутину заново);
+    при ошибке повторяется с экспоненциальной задержкой. Задачи с одним key
+    выполняются по очереди, а новая задача объединяется с ещё не начатой
+    задачей с тем же key
+    """
+
+    def __init__(self, workers: int, max_queue: int, retries: int, retry_delay: float, timeout: float):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._pending: Set[str] = set()
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._closing = False
+
+    def _ensure_started(self) -> None:
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        # Обработчики не наследуют контекст хода чата, из которого их запустили
+        # (счётчик SQL запросов, трассировку)
+        self._tasks = [
+            contextvars.Context().run(asyncio.get_running_loop().create_task, self._worker())
+            for _ in range(self.workers)
+        ]
+
+    def submit(self, name: str, factory: Callable[[], Awaitable[Any]], key: Optional[str] = None) -> bool:
+        """Поставить задачу в очередь, не дожидаясь её; False - очередь переполнена"""
+        if self._closing:
+            background_dropped.inc()
+            return False
+        self._ensure_started()
+        if key is not None and key in self._pending:
+            background_coalesced.inc()
+            return True
+        try:
+            self._queue.put_nowait(Job(name, key, factory))
+        except asyncio.QueueFull:
+            background_dropped.inc()
+            logging.warning(f"Background queue is full, task {name} dropped")
+            return False
+        if key is not None:
+            self._pending.add(key)
+        background_queued.set(self._queue.qsize())
+        return True
+
+    async def _run(self, job: Job) -> None:
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(job.factory(), timeout=self.timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == self.retries:
+                    background_failed.labels(job.name).inc()
+                    logging.error(f"Background task {job.name} failed: {e!r}")
+                    return
+                background_retried.labels(job.name).inc()
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+            else:
+                background_task_seconds.labels(job.name).observe(time.perf_counter() - started)
+                background_completed.labels(job.name).inc()
+                return
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            if job.key is not None:
+                self._pending.discard(job.key)
+            background_queued.set(self._queue.qsize())
+            background_running.inc()
+            try:
+                if job.key is None:
+                    await self._run(job)
+                else:
+                    lock = self._locks.get(job.key)
+                    if lock is None:
+                        lock = self._locks[job.key] = asyncio.Lock()
+                    async with lock:
+                        await self._run(job)
+            finally:
+                background_running.dec()
+                self._queue.task_done()
+
+    async def drain(self, timeout: float) -> None:
+        """Остановка: новые задачи не принимаются, поставленные дорабатываются не дольше timeout"""
+        self._closing = True
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Background tasks not finished on shutdown: {self._queue.qsize()} queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+background_tasks = BackgroundTasks(
+    workers=settings.BACKGROUND_WORKERS,
+    max_queue=settings.BACKGROUND_QUEUE_SIZE,
+    retries=settings.BACKGROUND_RETRIES,
+    retry_delay=settings.BACKGROUND_RETRY_DELAY,
+    timeout=settings.BACKGROUND_TASK_TIMEOUT
+)
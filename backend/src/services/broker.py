@@ -0,0 +1,90 @@
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+class Broker():
+    """
+    Рассылка событий между воркерами: publish отправляет событие,
+    подписчики всех воркеров (включая текущий) получают его в handler
+    """
+
+    async def start(self, handler: Handler) -> None:
+        raise NotImplementedError
+
+    async def publish(self, event: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+class InMemoryBroker(Broker):
+    """Брокер в пределах одного процесса (один воркер, тесты)"""
+
+    def __init__(self):
+        self._handlers: List[Handler] = []
+
+    async def start(self, handler: Handler) -> None:
+        self._handlers.append(handler)
+
+    async def publish(self, event: Dict[str, Any]) -> None:
+        for handler in self._handlers:
+            await handler(event)
+
+    async def close(self) -> None:
+        self._handlers.clear()
+
+class RedisBroker(Broker):
+    """Redis pub/sub: один канал на все воркеры и узлы"""
+
+    def __init__(self, url: str, channel: str):
+        # redis нужен только при горизонтальном масштабировании
+        import redis.asyncio as redis
+
+        self.channel = channel
+        self._client = redis.from_url(url)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler: Handler) -> None:
+        self._task = asyncio.create_task(self._listen(handler))
+
+    async def _listen(self, handler: Handler) -> None:
+        while True:
+            pubsub = self._client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    try:
+                        await handler(json.loads(message["data"]))
+                    except Exception as e:
+                        logging.error(f"Failed to handle broker event: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Переподключаемся после потери соединения с Redis
+                logging.error(f"Redis subscription failed: {e}")
+                await asyncio.sleep(1.0)
+            finally:
+                await pubsub.aclose()
+
+    async def publish(self, event: Dict[str, Any]) -> None:
+        await self._client.publish(self.channel, json.dumps(event, ensure_ascii=False))
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self._client.aclose()
+
+def create_broker(url: str, channel: str) -> Broker:
+    """Redis, если задан REDIS_URL, иначе брокер в памяти процесса"""
+    if url:
+        return RedisBroker(url, channel)
+    return InMemoryBroker()
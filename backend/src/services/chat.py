@@ -1,16 +1,96 @@
-from src.utils.document import doc
-from src.utils.vector_store import create_vectore_store
-from src.utils.agent import create_agent
-
-vector_store = create_vectore_store(doc)
-agent = create_agent(vector_store)
-
-async def process_chat(message: str, chat_history: list) -> str:
-    result = await agent.ainvoke(
-       {
-           "messages": [("human", message)]
-       }
-    )
+from typing import AsyncIterator, Optional
+import asyncio
+import importlib
+import logging
+import time
+from src.core.metrics import counter
+from src.core.tracing import stage
+from src.services.user_documents import user_collections
+
+llm_input_tokens = counter("llm_input_tokens_total", "Prompt tokens sent to the model (including tool rounds)")
+llm_output_tokens = counter("llm_output_tokens_total", "Completion tokens generated by the model")
+
+# Индекс и агент создаются при старте приложения (lifespan) или при первом
+# обращении; LangChain импортируется только здесь, а не при импорте модулей
+knowledge_base = None
+agent = None
+_init_task: Optional[asyncio.Task] = None
+_init_error: Optional[str] = None
+
+async def _init() -> None:
+    global knowledge_base, agent, _init_error
+    started = time.monotonic()
+    # Импорт LangChain занимает секунды - не блокируем event loop
+    ingestion = await asyncio.to_thread(importlib.import_module, "src.utils.ingestion")
+    agent_module = await asyncio.to_thread(importlib.import_module, "src.utils.agent")
+
+    loaded_knowledge_base, _ = await ingestion.sync_knowledge_base()
+    agent = await asyncio.to_thread(agent_module.create_agent, loaded_knowledge_base, user_collections.get)
+    knowledge_base = loaded_knowledge_base
+    _init_error = None
+    logging.info(f"Agent ready in {time.monotonic() - started:.1f}s ({len(knowledge_base)} chunks)")
+
+async def init_agent() -> None:
+    """Загрузить базу знаний и создать агента (один раз, повторно после ошибки)"""
+    global _init_task, _init_error
+    if agent is not None:
+        return
+    if _init_task is None:
+        _init_task = asyncio.create_task(_init())
+    task = _init_task
+    try:
+        await asyncio.shield(task)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        _init_error = str(e)
+        raise
+    finally:
+        if task.done() and _init_task is task:
+            _init_task = None
+
+def cancel_init() -> None:
+    if _init_task is not None:
+        _init_task.cancel()
+
+def agent_status() -> dict:
+    return {
+        "knowledge_base": knowledge_base is not None,
+        "agent": agent is not None,
+        "chunks": len(knowledge_base) if knowledge_base is not None else 0,
+        "error": _init_error
+    }
+
+async def get_knowledge_base():
+    await init_agent()
+    return knowledge_base
+
+def _build_messages(message: str, chat_history: list) -> list:
+    """История (резюме + последние реплики) и новое сообщение пользователя"""
+    return [*chat_history, {"role": "user", "content": message}]
+
+def _run_config(user_id: Optional[int]) -> dict:
+    """Пользователь запуска: инструмент поиска добавит его коллекцию документов"""
+    return {"configurable": {"user_id": user_id}}
+
+def _count_usage(message) -> None:
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        llm_input_tokens.inc(usage.get("input_tokens", 0))
+        llm_output_tokens.inc(usage.get("output_tokens", 0))
+
+async def process_chat(message: str, chat_history: list, user_id: Optional[int] = None) -> str:
+    await init_agent()
+    with stage("llm"):
+        result = await agent.ainvoke(
+           {
+               "messages": _build_messages(message, chat_history)
+           },
+           config=_run_config(user_id)
+        )
+    if isinstance(result, dict):
+        for msg in result.get("messages", []):
+            _count_usage(msg)
     
     # В новой версии langchain ответ может быть в разных форматах
     if isinstance(result, dict):
@@ -26,3 +106,38 @@ async def process_chat(message: str, chat_history: list) -> str:
             return result["output"]
     
     return str(result)
+
+def _chunk_text(chunk) -> str:
+    """Текст из чанка модели (content может быть строкой или списком блоков)"""
+    if isinstance(chunk.content, str):
+        return chunk.content
+    return "".join(
+        block.get("text", "") if isinstance(block, dict) else str(block)
+        for block in chunk.content
+    )
+
+async def stream_chat(message: str, chat_history: list, user_id: Optional[int] = None) -> AsyncIterator[str]:
+    """Потоковая генерация ответа агента: отдаёт токены по мере поступления"""
+    from langchain_core.messages import AIMessageChunk
+    
+    await init_agent()
+    async for chunk, metadata in agent.astream(
+        {
+            "messages": _build_messages(message, chat_history)
+        },
+        config=_run_config(user_id),
+        stream_mode="messages"
+    ):
+        # Пропускаем вывод инструментов и чанки с вызовами инструментов
+        if metadata.get("langgraph_node") != "model":
+            continue
+        if not isinstance(chunk, AIMessageChunk):
+            continue
+        # Расход токенов приходит последним чанком каждого вызова модели
+        _count_usage(chunk)
+        if chunk.tool_call_chunks:
+            continue
+
+        text = _chunk_text(chunk)
+        if text:
+            yield text
@@ -0,0 +1,75 @@
+from typing import Dict, Optional, Set, Tuple
+from tortoise.expressions import Q
+from src.core.config import settings
+from src.core.metrics import counter
+from src.models.chat import Chat
+from src.services.connections import connection_manager
+from src.utils.cache import TTLCache
+from src.utils.pagination import encode_cursor, decode_time_cursor
+
+# Страницы списка чатов по (user_id, limit, before). Запись сбрасывается во всех
+# воркерах при новом сообщении, переименовании, создании и удалении чата;
+# без REDIS_URL в остальных воркерах живёт не дольше CHAT_LIST_CACHE_TTL
+_page_cache = TTLCache(maxsize=settings.CHAT_LIST_CACHE_SIZE, ttl=settings.CHAT_LIST_CACHE_TTL)
+_user_pages: Dict[int, Set[Tuple[int, int, Optional[str]]]] = {}
+# Номер сброса на пользователя: страница, прочитанная до сброса, не кешируется
+_generations: Dict[int, int] = {}
+
+chat_list_cache_hits = counter("chat_list_cache_hits_total", "Chat list pages served from cache")
+chat_list_cache_misses = counter("chat_list_cache_misses_total", "Chat list pages loaded from the database")
+
+def make_preview(text: str) -> str:
+    """Начало сообщения для списка чатов"""
+    text = " ".join(text.split())
+    limit = min(settings.CHAT_PREVIEW_LENGTH, 255)
+    if len(text) <= limit:
+        return text
+    return text[:limit - 3].rstrip() + "..."
+
+async def list_chats(user_id: int, limit: int, before: Optional[str] = None) -> dict:
+    """
+    Страница чатов пользователя по убыванию последней активности одним запросом:
+    счётчики и превью хранятся в самой строке чата
+    """
+    key = (user_id, limit, before)
+    page = _page_cache.get(key)
+    if page is not None:
+        chat_list_cache_hits.inc()
+        return page
+    chat_list_cache_misses.inc()
+    generation = _generations.get(user_id, 0)
+
+    query = Chat.filter(user_id=user_id)
+    if before:
+        time, id = decode_time_cursor(before)
+        query = query.filter(Q(last_activity_at__lt=time) | Q(last_activity_at=time, id__lt=id))
+    rows = await query.order_by("-last_activity_at", "-id").limit(limit + 1).values(
+        "id", "name", "message_count", "last_message_at", "last_message_preview", "last_activity_at"
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    page = {
+        "chats": rows,
+        "has_more": has_more,
+        "next": encode_cursor(rows[-1]["last_activity_at"], rows[-1]["id"]) if has_more else None
+    }
+
+    if _generations.get(user_id, 0) != generation:
+        return page
+    _page_cache.set(key, page)
+    # Заодно забываем страницы, уже вытесненные из кеша
+    keys = {k for k in _user_pages.get(user_id, ()) if k in _page_cache}
+    keys.add(key)
+    _user_pages[user_id] = keys
+    return page
+
+def forget_chat_list(user_id: int) -> None:
+    _generations[user_id] = _generations.get(user_id, 0) + 1
+    for key in _user_pages.pop(user_id, set()):
+        _page_cache.pop(key)
+
+async def invalidate_chat_list(user_id: int) -> None:
+    """Сбросить закешированные страницы списка чатов пользователя во всех воркерах"""
+    await connection_manager.broadcast("chat_list", {"user_id": user_id})
+
+connection_manager.subscribe("chat_list", lambda message: forget_chat_list(message["user_id"]))
@@ -0,0 +1,249 @@
+"""
+Полнотекстовый поиск по сообщениям пользователя.
+
+Postgres: столбец tsvector (русская морфология, вопрос пользователя с большим
+весом, чем ответ), вычисляемый при вставке, и GIN индекс по нему.
+SQLite (локальный запуск и тесты): таблица FTS5 поверх chatmessages,
+которую ведут триггеры. В обоих случаях ищутся все термины запроса
+по префиксу основы слова, операторы из пользовательского ввода не действуют
+"""
+import html
+import logging
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+from fastapi import HTTPException
+from tortoise import connections
+from tortoise.transactions import in_transaction
+from src.core.config import settings
+from src.core.schema import UPGRADE_LOCK_KEY
+from src.utils.pagination import decode_cursor, encode_cursor
+
+# Границы совпадений во фрагментах: текст экранируется, затем они становятся <mark>
+MARK_START = "\ue000"
+MARK_END = "\ue001"
+
+_dialect: Optional[str] = None
+
+POSTGRES_SCHEMA = """
+ALTER TABLE chatmessages ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', user_message), 'A') ||
+        setweight(to_tsvector('russian', bot_response), 'B')
+    ) STORED;
+CREATE INDEX IF NOT EXISTS chatmessages_search_idx ON chatmessages USING GIN (search_vector);
+"""
+
+SQLITE_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS chatmessages_fts USING fts5(
+    user_message, bot_response, content='chatmessages', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS chatmessages_fts_insert AFTER INSERT ON chatmessages BEGIN
+    INSERT INTO chatmessages_fts(rowid, user_message, bot_response)
+    VALUES (new.id, new.user_message, new.bot_response);
+END;
+CREATE TRIGGER IF NOT EXISTS chatmessages_fts_delete AFTER DELETE ON chatmessages BEGIN
+    INSERT INTO chatmessages_fts(chatmessages_fts, rowid, user_message, bot_response)
+    VALUES ('delete', old.id, old.user_message, old.bot_response);
+END;
+CREATE TRIGGER IF NOT EXISTS chatmessages_fts_update AFTER UPDATE OF user_message, bot_response ON chatmessages BEGIN
+    INSERT INTO chatmessages_fts(chatmessages_fts, rowid, user_message, bot_response)
+    VALUES ('delete', old.id, old.user_message, old.bot_response);
+    INSERT INTO chatmessages_fts(rowid, user_message, bot_response)
+    VALUES (new.id, new.user_message, new.bot_response);
+END;
+"""
+
+# Сначала ранжирование и страница, затем фрагменты - только для строк страницы.
+# ts_headline разбирает HTML теги во входном тексте и выбрасывает их, поэтому
+# текст экранируется до него (сущности парсер оставляет как есть)
+POSTGRES_ESCAPE = "replace(replace(replace({}, '&', '&amp;'), '<', '&lt;'), '>', '&gt;')"
+
+# Запрос из слов текста по префиксу основы. Слова выделяет тот же парсер, что
+# и при индексации (числа со знаком, десятичные, части слов через дефис);
+# основа snowball у формы из запроса бывает короче, чем у той же формы в тексте
+# (экзамен -> экзам, экзаменом -> экзамен), поэтому точное совпадение основ не годится
+POSTGRES_QUERY = """
+SELECT string_agg(quote_literal(token) || ':*', ' & ') FROM (
+    SELECT token FROM ts_debug('russian', $2)
+    WHERE array_length(lexemes, 1) > 0 AND alias NOT IN ('asciihword', 'hword', 'numhword')
+    LIMIT $8
+) terms
+"""
+
+POSTGRES_SEARCH = f"""
+SELECT page.id, page.chat_id, chats.name AS chat_name, page.time, page.score,
+       ts_headline('russian', {POSTGRES_ESCAPE.format("page.user_message")}, page.q, $3) AS user_message,
+       ts_headline('russian', {POSTGRES_ESCAPE.format("page.bot_response")}, page.q, $3) AS bot_response
+FROM (
+    SELECT * FROM (
+        SELECT m.id, m.chat_id, m.time, m.user_message, m.bot_response, q,
+               ts_rank_cd(m.search_vector, q) AS score
+        FROM chatmessages m, to_tsquery('russian', ({POSTGRES_QUERY})) AS q
+        WHERE m.user_id = $1 AND m.search_vector @@ q AND ($4::int IS NULL OR m.chat_id = $4)
+    ) ranked
+    WHERE $5::real IS NULL OR score < $5 OR (score = $5 AND id < $6)
+    ORDER BY score DESC, id DESC
+    LIMIT $7
+) page
+JOIN chats ON chats.id = page.chat_id
+ORDER BY page.score DESC, page.id DESC
+"""
+
+SQLITE_SEARCH = """
+SELECT page.*, chats.name AS chat_name
+FROM (
+    SELECT * FROM (
+        SELECT m.id, m.chat_id, m.time, -bm25(chatmessages_fts, 2.0, 1.0) AS score,
+               snippet(chatmessages_fts, 0, ?, ?, '…', 24) AS user_message,
+               snippet(chatmessages_fts, 1, ?, ?, '…', 24) AS bot_response
+        FROM chatmessages_fts JOIN chatmessages m ON m.id = chatmessages_fts.rowid
+        WHERE chatmessages_fts MATCH ? AND m.user_id = ? AND (? IS NULL OR m.chat_id = ?)
+    ) ranked
+    WHERE ? IS NULL OR score < ? OR (score = ? AND id < ?)
+    ORDER BY score DESC, id DESC
+    LIMIT ?
+) page
+JOIN chats ON chats.id = page.chat_id
+ORDER BY page.score DESC, page.id DESC
+"""
+
+HEADLINE_OPTIONS = (
+    f"StartSel={MARK_START}, StopSel={MARK_END}, MaxWords=35, MinWords=15, "
+    "MaxFragments=2, FragmentDelimiter=\" … \""
+)
+
+POSTGRES_CHECK = """
+SELECT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = 'chatmessages' AND column_name = 'search_vector'
+) AND EXISTS (
+    SELECT 1 FROM pg_indexes
+    WHERE schemaname = current_schema() AND indexname = 'chatmessages_search_idx'
+) AS ready
+"""
+
+SQLITE_OBJECTS = ("chatmessages_fts", "chatmessages_fts_insert", "chatmessages_fts_delete", "chatmessages_fts_update")
+
+async def _search_index_ready(connection, dialect: str) -> bool:
+    if dialect == "postgres":
+        rows = await connection.execute_query_dict(POSTGRES_CHECK)
+        return bool(rows[0]["ready"])
+    _, rows = await connection.execute_query(
+        f"SELECT COUNT(*) FROM sqlite_master WHERE name IN ({', '.join('?' * len(SQLITE_OBJECTS))})",
+        list(SQLITE_OBJECTS)
+    )
+    return rows[0][0] == len(SQLITE_OBJECTS)
+
+async def ensure_search_index() -> None:
+    """Создать индекс поиска, если его ещё нет (вызывается после generate_schemas)"""
+    global _dialect
+    connection = connections.get("default")
+    dialect = connection.capabilities.dialect
+    if dialect not in ("postgres", "sqlite"):
+        logging.warning(f"Chat search is not supported for {dialect}")
+        return
+    try:
+        if dialect == "postgres":
+            # Воркеры и узлы стартуют одновременно: DDL под тем же замком, что и обновление схемы
+            async with in_transaction() as transaction:
+                await transaction.execute_query("SELECT pg_advisory_xact_lock($1)", [UPGRADE_LOCK_KEY])
+                await transaction.execute_script(POSTGRES_SCHEMA)
+        else:
+            _, rows = await connection.execute_query(
+                "SELECT name FROM sqlite_master WHERE name = 'chatmessages_fts'"
+            )
+            await connection.execute_script(SQLITE_SCHEMA)
+            if not rows:
+                # Индекс по сообщениям, сохранённым до его появления
+                await connection.execute_script(
+                    "INSERT INTO chatmessages_fts(chatmessages_fts) VALUES ('rebuild');"
+                )
+    except Exception as e:
+        logging.warning(f"Chat search index setup failed: {e}")
+    try:
+        ready = await _search_index_ready(connection, dialect)
+    except Exception as e:
+        logging.error(f"Failed to check chat search index: {e}")
+        ready = False
+    if not ready:
+        logging.error("Chat search index is missing, /chat/search is disabled")
+        return
+    _dialect = dialect
+
+def fts5_query(text: str) -> str:
+    """
+    Запрос FTS5: все термины по префиксу основы (тем же грубым стеммингом,
+    что и BM25 базы знаний), без операторов из пользовательского ввода
+    """
+    from src.utils.lexical_index import stem
+    terms = re.findall(r"\w+", text.lower())[:settings.CHAT_SEARCH_MAX_TERMS]
+    return " ".join(f'"{stem(term)}"*' for term in terms)
+
+def highlight(fragment: Optional[str], escaped: bool = False) -> str:
+    """Фрагмент как HTML: текст экранирован, совпадения в <mark>"""
+    text = fragment or ""
+    if not escaped:
+        text = html.escape(text)
+    return text.replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+def decode_score_cursor(cursor: str) -> Tuple[float, int]:
+    values = decode_cursor(cursor)
+    try:
+        score, id = values
+        return float(score), int(id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _as_datetime(value) -> datetime:
+    # SQLite возвращает время строкой
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+async def search_messages(
+    user_id: int,
+    text: str,
+    limit: int,
+    before: Optional[str] = None,
+    chat_id: Optional[int] = None
+) -> dict:
+    """
+    Сообщения пользователя по убыванию релевантности (при равной - новые выше)
+    с подсвеченными фрагментами; следующая страница - по курсору next
+    """
+    if _dialect is None:
+        raise HTTPException(status_code=503, detail="Search is not available")
+    score, id = decode_score_cursor(before) if before else (None, None)
+    if not re.search(r"\w", text):
+        return {"results": [], "has_more": False, "next": None}
+    connection = connections.get("default")
+
+    if _dialect == "postgres":
+        rows = await connection.execute_query_dict(POSTGRES_SEARCH, [
+            user_id, text, HEADLINE_OPTIONS, chat_id, score, id, limit + 1, settings.CHAT_SEARCH_MAX_TERMS
+        ])
+    else:
+        rows = await connection.execute_query_dict(SQLITE_SEARCH, [
+            MARK_START, MARK_END, MARK_START, MARK_END, fts5_query(text), user_id, chat_id, chat_id,
+            score, score, score, id, limit + 1
+        ])
+    escaped = _dialect == "postgres"
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    results: List[dict] = [
+        {
+            "message_id": row["id"],
+            "chat_id": row["chat_id"],
+            "chat_name": row["chat_name"],
+            "timestamp": _as_datetime(row["time"]).isoformat(),
+            "score": row["score"],
+            "user_message": highlight(row["user_message"], escaped),
+            "bot_response": highlight(row["bot_response"], escaped)
+        }
+        for row in rows
+    ]
+    return {
+        "results": results,
+        "has_more": has_more,
+        "next": encode_cursor(rows[-1]["score"], rows[-1]["id"]) if has_more else None
+    }
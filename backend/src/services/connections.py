@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+from fastapi import WebSocket
+from src.core.config import settings
+from src.core.metrics import gauge
+from src.services.broker import Broker, create_broker
+
+websocket_connections = gauge("websocket_connections", "Open WebSocket connections")
+
+ControlHandler = Callable[[Dict[str, Any]], None]
+
+# Частые кадры стриминга доставляются только вкладкам своего воркера: иначе каждый
+# воркер разбирал бы каждый кадр каждого чата. Вкладки на других воркерах
+# получают ai_thinking и сразу финальный ai_response
+LOCAL_EVENTS = {"ai_streaming"}
+
+class ConnectionManager():
+    """
+    Реестр WebSocket соединений воркера: несколько вкладок на пользователя
+    и на чат. Событие доставляется своим соединениям сразу и публикуется
+    в брокер для остальных воркеров. Через тот же брокер воркеры получают
+    служебные события (сброс кешей)
+    """
+
+    def __init__(self, broker: Broker):
+        self.broker = broker
+        self.worker_id = uuid.uuid4().hex
+        self._by_chat: Dict[int, Set[WebSocket]] = defaultdict(set)
+        self._by_user: Dict[int, Set[WebSocket]] = defaultdict(set)
+        self._handlers: Dict[str, ControlHandler] = {}
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._started = False
+        # Воркеры prefork сервера получают свой id, иначе примут события друг друга за свои
+        os.register_at_fork(after_in_child=self._reset_worker_id)
+
+    def _reset_worker_id(self) -> None:
+        self.worker_id = uuid.uuid4().hex
+
+    def __len__(self) -> int:
+        return sum(len(sockets) for sockets in self._by_user.values())
+
+    async def start(self) -> None:
+        """Подписка на события других воркеров (из lifespan, до первого подключения)"""
+        await self._ensure_started()
+
+    async def _ensure_started(self) -> None:
+        if self._started:
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if not self._started:
+                await self.broker.start(self._on_event)
+                self._started = True
+
+    async def connect(self, websocket: WebSocket, user_id: int, chat_id: int) -> None:
+        await self._ensure_started()
+        self._by_user[user_id].add(websocket)
+        self._by_chat[chat_id].add(websocket)
+        websocket_connections.set(len(self))
+
+    def disconnect(self, websocket: WebSocket, user_id: int, chat_id: int) -> None:
+        for registry, key in ((self._by_user, user_id), (self._by_chat, chat_id)):
+            sockets = registry.get(key)
+            if sockets is not None:
+                sockets.discard(websocket)
+                if not sockets:
+                    del registry[key]
+        websocket_connections.set(len(self))
+
+    async def _deliver(self, sockets: Iterable[WebSocket], message: Dict[str, Any]) -> None:
+        async def send(websocket: WebSocket) -> None:
+            try:
+                await websocket.send_json(message)
+            except Exception as e:
+                # Закрытое соединение удалит его собственный обработчик
+                logging.debug(f"Failed to send to WebSocket: {e}")
+
+        await asyncio.gather(*(send(websocket) for websocket in list(sockets)))
+
+    def _local(self, target: str, key: int) -> Set[WebSocket]:
+        registry = self._by_chat if target == "chat" else self._by_user
+        return registry.get(key, set())
+
+    async def _publish(self, target: str, key: int, message: Dict[str, Any]) -> None:
+        await self._deliver(self._local(target, key), message)
+        if message.get("type") in LOCAL_EVENTS:
+            return
+        try:
+            await self.broker.publish({
+                "origin": self.worker_id,
+                "target": target,
+                "key": key,
+                "message": message
+            })
+        except Exception as e:
+            logging.error(f"Failed to publish WebSocket event: {e}")
+
+    async def _on_event(self, event: Dict[str, Any]) -> None:
+        # Свои события уже доставлены в _publish
+        if event.get("origin") == self.worker_id:
+            return
+        handler = self._handlers.get(event["target"])
+        if handler is not None:
+            handler(event["message"])
+            return
+        await self._deliver(self._local(event["target"], event["key"]), event["message"])
+
+    def subscribe(self, target: str, handler: ControlHandler) -> None:
+        """Обработчик служебных событий target, отправленных любым воркером"""
+        self._handlers[target] = handler
+
+    async def broadcast(self, target: str, message: Dict[str, Any]) -> None:
+        """
+        Служебное событие всем воркерам, включая текущий. Без REDIS_URL
+        оно не выходит за пределы процесса
+        """
+        self._handlers[target](message)
+        try:
+            await self.broker.publish({
+                "origin": self.worker_id,
+                "target": target,
+                "key": None,
+                "message": message
+            })
+        except Exception as e:
+            logging.error(f"Failed to publish {target} event: {e}")
+
+    async def send_to_chat(self, chat_id: int, message: Dict[str, Any]) -> None:
+        """Отправить событие во все вкладки, открытые на этом чате"""
+        await self._publish("chat", chat_id, message)
+
+    async def send_to_user(self, user_id: int, message: Dict[str, Any]) -> None:
+        """Отправить событие во все вкладки пользователя"""
+        await self._publish("user", user_id, message)
+
+    async def close(self) -> None:
+        await self.broker.close()
+
+connection_manager = ConnectionManager(create_broker(settings.REDIS_URL, settings.REDIS_CHANNEL))
@@ -0,0 +1,135 @@
+from typing import Dict, List, Optional
+from src.core.config import settings
+from src.models.chat import Chat
+from src.models.message import ChatMessage
+from src.services.message_writer import message_writer
+
+SUMMARY_PROMPT = """Ты ведёшь краткое резюме консультации психолога с клиентом.
+Обнови резюме, добавив в него новые реплики. Сохрани важные факты о клиенте,
+его состояние, обсуждённые темы и предложенные техники. Пиши сжато, от третьего лица,
+не более {max_tokens} токенов, на русском языке.
+
+Текущее резюме:
+{summary}
+
+Новые реплики:
+{messages}
+
+Обновлённое резюме:"""
+
+_encoding = None
+_summarizer = None
+
+def count_tokens(text: str) -> int:
+    """Количество токенов в тексте (грубая оценка, если tiktoken недоступен)"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+def _message_tokens(message: ChatMessage) -> int:
+    return count_tokens(message.user_message) + count_tokens(message.bot_response)
+
+def _split_recent(messages: List[ChatMessage], budget: int) -> int:
+    """
+    Индекс, начиная с которого последние сообщения (по возрастанию id)
+    помещаются в бюджет токенов и лимит CONTEXT_MAX_MESSAGES
+    """
+    used = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        tokens = _message_tokens(messages[i])
+        if used + tokens > budget or len(messages) - i > settings.CONTEXT_MAX_MESSAGES:
+            break
+        used += tokens
+        start = i
+    return start
+
+async def _unsummarized_messages(chat: Chat, limit: int) -> List[ChatMessage]:
+    """Последние сообщения чата, ещё не вошедшие в резюме (по возрастанию id)"""
+    await message_writer.flush_chat(chat.id)
+    messages = await ChatMessage.filter(
+        chat=chat, id__gt=chat.summarized_until
+    ).order_by('-id').limit(limit)
+    return list(reversed(messages))
+
+async def build_context(chat: Chat) -> List[Dict[str, str]]:
+    """
+    Контекст для агента: резюме старой части диалога + последние реплики,
+    уложенные в CONTEXT_TOKEN_BUDGET
+    """
+    context = []
+    budget = settings.CONTEXT_TOKEN_BUDGET
+    if chat.summary:
+        context.append({
+            "role": "system",
+            "content": f"Краткое содержание предыдущей части разговора: {chat.summary}"
+        })
+        budget -= count_tokens(chat.summary)
+
+    messages = await _unsummarized_messages(chat, settings.CONTEXT_MAX_MESSAGES)
+    for msg in messages[_split_recent(messages, max(budget, 0)):]:
+        context.append({"role": "user", "content": msg.user_message})
+        context.append({"role": "assistant", "content": msg.bot_response})
+    return context
+
+def _format_messages(messages: List[ChatMessage]) -> str:
+    return "\n".join(
+        f"Клиент: {msg.user_message}\nПсихолог: {msg.bot_response}"
+        for msg in messages
+    )
+
+async def _window_start(chat: Chat, budget: int) -> Optional[int]:
+    """
+    id первого сообщения окна последних реплик: всё несвёрнутое до него
+    сворачивается в резюме (None - несвёрнутых сообщений нет)
+    """
+    messages = await _unsummarized_messages(chat, settings.CONTEXT_MAX_MESSAGES)
+    if not messages:
+        return None
+    start = _split_recent(messages, budget)
+    return messages[start].id if start < len(messages) else messages[-1].id + 1
+
+async def update_summary(chat: Chat) -> Optional[str]:
+    """
+    Инкрементальное обновление резюме: в него сворачиваются только сообщения,
+    которые вытеснены из окна последних реплик, а не вся история заново.
+    Сворачивание идёт от самого старого несвёрнутого сообщения пачками
+    по CONTEXT_MAX_MESSAGES, summarized_until сдвигается после каждой пачки
+    """
+    global _summarizer
+    # Сообщениям оставляем бюджет за вычетом места под резюме
+    recent_budget = max(settings.CONTEXT_TOKEN_BUDGET - settings.SUMMARY_MAX_TOKENS, 0)
+    window_start = await _window_start(chat, recent_budget)
+    if window_start is None:
+        return None
+
+    updated = None
+    while True:
+        overflow = await ChatMessage.filter(
+            chat=chat, id__gt=chat.summarized_until, id__lt=window_start
+        ).order_by('id').limit(settings.CONTEXT_MAX_MESSAGES)
+        if not overflow:
+            return updated
+
+        if _summarizer is None:
+            from src.utils.agent import create_llm
+            _summarizer = create_llm(temperature=0, max_tokens=settings.SUMMARY_MAX_TOKENS)
+
+        # Ошибку модели обрабатывает фоновая очередь (повтор продолжит с этой пачки)
+        result = await _summarizer.ainvoke(SUMMARY_PROMPT.format(
+            max_tokens=settings.SUMMARY_MAX_TOKENS,
+            summary=chat.summary or "(пусто)",
+            messages=_format_messages(overflow)
+        ))
+
+        chat.summary = result.content.strip()
+        chat.summarized_until = overflow[-1].id
+        await chat.save(update_fields=["summary", "summarized_until"])
+        updated = chat.summary
@@ -1,23 +1,70 @@
 from fastapi.security import OAuth2PasswordBearer
-from typing import Annotated
+from typing import Annotated, Dict, Set
 from fastapi import Depends, HTTPException
 from jose import jwt, JWTError
 from src.core.config import settings
+from src.core.metrics import counter
 from src.models.user import User
+from src.services.connections import connection_manager
+from src.utils.cache import TTLCache
+import time
 
 oauth_bearer = OAuth2PasswordBearer("/auth/sign_in")
 
-async def get_current_user(token: Annotated[str, Depends(oauth_bearer)]):
+# Кеш токен -> пользователь. Запись живёт не дольше AUTH_CACHE_TTL и срока токена
+_user_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+_user_tokens: Dict[str, Set[str]] = {}
+
+auth_cache_hits = counter("auth_cache_hits_total", "Auth resolutions served from cache")
+auth_cache_misses = counter("auth_cache_misses_total", "Auth resolutions that hit the database")
+
+async def resolve_user(token: str) -> User:
+    """Общая проверка JWT и загрузка пользователя для REST и WebSocket"""
+    user = _user_cache.get(token)
+    if user is not None:
+        auth_cache_hits.inc()
+        return user
+    auth_cache_misses.inc()
+
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if not username:
-            raise HTTPException(status_code=401, detail="Invalid auth data")
-        
-        user = await User.filter(username=username).first()
-
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
     except JWTError:
-        raise HTTPException(status_code=401, detail="Could not validate data")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Could not validate data")
+
+    username: str = payload.get("sub")
+    if not username:
+        raise HTTPException(status_code=401, detail="Invalid auth data")
+
+    user = await User.filter(username=username).first()
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    expires_in = payload.get("exp", time.time() + settings.AUTH_CACHE_TTL) - time.time()
+    if expires_in > 0:
+        _user_cache.set(token, user, ttl=expires_in)
+        # Заодно забываем токены, уже вытесненные из кеша
+        tokens = {t for t in _user_tokens.get(username, ()) if t in _user_cache}
+        tokens.add(token)
+        _user_tokens[username] = tokens
+    return user
+
+def forget_user(username: str) -> None:
+    for token in _user_tokens.pop(username, set()):
+        _user_cache.pop(token)
+
+async def invalidate_user(username: str) -> None:
+    """
+    Сбросить закешированные токены пользователя (например, после смены пароля)
+    во всех воркерах. Без REDIS_URL другие воркеры забудут их через AUTH_CACHE_TTL
+    """
+    await connection_manager.broadcast("auth", {"username": username})
+
+connection_manager.subscribe("auth", lambda message: forget_user(message["username"]))
+
+async def get_current_user(token: Annotated[str, Depends(oauth_bearer)]):
+    return await resolve_user(token)
+
+async def get_admin_user(current_user: Annotated[User, Depends(get_current_user)]):
+    if current_user.username not in settings.ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
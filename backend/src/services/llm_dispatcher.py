@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from src.core.config import settings
+from src.core.metrics import counter, gauge
+from src.core.tracing import stage
+
+llm_inflight = gauge("llm_requests_inflight", "Agent calls currently running")
+llm_queued = gauge("llm_requests_queued", "Agent calls waiting for a free slot")
+llm_rejected = counter("llm_requests_rejected_total", "Agent calls rejected because the queue is full")
+llm_coalesced = counter("llm_requests_coalesced_total", "Agent calls served by an identical in-flight call")
+
+class DispatcherBusy(Exception):
+    """Очередь к LLM переполнена; retry_after - через сколько секунд стоит повторить"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def request_key(chat_id: int, message: str, chat_history: List[Dict[str, str]]) -> str:
+    """
+    Ключ одинаковых запросов: то же сообщение при том же контексте в том же
+    чате (например, из двух вкладок). Стрим и итоговый ответ ведущего запроса
+    уходят во все вкладки этого чата, сохраняет ответ тоже он один;
+    запросы разных чатов и пользователей не объединяются
+    """
+    raw = json.dumps([chat_id, chat_history, message], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class LLMDispatcher():
+    """
+    Общий для процесса диспетчер вызовов агента: не больше max_concurrency
+    одновременных вызовов, очереди ожидания по пользователям с обслуживанием
+    по кругу (round-robin) и объединение одинаковых запросов в один вызов
+    """
+
+    def __init__(self, max_concurrency: int, max_queue_per_user: int, max_queue_total: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue_per_user = max_queue_per_user
+        self.max_queue_total = max_queue_total
+        self._running = 0
+        self._queued = 0
+        self._waiting: "OrderedDict[int, Deque[asyncio.Future]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Завершается при любом сдвиге очереди: ожидающие пересчитывают свою позицию
+        self._moved: Optional[asyncio.Future] = None
+
+    def _update_gauges(self) -> None:
+        llm_inflight.set(self._running)
+        llm_queued.set(self._queued)
+
+    def _queue_moved(self) -> None:
+        if self._moved is not None and not self._moved.done():
+            self._moved.set_result(None)
+        self._moved = None
+
+    def joins(self, key: Optional[str]) -> bool:
+        """Запрос с таким ключом сейчас будет объединён с уже выполняющимся"""
+        return key is not None and key in self._inflight
+
+    def position(self, user_id: int, index: int) -> int:
+        """
+        Место в общей очереди для index-й заявки пользователя при обходе по кругу:
+        пользователи раньше него в круге успеют получить index + 1 слотов, позже - index
+        """
+        ahead = index
+        before = True
+        for other_id, queue in self._waiting.items():
+            if other_id == user_id:
+                before = False
+            else:
+                ahead += min(len(queue), index + 1 if before else index)
+        return ahead + 1
+
+    def _remove(self, user_id: int, granted: asyncio.Future) -> None:
+        queue = self._waiting.get(user_id)
+        if queue and granted in queue:
+            queue.remove(granted)
+            self._queued -= 1
+            if not queue:
+                del self._waiting[user_id]
+            self._queue_moved()
+        self._update_gauges()
+
+    async def _wait(
+        self,
+        user_id: int,
+        granted: asyncio.Future,
+        on_queued: Optional[Callable[[int], Awaitable[Any]]]
+    ) -> None:
+        """Ждать слот, сообщая позицию в очереди при каждом её изменении"""
+        last = None
+        while on_queued and not granted.done():
+            position = self.position(user_id, self._waiting[user_id].index(granted))
+            if position != last:
+                last = position
+                await on_queued(position)
+                continue
+            if self._moved is None:
+                self._moved = asyncio.get_running_loop().create_future()
+            await asyncio.wait((granted, self._moved), return_when=asyncio.FIRST_COMPLETED)
+        await granted
+
+    async def _acquire(self, user_id: int, on_queued: Optional[Callable[[int], Awaitable[Any]]]) -> None:
+        if self._running < self.max_concurrency and not self._queued:
+            self._running += 1
+            self._update_gauges()
+            return
+
+        queue = self._waiting.get(user_id)
+        if (queue and len(queue) >= self.max_queue_per_user) or self._queued >= self.max_queue_total:
+            llm_rejected.inc()
+            raise DispatcherBusy(
+                "Слишком много запросов, попробуйте немного позже", settings.LLM_BUSY_RETRY_AFTER
+            )
+
+        granted = asyncio.get_running_loop().create_future()
+        queue = self._waiting.setdefault(user_id, deque())
+        queue.append(granted)
+        self._queued += 1
+        self._queue_moved()
+        self._update_gauges()
+
+        try:
+            await self._wait(user_id, granted, on_queued)
+        except BaseException:
+            if granted.done() and not granted.cancelled():
+                # Слот уже выдан, но ожидающий отменён - отдаём его следующему
+                self._release()
+            else:
+                granted.cancel()
+                self._remove(user_id, granted)
+            raise
+
+    def _release(self) -> None:
+        self._running -= 1
+        while self._waiting:
+            user_id, queue = next(iter(self._waiting.items()))
+            granted = queue.popleft()
+            self._queued -= 1
+            # Пользователь уходит в конец круга, чтобы не занимать слоты подряд
+            if queue:
+                self._waiting.move_to_end(user_id)
+            else:
+                del self._waiting[user_id]
+            self._queue_moved()
+            if not granted.done():
+                self._running += 1
+                granted.set_result(None)
+                break
+        self._update_gauges()
+
+    async def submit(
+        self,
+        user_id: int,
+        key: Optional[str],
+        factory: Callable[[], Awaitable[Any]],
+        on_queued: Optional[Callable[[int], Awaitable[Any]]] = None
+    ) -> Any:
+        """
+        Выполнить вызов с учётом лимитов. Если такой же запрос (key) уже
+        выполняется, дождаться его результата вместо нового вызова
+        """
+        if key is not None and key in self._inflight:
+            llm_coalesced.inc()
+            return await asyncio.shield(self._inflight[key])
+
+        result = asyncio.get_running_loop().create_future()
+        # Исключение могут не забрать, если не было присоединившихся запросов
+        result.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if key is not None:
+            self._inflight[key] = result
+
+        try:
+            with stage("queue"):
+                await self._acquire(user_id, on_queued)
+            try:
+                value = await factory()
+            finally:
+                self._release()
+            result.set_result(value)
+            return value
+        except BaseException as e:
+            if not result.done():
+                if isinstance(e, asyncio.CancelledError):
+                    # Отмена ведущего запроса не должна выглядеть отменой для присоединившихся
+                    e = RuntimeError("Запрос к агенту был отменён")
+                result.set_exception(e)
+            raise
+        finally:
+            if key is not None and self._inflight.get(key) is result:
+                del self._inflight[key]
+
+llm_dispatcher = LLMDispatcher(
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    max_queue_per_user=settings.LLM_MAX_QUEUE_PER_USER,
+    max_queue_total=settings.LLM_MAX_QUEUE_TOTAL
+)
@@ -0,0 +1,333 @@
+"""
+Групповая запись сообщений чата (MESSAGE_PERSISTENCE = group или async).
+
+id и время сообщения назначаются в процессе, строки копятся в памяти
+и пишутся пачкой: bulk_create всех строк и по одному UPDATE счётчиков
+на чат в одной транзакции. В режиме group ответ отправляется после фиксации
+пачки (запись одного хода ждёт не дольше MESSAGE_FLUSH_INTERVAL, а нагрузка
+на БД - запрос на пачку, а не на сообщение), в режиме async - сразу
+(при падении процесса теряются сообщения последних MESSAGE_FLUSH_INTERVAL секунд).
+
+Чтение истории, контекста, списка чатов и поиск сначала дописывают
+несохранённые сообщения пользователя этого процесса. Буфер других воркеров
+им не виден, поэтому async работает только с одним воркером, а group -
+с несколькими (ответ уходит после фиксации), кроме SQLite: там id уникальны
+только в пределах процесса. check_workers проверяет это при старте src.server
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional
+from tortoise import connections, timezone
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+from src.core.config import settings
+from src.core.metrics import counter, gauge, histogram
+from src.models.chat import Chat
+from src.models.message import ChatMessage
+from src.services.chat_list import invalidate_chat_list, make_preview
+
+messages_pending = gauge("chat_messages_pending", "Chat messages waiting to be written to the database")
+message_batch_size = histogram(
+    "chat_message_batch_size", "Chat messages written per batch",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+message_batch_seconds = histogram("chat_message_batch_seconds", "Time to write a batch of chat messages")
+message_write_errors = counter("chat_message_write_errors_total", "Failed attempts to write a batch of chat messages")
+messages_dropped = counter("chat_messages_dropped_total", "Chat messages dropped because their chat was deleted")
+messages_failed = counter(
+    "chat_messages_failed_total", "Chat messages dropped after MESSAGE_WRITE_RETRIES rejected writes"
+)
+
+class UnwrittenMessages(Exception):
+    """Часть пачки не записана, остальные сообщения зафиксированы"""
+
+    def __init__(self, messages: List[ChatMessage], cause: Exception):
+        super().__init__(f"{len(messages)} chat messages not written: {cause}")
+        self.messages = messages
+        self.cause = cause
+
+class PendingMessage(NamedTuple):
+    message: ChatMessage
+    # Режим group: ожидание фиксации пачки
+    written: Optional[asyncio.Future]
+    # Режим async: сколько раз БД отвергла строку (IntegrityError)
+    rejected: int = 0
+
+class IdAllocator():
+    """
+    Блоки id сообщений. Postgres: из последовательности столбца id (уникальны
+    для всех воркеров, вперемешку с обычными INSERT). SQLite: от MAX(id) -
+    только для одного процесса (см. check_workers)
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._ids: Deque[int] = deque()
+        self._last = 0
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _reserve(self) -> List[int]:
+        connection = connections.get("default")
+        if connection.capabilities.dialect == "postgres":
+            rows = await connection.execute_query_dict(
+                "SELECT nextval(pg_get_serial_sequence('chatmessages', 'id')) AS id "
+                "FROM generate_series(1, $1)",
+                [self.block_size]
+            )
+            return [row["id"] for row in rows]
+        _, rows = await connection.execute_query("SELECT COALESCE(MAX(id), 0) FROM chatmessages")
+        start = max(rows[0][0], self._last) + 1
+        self._last = start + self.block_size - 1
+        return list(range(start, self._last + 1))
+
+    async def next(self) -> int:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._ids:
+                self._ids.extend(await self._reserve())
+            return self._ids.popleft()
+
+async def _update_chats(messages: List[ChatMessage]) -> None:
+    """Счётчик, время и превью последнего сообщения - по запросу на чат"""
+    by_chat: Dict[int, List[ChatMessage]] = {}
+    for message in messages:
+        by_chat.setdefault(message.chat_id, []).append(message)
+    for chat_id, chat_messages in by_chat.items():
+        last = chat_messages[-1]
+        await Chat.filter(id=chat_id).update(
+            message_count=F("message_count") + len(chat_messages),
+            last_message_at=last.time,
+            last_message_preview=make_preview(last.bot_response),
+            last_activity_at=last.time
+        )
+
+async def _write(messages: List[ChatMessage]) -> None:
+    try:
+        async with in_transaction():
+            # id уже назначены: bulk_create пишет их вместе со строками одним executemany
+            await ChatMessage.bulk_create(messages)
+            await _update_chats(messages)
+        return
+    except IntegrityError:
+        if len(messages) == 1:
+            if await Chat.exists(id=messages[0].chat_id):
+                # Не удалённый чат, а конфликт id: сообщение не теряем
+                raise
+            messages_dropped.inc()
+            logging.warning(f"Message {messages[0].id} dropped: chat {messages[0].chat_id} no longer exists")
+            return
+    # В пачке сообщение удалённого чата (или конфликт): пишем по одному
+    unwritten = []
+    cause = None
+    for message in messages:
+        try:
+            await _write([message])
+        except Exception as e:
+            unwritten.append(message)
+            cause = e
+    if unwritten:
+        raise UnwrittenMessages(unwritten, cause)
+
+class MessageWriter():
+    """Буфер несохранённых сообщений процесса и фоновая запись пачками"""
+
+    def __init__(
+        self,
+        mode: str,
+        batch_size: int,
+        flush_interval: float,
+        max_pending: int,
+        id_block_size: int,
+        write_retries: int
+    ):
+        if mode not in ("sync", "group", "async"):
+            raise ValueError(f"Unknown MESSAGE_PERSISTENCE: {mode}")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.write_retries = write_retries
+        self.ids = IdAllocator(id_block_size)
+        self._pending: List[PendingMessage] = []
+        self._lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def _ensure_started(self) -> None:
+        if self._task is not None or self._closed:
+            return
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        # Запись не должна попадать в счётчик запросов хода, который её запустил
+        self._task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._run())
+
+    async def add(self, chat: Chat, user_id: int, user_message: str, bot_response: str) -> ChatMessage:
+        """Сообщение с id и временем; в БД оно попадёт со следующей пачкой"""
+        self._ensure_started()
+        message = ChatMessage(
+            id=await self.ids.next(),
+            chat_id=chat.id,
+            user_id=user_id,
+            user_message=user_message,
+            bot_response=bot_response,
+            time=timezone.now()
+        )
+        written = asyncio.get_running_loop().create_future() if self.mode == "group" else None
+        self._pending.append(PendingMessage(message, written))
+        messages_pending.set(len(self._pending))
+
+        if self._closed or len(self._pending) >= self.max_pending:
+            # БД не успевает (или процесс останавливается): пишем сами
+            await self.flush()
+        elif len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        if written is not None:
+            await written
+        return message
+
+    async def flush(self) -> None:
+        """Записать все накопленные сообщения пачками по batch_size"""
+        if self._lock is None:
+            return
+        async with self._lock:
+            while self._pending:
+                batch = self._pending[:self.batch_size]
+                self._pending = self._pending[len(batch):]
+                messages = [item.message for item in batch]
+                if self.mode == "group":
+                    # Время - при записи: порядок времени ближе к порядку фиксации,
+                    # как у sync, и курсор after не пропускает строки
+                    now = timezone.now()
+                    for message in messages:
+                        message.time = now
+                started = time.perf_counter()
+                try:
+                    await _write(messages)
+                except Exception as e:
+                    message_write_errors.inc()
+                    unwritten = {message.id for message in (
+                        e.messages if isinstance(e, UnwrittenMessages) else messages
+                    )}
+                    failed = [item for item in batch if item.message.id in unwritten]
+                    # group: ход получает ошибку, как при синхронной записи;
+                    # async: сообщения остаются в буфере до следующей попытки
+                    for item in failed:
+                        if item.written is not None and not item.written.done():
+                            item.written.set_exception(e)
+                    self._pending = self._retry([item for item in failed if item.written is None], e) + self._pending
+                    messages_pending.set(len(self._pending))
+                    await self._written([item for item in batch if item.message.id not in unwritten])
+                    raise
+                message_batch_seconds.observe(time.perf_counter() - started)
+                message_batch_size.observe(len(batch))
+                messages_pending.set(len(self._pending))
+                await self._written(batch)
+
+    def _retry(self, failed: List[PendingMessage], error: Exception) -> List[PendingMessage]:
+        """
+        Сообщения для следующей попытки. Недоступная БД не считается: строку,
+        которую БД отвергает (IntegrityError), выбрасываем после write_retries попыток
+        """
+        if not isinstance(getattr(error, "cause", error), IntegrityError):
+            return failed
+        retried = []
+        for item in failed:
+            if item.rejected >= self.write_retries:
+                messages_failed.inc()
+                logging.error(
+                    f"Message {item.message.id} of chat {item.message.chat_id} dropped "
+                    f"after {item.rejected + 1} rejected writes: {error}"
+                )
+            else:
+                retried.append(item._replace(rejected=item.rejected + 1))
+        return retried
+
+    async def _written(self, batch: List[PendingMessage]) -> None:
+        for item in batch:
+            if item.written is not None and not item.written.done():
+                item.written.set_result(None)
+        for user_id in {item.message.user_id for item in batch}:
+            await invalidate_chat_list(user_id)
+
+    async def _run(self) -> None:
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._closed:
+                # Остаток дописывает close
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Failed to write {len(self._pending)} chat messages: {e}")
+                await asyncio.sleep(self.flush_interval)
+
+    async def flush_chat(self, chat_id: int) -> None:
+        """Дописать несохранённые сообщения чата перед чтением из БД"""
+        if any(item.message.chat_id == chat_id for item in self._pending):
+            await self.flush()
+        elif self._lock is not None and self._lock.locked():
+            # Сообщения чата могут быть в записываемой сейчас пачке
+            async with self._lock:
+                pass
+
+    async def flush_user(self, user_id: int) -> None:
+        if any(item.message.user_id == user_id for item in self._pending):
+            await self.flush()
+        elif self._lock is not None and self._lock.locked():
+            async with self._lock:
+                pass
+
+    def discard_chat(self, chat_id: int) -> None:
+        """Чат удаляется: его несохранённые сообщения писать уже не нужно"""
+        kept = []
+        for item in self._pending:
+            if item.message.chat_id != chat_id:
+                kept.append(item)
+            elif item.written is not None and not item.written.done():
+                item.written.set_result(None)
+        self._pending = kept
+        messages_pending.set(len(self._pending))
+
+    async def close(self) -> None:
+        """Остановка процесса: дописать всё накопленное"""
+        self._closed = True
+        if self._task is not None:
+            # Без отмены: отменённая посреди транзакции запись оставляет
+            # занятой блокировку соединения, и последняя запись не начнётся
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Chat messages lost on shutdown: {len(self._pending)} ({e})")
+
+def check_workers(mode: str, workers: int, database_url: str) -> None:
+    """Режим записи допускает столько воркеров (вызывается src.server до fork)"""
+    if mode == "sync" or workers <= 1:
+        return
+    if mode == "async":
+        raise ValueError(
+            "MESSAGE_PERSISTENCE=async needs a single worker (WEB_WORKERS=1): "
+            "other workers do not see unwritten messages"
+        )
+    if database_url.startswith("sqlite"):
+        raise ValueError(f"MESSAGE_PERSISTENCE={mode} on SQLite needs a single worker (WEB_WORKERS=1)")
+
+message_writer = MessageWriter(
+    mode=settings.MESSAGE_PERSISTENCE,
+    batch_size=settings.MESSAGE_BATCH_SIZE,
+    flush_interval=settings.MESSAGE_FLUSH_INTERVAL,
+    max_pending=settings.MESSAGE_MAX_PENDING,
+    id_block_size=settings.MESSAGE_ID_BLOCK_SIZE,
+    write_retries=settings.MESSAGE_WRITE_RETRIES
+)
@@ -0,0 +1,176 @@
+"""
+Личные коллекции документов пользователей.
+
+Файлы пользователя лежат в USER_DOCUMENTS_DIR/<user_id>/files, индексы -
+в USER_DOCUMENTS_DIR/<user_id>/index и строятся той же инкрементальной
+индексацией, что и общая база знаний. Загруженные индексы держатся в памяти
+в LRU, ограниченном суммарным числом чанков
+"""
+import asyncio
+import os
+import shutil
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from src.core.config import settings
+from src.core.metrics import counter, gauge, histogram
+
+if TYPE_CHECKING:
+    from src.utils.knowledge_base import KnowledgeBase
+
+# Как SOURCE_EXTENSIONS и CURRENT_FILE в src.utils: те модули тянут LangChain
+# и импортируются лениво
+SOURCE_EXTENSIONS = (".md", ".txt")
+CURRENT_FILE = "CURRENT"
+
+collection_hits = counter("user_collection_cache_hits_total", "Searches served by an already loaded user collection")
+collection_misses = counter("user_collection_cache_misses_total", "User collections loaded from disk")
+collection_evictions = counter("user_collection_evictions_total", "User collections evicted from memory")
+collections_loaded = gauge("user_collections_loaded", "User collections held in memory")
+collection_chunks = gauge("user_collection_chunks", "Chunks of all user collections held in memory")
+collection_load_seconds = histogram("user_collection_load_seconds", "Time to load a user collection from disk")
+
+def files_dir(user_id: int) -> str:
+    return os.path.join(settings.USER_DOCUMENTS_DIR, str(user_id), "files")
+
+def index_dir(user_id: int) -> str:
+    return os.path.join(settings.USER_DOCUMENTS_DIR, str(user_id), "index")
+
+def collection_version(user_id: int) -> Optional[str]:
+    """Версия (ключ содержимого) коллекции пользователя; None - документов нет"""
+    try:
+        with open(os.path.join(index_dir(user_id), CURRENT_FILE), encoding="UTF-8") as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+def _load(user_id: int, version: str) -> "KnowledgeBase":
+    from src.utils.knowledge_base import KnowledgeBase
+    from src.utils.vector_store import get_embeddings, get_index_key
+    knowledge_base = KnowledgeBase.load(os.path.join(index_dir(user_id), version), get_embeddings())
+    if knowledge_base.manifest.get("key") != get_index_key():
+        raise ValueError("Collection was built with other index parameters")
+    return knowledge_base
+
+class UserCollections():
+    """
+    LRU загруженных коллекций: запись вытесняется, когда суммарное число чанков
+    превышает max_chunks (последняя использованная коллекция остаётся всегда).
+    Одновременные обращения к незагруженной коллекции ждут одну загрузку
+    """
+
+    def __init__(self, max_chunks: int):
+        self.max_chunks = max_chunks
+        # user_id -> (версия, коллекция, число чанков при загрузке)
+        self._entries: "OrderedDict[int, Tuple[str, KnowledgeBase, int]]" = OrderedDict()
+        self._loading: Dict[Tuple[int, str], asyncio.Task] = {}
+        self._chunks = 0
+
+    def _update_gauges(self) -> None:
+        collections_loaded.set(len(self._entries))
+        collection_chunks.set(self._chunks)
+
+    def _pop(self, user_id: int) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry:
+            self._chunks -= entry[2]
+
+    def put(self, user_id: int, version: str, knowledge_base: "KnowledgeBase") -> None:
+        self._pop(user_id)
+        chunks = len(knowledge_base)
+        self._entries[user_id] = (version, knowledge_base, chunks)
+        self._chunks += chunks
+        while self._chunks > self.max_chunks and len(self._entries) > 1:
+            _, (_, _, evicted_chunks) = self._entries.popitem(last=False)
+            self._chunks -= evicted_chunks
+            collection_evictions.inc()
+        self._update_gauges()
+
+    def discard(self, user_id: int) -> None:
+        self._pop(user_id)
+        self._update_gauges()
+
+    def cached(self, user_id: int) -> Optional["KnowledgeBase"]:
+        entry = self._entries.get(user_id)
+        return entry[1] if entry else None
+
+    async def _load(self, user_id: int, version: str) -> "KnowledgeBase":
+        collection_misses.inc()
+        started = time.monotonic()
+        try:
+            knowledge_base = await asyncio.to_thread(_load, user_id, version)
+        except Exception:
+            # Индекс устарел или повреждён: перестраиваем по файлам пользователя
+            knowledge_base, report = await sync_collection(user_id)
+            version = report["corpus_key"]
+        collection_load_seconds.observe(time.monotonic() - started)
+        self.put(user_id, version, knowledge_base)
+        return knowledge_base
+
+    async def get(self, user_id: int) -> Optional["KnowledgeBase"]:
+        """Коллекция пользователя (None, если документов нет)"""
+        # Версию проверяем при каждом обращении: документы могли изменить в другом воркере
+        version = collection_version(user_id)
+        if version is None:
+            self.discard(user_id)
+            return None
+        entry = self._entries.get(user_id)
+        if entry and entry[0] == version:
+            collection_hits.inc()
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+        key = (user_id, version)
+        task = self._loading.get(key)
+        if task is None:
+            task = self._loading[key] = asyncio.create_task(self._load(user_id, version))
+            task.add_done_callback(lambda _: self._loading.pop(key, None))
+        return await asyncio.shield(task)
+
+user_collections = UserCollections(max_chunks=settings.USER_DOCUMENTS_CACHE_CHUNKS)
+
+async def sync_collection(user_id: int, knowledge_base: Optional["KnowledgeBase"] = None) -> Tuple["KnowledgeBase", dict]:
+    """Переиндексировать коллекцию по файлам пользователя (только изменённые файлы)"""
+    from src.utils.ingestion import sync_knowledge_base
+    os.makedirs(files_dir(user_id), exist_ok=True)
+    return await sync_knowledge_base(knowledge_base, source_dir=files_dir(user_id), store_dir=index_dir(user_id))
+
+def list_documents(user_id: int) -> List[dict]:
+    directory = files_dir(user_id)
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return []
+    return [
+        {"name": name, "size": os.path.getsize(os.path.join(directory, name))}
+        for name in names if name.endswith(SOURCE_EXTENSIONS)
+    ]
+
+def _write_file(path: str, content: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as file:
+        file.write(content)
+    os.replace(path + ".tmp", path)
+
+async def _resync(user_id: int) -> dict:
+    knowledge_base, report = await sync_collection(user_id, user_collections.cached(user_id))
+    user_collections.put(user_id, report["corpus_key"], knowledge_base)
+    return report
+
+async def save_document(user_id: int, name: str, content: bytes) -> dict:
+    """Сохранить (или заменить) документ и доиндексировать коллекцию"""
+    await asyncio.to_thread(_write_file, os.path.join(files_dir(user_id), name), content)
+    return await _resync(user_id)
+
+async def delete_document(user_id: int, name: str) -> bool:
+    path = os.path.join(files_dir(user_id), name)
+    if not os.path.isfile(path):
+        return False
+    os.remove(path)
+    if os.listdir(files_dir(user_id)):
+        await _resync(user_id)
+    else:
+        # Последний документ удалён: коллекции больше нет
+        user_collections.discard(user_id)
+        await asyncio.to_thread(shutil.rmtree, os.path.join(settings.USER_DOCUMENTS_DIR, str(user_id)), True)
+    return True
@@ -1,24 +1,36 @@
-from typing import AsyncGenerator, List, Dict
-from src.services.chat import process_chat
+from typing import AsyncGenerator, List, Dict, Optional
+from src.services.chat import stream_chat
+from src.services.context import build_context, update_summary
+from src.services.answer_cache import answer_cache, lookup_answer
+from src.services.llm_dispatcher import DispatcherBusy, llm_dispatcher, request_key
+from src.services.connections import connection_manager
+from src.services.chat_list import invalidate_chat_list, make_preview
+from src.services.user_documents import collection_version
+from src.services.background import background_tasks
+from src.services.message_writer import message_writer
+from src.core.config import settings
+from src.core.metrics import histogram
+from src.core.tracing import stage
 from src.models.chat import Chat
 from src.models.message import ChatMessage
 from src.models.user import User
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
 import asyncio
 import json
 import logging
 
+time_to_first_token = histogram(
+    "chat_time_to_first_token_seconds", "Time from the start of generation to the first streamed token"
+)
+
 class WebSocketChatService:
     """Сервис для обработки реал-тайм чата через WebSocket"""
     
     @staticmethod
     async def get_chat_history(chat: Chat) -> List[Dict[str, str]]:
-        """Получить историю чата в формате для агента"""
-        messages = await ChatMessage.filter(chat=chat).order_by('time')
-        chat_history = []
-        for msg in messages:
-            chat_history.append({"role": "user", "content": msg.user_message})
-            chat_history.append({"role": "assistant", "content": msg.bot_response})
-        return chat_history
+        """Получить историю чата в формате для агента (в пределах бюджета токенов)"""
+        return await build_context(chat)
     
     @staticmethod
     async def process_user_message(
@@ -26,13 +38,16 @@ class WebSocketChatService:
         chat: Chat, 
         user: User,
         websocket_send_func
-    ) -> ChatMessage:
+    ) -> Optional[ChatMessage]:
         """
-        Обработка сообщения пользователя с реал-тайм отправкой ответа
+        Обработка сообщения пользователя с реал-тайм отправкой ответа.
+        None - ответ дал такой же запрос из другой вкладки чата: сохраняет
+        и рассылает его тот запрос
         """
         try:
             # Получение истории для контекста
-            chat_history = await WebSocketChatService.get_chat_history(chat)
+            with stage("history"):
+                chat_history = await WebSocketChatService.get_chat_history(chat)
             
             # Уведомление о начале обработки
             await websocket_send_func({
@@ -40,19 +55,17 @@ class WebSocketChatService:
                 "message": "💙 Внимательно выслушиваю вас..."
             })
             
-            # Симуляция задержки для демонстрации
-            await asyncio.sleep(0.5)
-            
-            # Получение ответа от агента
-            ai_response = await process_chat(user_message, chat_history)
+            ai_response = await WebSocketChatService.generate_response(
+                user_message, chat, chat_history, websocket_send_func
+            )
+            if ai_response is None:
+                return None
             
             # Сохранение в БД
-            chat_message = await ChatMessage.create(
-                chat=chat,
-                user=user,
-                user_message=user_message,
-                bot_response=ai_response
-            )
+            with stage("persist"):
+                chat_message = await WebSocketChatService.save_message(
+                    chat, user, user_message, ai_response
+                )
             
             # Отправка финального ответа
             await websocket_send_func({
@@ -62,8 +75,17 @@ class WebSocketChatService:
                 "timestamp": chat_message.time.isoformat()
             })
             
+            WebSocketChatService.schedule_post_turn(chat, user_message)
             return chat_message
             
+        except DispatcherBusy as e:
+            # Не ошибка обработки: клиент может повторить запрос позже
+            await websocket_send_func({
+                "type": "busy",
+                "message": str(e),
+                "retry_after": e.retry_after
+            })
+            raise
         except Exception as e:
             logging.error(f"Error processing user message: {e}")
             await websocket_send_func({
@@ -73,36 +95,148 @@ class WebSocketChatService:
             raise
     
     @staticmethod
-    async def stream_ai_response(
+    async def save_message(chat: Chat, user: User, user_message: str, bot_response: str) -> ChatMessage:
+        """Сохранение сообщения вместе со счётчиком и временем последнего сообщения чата"""
+        if message_writer.mode != "sync":
+            chat_message = await message_writer.add(chat, user.id, user_message, bot_response)
+            chat.message_count += 1
+            chat.last_message_at = chat.last_activity_at = chat_message.time
+            chat.last_message_preview = make_preview(bot_response)
+            return chat_message
+        async with in_transaction():
+            chat_message = await ChatMessage.create(
+                chat=chat,
+                user=user,
+                user_message=user_message,
+                bot_response=bot_response
+            )
+            # Инкремент в БД: сообщения могут приходить из нескольких вкладок
+            preview = make_preview(bot_response)
+            await Chat.filter(id=chat.id).update(
+                message_count=F("message_count") + 1,
+                last_message_at=chat_message.time,
+                last_message_preview=preview,
+                last_activity_at=chat_message.time
+            )
+        chat.message_count += 1
+        chat.last_message_at = chat.last_activity_at = chat_message.time
+        chat.last_message_preview = preview
+        await invalidate_chat_list(chat.user_id)
+        return chat_message
+    
+    @staticmethod
+    async def generate_response(
         user_message: str,
+        chat: Chat,
         chat_history: List[Dict[str, str]],
         websocket_send_func
-    ) -> str:
+    ) -> Optional[str]:
         """
-        Стриминговая отправка ответа агента (для будущего улучшения)
+        Ответ из семантического кеша или потоковая генерация агентом.
+        None - запрос объединён с таким же выполняющимся запросом этого чата
         """
-        # TODO: Реализовать настоящий streaming когда LangChain будет поддерживать
-        # Пока что имитируем streaming разбивкой на части
+        cached_answer = None
+        # С личными документами ответ зависит от их текущей версии - не кешируем
+        private = collection_version(chat.user_id) is not None
+        use_cache = settings.ANSWER_CACHE_ENABLED and chat.answer_cache_enabled and not private
+        if use_cache:
+            try:
+                with stage("answer_cache") as record:
+                    cached_answer, vector, fingerprint = await lookup_answer(chat.user_id, user_message, chat_history)
+                    record["hit"] = cached_answer is not None
+            except Exception as e:
+                logging.error(f"Answer cache lookup failed: {e}")
+                use_cache = False
         
-        full_response = await process_chat(user_message, chat_history)
+        if cached_answer and settings.ANSWER_CACHE_MODE == "return":
+            return cached_answer
         
-        # Разбиваем ответ на части для имитации streaming
-        words = full_response.split()
-        current_response = ""
+        agent_history = chat_history
+        if cached_answer:
+            # Режим seed: похожий прошлый ответ передаётся агенту как ориентир
+            agent_history = [*chat_history, {
+                "role": "system",
+                "content": f"Ответ на похожее обращение, можно взять за основу: {cached_answer}"
+            }]
         
-        for i, word in enumerate(words):
-            current_response += word + " "
+        async def generate() -> str:
+            # Потоковая отправка ответа агента по мере генерации
+            with stage("llm"):
+                return await WebSocketChatService.stream_ai_response(
+                    user_message, agent_history, websocket_send_func, chat.user_id
+                )
+        
+        async def notify_queued(position: int) -> None:
+            await websocket_send_func({
+                "type": "queued",
+                "position": position,
+                "message": f"Ваш запрос в очереди, позиция: {position}"
+            })
+        
+        # Через общий диспетчер: лимит одновременных вызовов, честная очередь
+        # и объединение одинаковых запросов
+        key = request_key(chat.id, user_message, agent_history)
+        joined = llm_dispatcher.joins(key)
+        try:
+            ai_response = await llm_dispatcher.submit(chat.user_id, key, generate, notify_queued)
+        except Exception:
+            if joined:
+                # Ошибку все вкладки чата уже получили от ведущего запроса
+                return None
+            raise
+        if joined:
+            # Ответ во все вкладки чата отправит и сохранит один раз ведущий запрос
+            return None
+        
+        if use_cache and ai_response and not cached_answer:
+            answer_cache.store(vector, fingerprint, ai_response)
+        return ai_response
+    
+    @staticmethod
+    async def stream_ai_response(
+        user_message: str,
+        chat_history: List[Dict[str, str]],
+        websocket_send_func,
+        user_id: Optional[int] = None
+    ) -> str:
+        """
+        Стриминговая отправка ответа агента по мере поступления токенов.
+        Токены склеиваются во фреймы, чтобы не отправлять по фрейму на токен;
+        фрейм несёт только новый текст, клиент дописывает его сам
+        """
+        full_response = ""
+        pending = ""
+        last_flush = 0.0
+        loop = asyncio.get_running_loop()
+        
+        async def flush() -> None:
+            nonlocal pending, last_flush
+            await websocket_send_func({
+                "type": "ai_streaming",
+                "delta": pending,
+                "is_complete": False
+            })
+            pending = ""
+            last_flush = loop.time()
+        
+        started = loop.time()
+        async for token in stream_chat(user_message, chat_history, user_id):
+            if not full_response:
+                time_to_first_token.observe(loop.time() - started)
+            full_response += token
+            pending += token
             
-            # Отправляем частичный ответ каждые 3-4 слова
-            if (i + 1) % 3 == 0 or i == len(words) - 1:
-                await websocket_send_func({
-                    "type": "ai_streaming",
-                    "partial_message": current_response.strip(),
-                    "is_complete": i == len(words) - 1
-                })
-                
-                # Небольшая задержка для эффекта печати
-                await asyncio.sleep(0.1)
+            # Первый токен отправляем сразу, дальше - пачками
+            if (
+                not last_flush
+                or len(pending) >= settings.STREAM_MIN_CHARS
+                or loop.time() - last_flush >= settings.STREAM_FLUSH_INTERVAL
+            ):
+                await flush()
+        
+        # Завершение стрима клиент получает отдельным фреймом ai_response
+        if pending:
+            await flush()
         
         return full_response
     
@@ -115,19 +249,45 @@ class WebSocketChatService:
             chat_name = f"Чат {chat_count + 1}"
         
         chat = await Chat.create(name=chat_name, user=user)
+        await invalidate_chat_list(user.id)
         return chat
     
+    @staticmethod
+    def schedule_post_turn(chat: Chat, user_message: str) -> None:
+        """
+        Работа после ответа, которую пользователь не ждёт, - в фоновую очередь.
+        Задачи одного чата выполняются по очереди, резюме не пересчитывается
+        дважды, если предыдущий пересчёт ещё не начался
+        """
+        # Название - только после первого сообщения (условие проверяем сейчас,
+        # к запуску задачи счётчик может вырасти)
+        if chat.message_count == 1 and chat.name.startswith("Чат "):
+            background_tasks.submit(
+                "title",
+                lambda: WebSocketChatService.update_chat_title(chat, user_message),
+                key=f"chat:{chat.id}:title"
+            )
+        # Сворачиваем вытесненные из окна сообщения в резюме чата
+        background_tasks.submit("summary", lambda: update_summary(chat), key=f"chat:{chat.id}:summary")
+    
     @staticmethod
     async def update_chat_title(chat: Chat, user_message: str) -> None:
-        """Автоматическое обновление названия чата на основе первого сообщения"""
-        message_count = await ChatMessage.filter(chat=chat).count()
+        """Название чата по первому сообщению; клиенты получают событие chat_renamed"""
+        # Берём первые 50 символов сообщения как название
+        new_title = user_message[:50].strip()
+        if len(user_message) > 50:
+            new_title += "..."
         
-        # Обновляем название только для первого сообщения
-        if message_count == 1 and chat.name.startswith("Чат "):
-            # Берём первые 50 символов сообщения как название
-            new_title = user_message[:50].strip()
-            if len(user_message) > 50:
-                new_title += "..."
-            
+        # При повторе попытки имя может быть уже сохранено - тогда только событие
+        if chat.name != new_title:
             chat.name = new_title
-            await chat.save()
+            # Только имя: счётчики в объекте могут отставать от БД
+            await chat.save(update_fields=["name"])
+            await invalidate_chat_list(chat.user_id)
+        
+        # Новое название сразу видно во всех вкладках пользователя
+        await connection_manager.send_to_user(chat.user_id, {
+            "type": "chat_renamed",
+            "chat_id": chat.id,
+            "chat_name": chat.name
+        })
@@ -1,15 +1,35 @@
+from typing import Awaitable, Callable, Optional
+from src.core.config import settings
 from src.utils.vector_search import vector_search_tool
-from langchain_community.vectorstores import FAISS
+from src.utils.knowledge_base import KnowledgeBase
+from langchain_core.language_models import BaseChatModel
 from langchain_openai import ChatOpenAI
 from langchain.agents import create_agent as create_langchain_agent
 
-def create_agent(vector_store: FAISS):
-    llm = ChatOpenAI(
+def create_llm(temperature: float = 0.7, max_tokens: Optional[int] = None) -> BaseChatModel:
+    if settings.LLM_BACKEND == "fake":
+        from src.utils.fake_models import FakeChatModel
+        return FakeChatModel(
+            latency=settings.FAKE_LLM_LATENCY,
+            tokens_per_second=settings.FAKE_LLM_TOKENS_PER_SECOND,
+            response_tokens=min(max_tokens or settings.FAKE_LLM_RESPONSE_TOKENS, settings.FAKE_LLM_RESPONSE_TOKENS),
+            use_tools=settings.FAKE_LLM_USE_TOOLS
+        )
+    return ChatOpenAI(
         model="gpt-4o-mini",
-        temperature=0.7
+        temperature=temperature,
+        max_tokens=max_tokens,
+        # Расход токенов в стриминге (для метрик)
+        stream_usage=True
     )
 
-    tools = [vector_search_tool(vector_store)]
+def create_agent(
+    knowledge_base: KnowledgeBase,
+    user_collection: Optional[Callable[[int], Awaitable[Optional[KnowledgeBase]]]] = None
+):
+    llm = create_llm()
+
+    tools = [vector_search_tool(knowledge_base, user_collection=user_collection)]
 
     system_prompt = """Вы - опытный психолог с 15-летним стажем работы, специализирующийся на помощи пострадавшим в кризисных и травматических ситуациях. Ваше имя - Анна Владимировна.
 
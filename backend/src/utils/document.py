@@ -1,26 +1,58 @@
+import hashlib
+import os
+from typing import Dict, Iterator
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+# Параметры нарезки входят в ключ кеша индекса (см. vector_store.py)
+CHUNK_SIZE = 350
+CHUNK_OVERLAP = 20
+
+# Какие файлы каталога базы знаний индексируются
+SOURCE_EXTENSIONS = (".md", ".txt")
+
+def get_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
+    )
+
 def get_documents_from_file(filename: str) -> list[Document]:
     
     with open(filename, encoding="UTF-8") as file:
         text = file.read()
 
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=350,
-            chunk_overlap=20
-        )
+        splitter = get_splitter()
 
         documents = splitter.create_documents([text])
 
         return documents
-    
-import os
-import asyncio
 
-# Получаем путь относительно корня проекта
-current_dir = os.path.dirname(__file__)
-project_root = os.path.abspath(os.path.join(current_dir, '..', '..'))
-prompt_file = os.path.join(project_root, "src", "prompts", "first.md")
+def file_hash(filename: str) -> str:
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def scan_source_files(directory: str) -> Dict[str, str]:
+    """Файлы базы знаний: путь относительно каталога -> sha256 содержимого"""
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if name.endswith(SOURCE_EXTENSIONS):
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, directory)] = file_hash(path)
+    return files
 
-doc = get_documents_from_file(prompt_file)
+def iter_file_chunks(directory: str, relpath: str, content_hash: str) -> Iterator[Document]:
+    """Чанки одного файла со стабильными id (путь + хеш содержимого + номер)"""
+    with open(os.path.join(directory, relpath), encoding="UTF-8") as file:
+        text = file.read()
+
+    for i, chunk in enumerate(get_splitter().split_text(text)):
+        yield Document(
+            page_content=chunk,
+            metadata={"source": relpath, "chunk": i},
+            id=f"{relpath}:{content_hash[:16]}:{i}"
+        )
@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.core.metrics import counter
+
+embedding_cache_hits = counter("embedding_cache_hits_total", "Embeddings served from the local cache")
+embedding_cache_misses = counter("embedding_cache_misses_total", "Embeddings requested from the provider")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    hash BLOB NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (model, hash)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS query_embeddings (
+    model TEXT NOT NULL,
+    hash BLOB NOT NULL,
+    vector BLOB NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS query_embeddings_last_used ON query_embeddings (last_used);
+"""
+
+# SQLite ограничивает число параметров в одном запросе
+SQL_BATCH = 500
+
+def text_hash(text: str) -> bytes:
+    """Хеш нормализованного текста: пробелы по краям и повторы не влияют на ключ"""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).digest()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Эмбеддинги с локальным кешем в SQLite (векторы float32 в BLOB).
+    Чанки документов хранятся без ограничения, запросы пользователей - в LRU:
+    горячие в памяти, остальные на диске не более query_disk_size записей
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        model: str,
+        path: str,
+        query_cache_size: int = 2048,
+        query_disk_size: int = 100000
+    ):
+        self.underlying = underlying
+        self.model = model
+        self.query_cache_size = query_cache_size
+        self.query_disk_size = query_disk_size
+        self._queries: "OrderedDict[bytes, List[float]]" = OrderedDict()
+        self._query_inserts = 0
+
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect()
+        # Соединение SQLite нельзя использовать после fork (prefork сервер)
+        os.register_at_fork(after_in_child=self._connect)
+
+    def _connect(self) -> None:
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    # --- SQLite ---
+
+    def _select(self, table: str, hashes: List[bytes]) -> Dict[bytes, List[float]]:
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), SQL_BATCH):
+                chunk = hashes[i:i + SQL_BATCH]
+                rows = self._db.execute(
+                    f"SELECT hash, vector FROM {table} WHERE model = ? AND hash IN ({','.join('?' * len(chunk))})",
+                    [self.model, *chunk]
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+            if table == "query_embeddings" and found:
+                self._db.executemany(
+                    "UPDATE query_embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(time.time(), self.model, key) for key in found]
+                )
+        return found
+
+    def _insert(self, table: str, items: Dict[bytes, List[float]]) -> None:
+        if not items:
+            return
+        with self._lock:
+            if table == "query_embeddings":
+                now = time.time()
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)",
+                    [(self.model, key, np.asarray(v, dtype=np.float32).tobytes(), now) for key, v in items.items()]
+                )
+                self._query_inserts += len(items)
+                # Вытеснение редко используемых запросов проверяем не на каждой вставке
+                if self._query_inserts >= max(self.query_disk_size // 10, 1):
+                    self._query_inserts = 0
+                    self._db.execute(
+                        "DELETE FROM query_embeddings WHERE model = ? AND hash IN ("
+                        "SELECT hash FROM query_embeddings WHERE model = ? "
+                        "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                        (self.model, self.model, self.query_disk_size)
+                    )
+            else:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)",
+                    [(self.model, key, np.asarray(v, dtype=np.float32).tobytes()) for key, v in items.items()]
+                )
+
+    # --- LRU запросов в памяти ---
+
+    def _remember_queries(self, items: Dict[bytes, List[float]]) -> None:
+        for key, vector in items.items():
+            self._queries[key] = vector
+            self._queries.move_to_end(key)
+        while len(self._queries) > self.query_cache_size:
+            self._queries.popitem(last=False)
+
+    def _from_memory(self, hashes: List[bytes]) -> Dict[bytes, List[float]]:
+        found = {}
+        for key in hashes:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                found[key] = vector
+        return found
+
+    # --- общая логика ---
+
+    @staticmethod
+    def _missing(texts: List[str], hashes: List[bytes], found: Dict[bytes, List[float]]) -> Dict[bytes, str]:
+        missing = {}
+        for text, key in zip(texts, hashes):
+            if key not in found:
+                missing.setdefault(key, text)
+        return missing
+
+    def _result(self, hashes: List[bytes], found: Dict[bytes, List[float]], hits: int) -> List[List[float]]:
+        embedding_cache_hits.inc(hits)
+        embedding_cache_misses.inc(len(hashes) - hits)
+        return [found[key] for key in hashes]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        found = self._select("embeddings", hashes)
+        hits = sum(key in found for key in hashes)
+        missing = self._missing(texts, hashes, found)
+        if missing:
+            new = dict(zip(missing, self.underlying.embed_documents(list(missing.values()))))
+            self._insert("embeddings", new)
+            found.update(new)
+        return self._result(hashes, found, hits)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        found = await asyncio.to_thread(self._select, "embeddings", hashes)
+        hits = sum(key in found for key in hashes)
+        missing = self._missing(texts, hashes, found)
+        if missing:
+            new = dict(zip(missing, await self.underlying.aembed_documents(list(missing.values()))))
+            await asyncio.to_thread(self._insert, "embeddings", new)
+            found.update(new)
+        return self._result(hashes, found, hits)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        found = self._from_memory(hashes)
+        if len(found) < len(set(hashes)):
+            found.update(self._select("query_embeddings", [k for k in hashes if k not in found]))
+        hits = sum(key in found for key in hashes)
+        missing = self._missing(texts, hashes, found)
+        if missing:
+            new = dict(zip(missing, self.underlying.embed_documents(list(missing.values()))))
+            self._insert("query_embeddings", new)
+            found.update(new)
+        self._remember_queries({key: found[key] for key in hashes})
+        return self._result(hashes, found, hits)
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Пакетный эмбеддинг запросов: один запрос к провайдеру на все промахи"""
+        hashes = [text_hash(text) for text in texts]
+        found = self._from_memory(hashes)
+        if len(found) < len(set(hashes)):
+            found.update(await asyncio.to_thread(
+                self._select, "query_embeddings", [k for k in hashes if k not in found]
+            ))
+        hits = sum(key in found for key in hashes)
+        missing = self._missing(texts, hashes, found)
+        if missing:
+            new = dict(zip(missing, await self.underlying.aembed_documents(list(missing.values()))))
+            await asyncio.to_thread(self._insert, "query_embeddings", new)
+            found.update(new)
+        self._remember_queries({key: found[key] for key in hashes})
+        return self._result(hashes, found, hits)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_queries([text]))[0]
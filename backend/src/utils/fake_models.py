@@ -0,0 +1,156 @@
+"""
+Детерминированные локальные замены ChatOpenAI и OpenAIEmbeddings для нагрузочного
+тестирования (LLM_BACKEND=fake): ответы и векторы зависят только от входа,
+задержка и скорость генерации настраиваются в config
+"""
+import asyncio
+import hashlib
+import json
+import random
+import time
+import zlib
+from typing import Any, AsyncIterator, List, Optional, Sequence
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from src.utils.lexical_index import tokenize
+
+WORDS = (
+    "понимаю", "ваши", "чувства", "это", "нормальная", "реакция", "на", "трудную", "ситуацию",
+    "давайте", "попробуем", "дыхательное", "упражнение", "вдох", "на", "четыре", "счёта",
+    "задержка", "выдох", "обратите", "внимание", "на", "ощущения", "в", "теле", "вы",
+    "справляетесь", "и", "это", "требует", "сил", "расскажите", "что", "помогает", "вам",
+)
+
+class FakeChatModel(BaseChatModel):
+    """
+    Модель с ответом из словаря, выбранным по хешу последнего сообщения.
+    С привязанным инструментом на первом шаге вызывает его (как агент с поиском),
+    затем отвечает текстом
+    """
+
+    latency: float = 0.2
+    tokens_per_second: float = 50.0
+    response_tokens: int = 60
+    use_tools: bool = True
+    tool_name: Optional[str] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        names = [getattr(tool, "name", None) for tool in tools]
+        return self.model_copy(update={"tool_name": names[0] if names else None})
+
+    def _last_human(self, messages: List[BaseMessage]) -> str:
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                content = message.content
+                return content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+        return ""
+
+    def _wants_tool(self, messages: List[BaseMessage]) -> bool:
+        return bool(self.use_tools and self.tool_name and messages and isinstance(messages[-1], HumanMessage))
+
+    def _tool_call(self, messages: List[BaseMessage]) -> dict:
+        query = self._last_human(messages)[:200]
+        return {
+            "name": self.tool_name,
+            "args": {"queries": [query]},
+            "id": "call_" + hashlib.sha256(query.encode("utf-8")).hexdigest()[:12]
+        }
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        seed = int.from_bytes(hashlib.sha256(self._last_human(messages).encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        return [rng.choice(WORDS) + " " for _ in range(self.response_tokens)]
+
+    def _usage(self, messages: List[BaseMessage], output_tokens: int) -> dict:
+        input_tokens = sum(len(str(message.content)) for message in messages) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        if self._wants_tool(messages):
+            message = AIMessage(content="", tool_calls=[self._tool_call(messages)], usage_metadata=self._usage(messages, 10))
+        else:
+            tokens = self._tokens(messages)
+            message = AIMessage(content="".join(tokens).strip(), usage_metadata=self._usage(messages, len(tokens)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generation_time(self, messages: List[BaseMessage]) -> float:
+        if self._wants_tool(messages):
+            return self.latency
+        return self.latency + self.response_tokens / self.tokens_per_second
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._generation_time(messages))
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._generation_time(messages))
+        return self._result(messages)
+
+    async def _astream(
+        self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        if self._wants_tool(messages):
+            call = self._tool_call(messages)
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[{
+                    "name": call["name"], "args": json.dumps(call["args"], ensure_ascii=False),
+                    "id": call["id"], "index": 0
+                }]
+            ))
+            output_tokens = 10
+        else:
+            tokens = self._tokens(messages)
+            for token in tokens:
+                yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+                await asyncio.sleep(1 / self.tokens_per_second)
+            output_tokens = len(tokens)
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content="", usage_metadata=self._usage(messages, output_tokens)
+        ))
+
+class FakeEmbeddings(Embeddings):
+    """
+    Хеширование терминов (с той же нормализацией, что и BM25) в вектор размера size:
+    тексты с общими словами близки, как и у настоящих эмбеддингов
+    """
+
+    def __init__(self, size: int = 256, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for term in tokenize(text):
+            digest = zlib.crc32(term.encode("utf-8"))
+            vector[digest % self.size] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        if not norm:
+            # Текст без терминов: фиксированный вектор, чтобы не было нулевой нормы
+            vector[zlib.crc32(text.encode("utf-8")) % self.size] = 1.0
+            norm = 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
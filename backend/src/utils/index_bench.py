@@ -0,0 +1,171 @@
+"""
+Точность и скорость сжатых индексов FAISS относительно точного.
+
+Запуск из корня backend:
+    python -m src.utils.index_bench                      # векторы текущей базы знаний
+    python -m src.utils.index_bench --synthetic 100000   # синтетические векторы
+
+Для каждого индекса и значения параметра поиска (nprobe для IVF-PQ, efSearch
+для HNSW) выводятся recall@k относительно точного поиска, задержка одного
+запроса (p50/p95), пропускная способность пачки запросов, время построения
+и размер на диске. Индексы сохраняются и загружаются так же, как при работе
+сервиса (через mmap, IVF-PQ - с уточнением по VECTOR_INDEX_REFINE).
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+import faiss
+import numpy as np
+from src.core.config import settings
+from src.utils.knowledge_base import read_current
+from src.utils.vector_store import (
+    ANN_DATA_FILE, ANN_INDEX_FILE, INDEX_FILE, build_ann_index, read_index, write_ann_index
+)
+
+NPROBE_SWEEP = (1, 4, 8, 16, 32, 64)
+EF_SEARCH_SWEEP = (16, 32, 64, 128, 256)
+
+def load_corpus_vectors() -> np.ndarray:
+    """Векторы точного индекса текущей базы знаний"""
+    current = read_current()
+    if not current:
+        raise SystemExit("Knowledge base is not indexed yet: run python -m src.utils.ingestion")
+    index = faiss.read_index(os.path.join(settings.VECTOR_STORE_DIR, current, INDEX_FILE))
+    return index.reconstruct_n(0, index.ntotal)
+
+def synthetic_vectors(count: int, dimension: int, seed: int = 0) -> np.ndarray:
+    """Кластеризованные нормированные векторы (как у эмбеддингов текстов на разные темы)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(count // 100, 1), dimension)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=count)]
+    vectors += rng.standard_normal((count, dimension)).astype(np.float32) * 0.5
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def make_queries(vectors: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """Запросы рядом с документами корпуса, но не совпадающие с ними"""
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(len(vectors), size=count)].copy()
+    queries += rng.standard_normal(queries.shape).astype(np.float32) * 0.1
+    faiss.normalize_L2(queries)
+    return queries
+
+def recall(found: np.ndarray, exact: np.ndarray) -> float:
+    hits = sum(len(set(row[row >= 0]) & set(truth)) for row, truth in zip(found, exact))
+    return hits / exact.size
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int) -> Tuple[np.ndarray, List[float], float]:
+    """Результаты, задержки одиночных запросов и время поиска всей пачкой"""
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    _, found = index.search(queries, k)
+    return found, latencies, time.perf_counter() - started
+
+def index_size(index_dir: str, params: Optional[dict]) -> int:
+    """Размер файлов индекса для поиска (у сжатого - без точного индекса)"""
+    names = [ANN_INDEX_FILE, ANN_DATA_FILE] if params else [INDEX_FILE]
+    paths = [os.path.join(index_dir, name) for name in names]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+def build_on_disk(vectors: np.ndarray, params: Optional[dict], workdir: str) -> Tuple[str, float]:
+    """
+    Сохранить индексы как при индексации: точный всегда, сжатый - по params.
+    Возвращает каталог и время построения сжатого индекса
+    """
+    index_dir = tempfile.mkdtemp(dir=workdir)
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    faiss.write_index(exact, os.path.join(index_dir, INDEX_FILE))
+    started = time.perf_counter()
+    if params is not None:
+        write_ann_index(build_ann_index(vectors, params), index_dir)
+    return index_dir, time.perf_counter() - started
+
+def row(name: str, param: str, found, exact, latencies, batch_seconds, build_seconds, size) -> dict:
+    latencies = np.asarray(latencies)
+    return {
+        "index": name,
+        "param": param,
+        "recall": round(recall(found, exact), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "batch_qps": round(len(found) / batch_seconds, 1),
+        "build_s": round(build_seconds, 2),
+        "size_mb": round(size / 2 ** 20, 2),
+    }
+
+def run(vectors: np.ndarray, queries: np.ndarray, k: int, index_types: List[str]) -> List[dict]:
+    exact_index = faiss.IndexFlatL2(vectors.shape[1])
+    exact_index.add(vectors)
+    _, exact = exact_index.search(queries, k)
+
+    configs: Dict[str, Tuple[Optional[dict], str, Tuple[int, ...]]] = {
+        "flat": (None, "", (0,)),
+        "ivfpq": ({
+            "type": "ivfpq", "min_size": 0,
+            "nlist": settings.VECTOR_INDEX_NLIST, "pq_m": settings.VECTOR_INDEX_PQ_M
+        }, "nprobe", NPROBE_SWEEP),
+        "hnsw": ({
+            "type": "hnsw", "min_size": 0, "m": settings.VECTOR_INDEX_HNSW_M,
+            "ef_construction": settings.VECTOR_INDEX_EF_CONSTRUCTION
+        }, "efSearch", EF_SEARCH_SWEEP),
+    }
+    results = []
+    workdir = tempfile.mkdtemp(prefix="deepchat-index-bench-")
+    try:
+        for name in index_types:
+            params, knob, values = configs[name]
+            index_dir, build_seconds = build_on_disk(vectors, params, workdir)
+            size = index_size(index_dir, params)
+            index = read_index(index_dir, mmap=True)
+            for value in values:
+                if knob == "nprobe":
+                    faiss.extract_index_ivf(index).nprobe = value
+                elif knob == "efSearch":
+                    index.hnsw.efSearch = value
+                found, latencies, batch_seconds = measure(index, queries, k)
+                param = f"{knob}={value}" if knob else "exact"
+                results.append(row(name, param, found, exact, latencies, batch_seconds, build_seconds, size))
+            del index
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def print_table(results: List[dict]) -> None:
+    columns = ("index", "param", "recall", "p50_ms", "p95_ms", "batch_qps", "build_s", "size_mb")
+    widths = (8, 16, 9, 9, 9, 11, 9, 9)
+    print("".join(f"{column:>{width}}" for column, width in zip(columns, widths)))
+    for result in results:
+        print("".join(f"{result[column]!s:>{width}}" for column, width in zip(columns, widths)))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recall и задержка сжатых индексов FAISS")
+    parser.add_argument("--synthetic", type=int, default=0, help="число синтетических векторов вместо базы знаний")
+    parser.add_argument("--dim", type=int, default=1536, help="размерность синтетических векторов")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=settings.RETRIEVAL_K)
+    parser.add_argument("--index", nargs="+", default=["flat", "ivfpq", "hnsw"], choices=["flat", "ivfpq", "hnsw"])
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.synthetic, args.dim) if args.synthetic else load_corpus_vectors()
+    queries = make_queries(vectors, args.queries)
+    print(f"{len(vectors)} vectors x {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+    results = run(vectors, queries, args.k, args.index)
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"vectors": len(vectors), "dimension": int(vectors.shape[1]), "k": args.k,
+                       "results": results}, file, indent=2)
+
+if __name__ == "__main__":
+    main()
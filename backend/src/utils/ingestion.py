@@ -0,0 +1,178 @@
+"""
+Инкрементальная индексация базы знаний.
+
+Запуск из корня backend: python -m src.utils.ingestion [--source DIR]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+from langchain_core.documents import Document
+from src.core.config import settings
+from src.utils.document import iter_file_chunks, scan_source_files
+from src.utils.knowledge_base import (
+    KnowledgeBase, get_corpus_key, read_current, write_current, remove_stale_indexes
+)
+from src.utils.vector_store import get_embeddings, get_index_key
+
+# Индексация одного каталога индексов в процессе идёт последовательно
+_ingest_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def _iter_batches(source_dir: str, files: Dict[str, str]) -> Iterator[List[Document]]:
+    """Чанки файлов нарезаются по мере надобности и группируются в пачки"""
+    batch = []
+    for relpath, content_hash in files.items():
+        for doc in iter_file_chunks(source_dir, relpath, content_hash):
+            batch.append(doc)
+            if len(batch) >= settings.INGEST_BATCH_SIZE:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+async def _embed_and_add(knowledge_base: KnowledgeBase, source_dir: str, files: Dict[str, str]) -> List[str]:
+    """
+    Эмбеддинг новых чанков пачками, не более INGEST_CONCURRENCY запросов
+    одновременно. Возвращает id добавленных в индекс документов
+    """
+    added: List[str] = []
+    pending = set()
+
+    async def embed(batch: List[Document]) -> Tuple[List[Document], List[List[float]]]:
+        texts = [doc.page_content for doc in batch]
+        return batch, await asyncio.to_thread(knowledge_base.embedding.embed_documents, texts)
+
+    def collect(done) -> None:
+        for task in done:
+            batch, vectors = task.result()
+            knowledge_base.add(batch, vectors)
+            added.extend(doc.id for doc in batch)
+
+    try:
+        for batch in _iter_batches(source_dir, files):
+            pending.add(asyncio.create_task(embed(batch)))
+            if len(pending) >= settings.INGEST_CONCURRENCY:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                collect(done)
+        if pending:
+            done, pending = await asyncio.wait(pending)
+            collect(done)
+    except BaseException:
+        for task in pending:
+            task.cancel()
+        # Откат: индекс остаётся в состоянии до начала индексации
+        knowledge_base.delete(added)
+        raise
+
+    return added
+
+def _load_latest(embedding, store_dir: str) -> Optional[KnowledgeBase]:
+    """Последний сохранённый индекс, если он построен с теми же параметрами"""
+    current = read_current(store_dir)
+    if not current:
+        return None
+    try:
+        knowledge_base = KnowledgeBase.load(os.path.join(store_dir, current), embedding)
+    except Exception as e:
+        logging.warning(f"Failed to load knowledge base {current}: {e}")
+        return None
+    if knowledge_base.manifest.get("key") != get_index_key():
+        return None
+    return knowledge_base
+
+async def sync_knowledge_base(
+    knowledge_base: Optional[KnowledgeBase] = None,
+    source_dir: Optional[str] = None,
+    store_dir: Optional[str] = None
+) -> Tuple[KnowledgeBase, dict]:
+    """
+    Привести индекс в соответствие с каталогом документов.
+    Эмбеддятся только добавленные и изменённые файлы, векторы удалённых
+    и устаревших версий удаляются из индекса на месте.
+    По умолчанию - общая база знаний; store_dir - каталог индексов другой
+    коллекции (например, документов пользователя)
+    """
+    source_dir = source_dir or settings.KNOWLEDGE_BASE_DIR
+    store_dir = store_dir or settings.VECTOR_STORE_DIR
+    lock = _ingest_locks.get(store_dir)
+    if lock is None:
+        lock = _ingest_locks[store_dir] = asyncio.Lock()
+    async with lock:
+        files = await asyncio.to_thread(scan_source_files, source_dir)
+        corpus_key = get_corpus_key(get_index_key(), files)
+        index_dir = os.path.join(store_dir, corpus_key)
+
+        if knowledge_base is None:
+            embedding = get_embeddings()
+            # Быстрый путь: индекс для ровно такого содержимого уже сохранён
+            if os.path.exists(index_dir):
+                try:
+                    knowledge_base = await asyncio.to_thread(KnowledgeBase.load, index_dir, embedding)
+                    return knowledge_base, {
+                        "corpus_key": corpus_key, "added": [], "changed": [], "deleted": [],
+                        "chunks": len(knowledge_base)
+                    }
+                except Exception as e:
+                    logging.warning(f"Failed to load knowledge base {corpus_key}: {e}")
+            knowledge_base = await asyncio.to_thread(_load_latest, embedding, store_dir) or KnowledgeBase(embedding)
+
+        indexed = knowledge_base.manifest["files"]
+        added = [path for path in files if path not in indexed]
+        changed = [path for path in files if path in indexed and indexed[path]["hash"] != files[path]]
+        deleted = [path for path in indexed if path not in files]
+
+        report = {"corpus_key": corpus_key, "added": added, "changed": changed, "deleted": deleted}
+        if not (added or changed or deleted) and os.path.exists(index_dir):
+            report["chunks"] = len(knowledge_base)
+            return knowledge_base, report
+
+        to_embed = {path: files[path] for path in added + changed}
+        new_ids = await _embed_and_add(knowledge_base, source_dir, to_embed)
+
+        # Старые версии удаляем только после успешного добавления новых
+        stale_ids = [doc_id for path in changed + deleted for doc_id in indexed[path]["ids"]]
+        knowledge_base.delete(stale_ids)
+
+        ids_by_file: Dict[str, List[str]] = {path: [] for path in to_embed}
+        for doc_id in new_ids:
+            ids_by_file[doc_id.rsplit(":", 2)[0]].append(doc_id)
+        for path in deleted:
+            del indexed[path]
+        for path, ids in ids_by_file.items():
+            indexed[path] = {"hash": files[path], "ids": ids}
+
+        knowledge_base.rebuild_lexical_index()
+        await asyncio.to_thread(knowledge_base.save, index_dir)
+        # Поиск снова по сохранённому индексу (сжатому и/или через mmap)
+        await asyncio.to_thread(knowledge_base.reopen, index_dir)
+        write_current(corpus_key, store_dir)
+        remove_stale_indexes(keep=corpus_key, directory=store_dir)
+
+        report["chunks"] = len(knowledge_base)
+        logging.info(f"Knowledge base synced: {report}")
+        return knowledge_base, report
+
+def load_knowledge_base() -> KnowledgeBase:
+    """Синхронная загрузка базы знаний (в том числе из работающего event loop)"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(sync_knowledge_base())[0]
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, sync_knowledge_base()).result()[0]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Индексация базы знаний")
+    parser.add_argument("--source", default=settings.KNOWLEDGE_BASE_DIR, help="Каталог с документами")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    _, report = asyncio.run(sync_knowledge_base(source_dir=args.source))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from src.core.config import settings
+from src.utils.embedding_cache import CachedEmbeddings
+from src.utils.lexical_index import LexicalIndex
+from src.utils.vector_store import (
+    INDEX_FILE, ann_index_params, build_ann_index, create_empty_vector_store, get_index_key,
+    load_vector_store, read_exact_index, read_index, write_ann_index
+)
+
+MANIFEST_FILE = "manifest.json"
+# Имя каталога актуального индекса внутри VECTOR_STORE_DIR
+CURRENT_FILE = "CURRENT"
+
+def get_corpus_key(index_key: str, files: Dict[str, str]) -> str:
+    """Ключ содержимого базы знаний: параметры индекса + хеши всех файлов"""
+    digest = hashlib.sha256(index_key.encode("utf-8"))
+    for relpath, content_hash in sorted(files.items()):
+        digest.update(f"\0{relpath}\0{content_hash}".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+class KnowledgeBase():
+    """
+    Индексы базы знаний (FAISS и BM25) и манифест проиндексированных файлов.
+    Поиск идёт из пула потоков, поэтому изменения индекса защищены блокировкой.
+
+    Загруженная с диска база ищет по индексу только для чтения (сжатому и/или
+    через mmap); перед изменением он заменяется точным индексом из index_dir,
+    а после сохранения - снова индексом для поиска
+    """
+
+    def __init__(
+        self,
+        embedding: CachedEmbeddings,
+        vector_store: Optional[FAISS] = None,
+        lexical_index: Optional[LexicalIndex] = None,
+        manifest: Optional[dict] = None
+    ):
+        self.embedding = embedding
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index or LexicalIndex()
+        self.manifest = manifest or {"key": get_index_key(), "files": {}}
+        self.lock = threading.RLock()
+        # Каталог, из которого загружен индекс только для чтения
+        self.index_dir: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.vector_store.index_to_docstore_id) if self.vector_store else 0
+
+    def search(
+        self,
+        vectors: List[List[float]],
+        k: int,
+        score_threshold: float
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Один векторизованный поиск FAISS по всем запросам.
+        Для каждого запроса: (doc_id, релевантность) по убыванию релевантности
+        """
+        with self.lock:
+            if not self.vector_store:
+                return [[] for _ in vectors]
+
+            matrix = np.asarray(vectors, dtype=np.float32)
+            if self.vector_store._normalize_L2:
+                faiss.normalize_L2(matrix)
+            distances, indices = self.vector_store.index.search(matrix, k)
+
+            relevance = self.vector_store._select_relevance_score_fn()
+            rankings = []
+            for row_distances, row_indices in zip(distances, indices):
+                ranking = []
+                for distance, i in zip(row_distances, row_indices):
+                    if i == -1:
+                        continue
+                    score = relevance(float(distance))
+                    if score >= score_threshold:
+                        ranking.append((self.vector_store.index_to_docstore_id[i], score))
+                rankings.append(ranking)
+            return rankings
+
+    def get_document(self, doc_id: str) -> Document:
+        return self.vector_store.docstore.search(doc_id)
+
+    def _make_writable(self) -> None:
+        if self.index_dir is not None:
+            if self.vector_store:
+                self.vector_store.index = read_exact_index(self.index_dir)
+            self.index_dir = None
+
+    def reopen(self, index_dir: str) -> None:
+        """Перейти на сохранённый в index_dir индекс для поиска, освободив точный"""
+        with self.lock:
+            if self.vector_store:
+                self.vector_store.index = read_index(index_dir, settings.VECTOR_INDEX_MMAP)
+            self.index_dir = index_dir
+
+    def add(self, documents: List[Document], vectors: List[List[float]]) -> None:
+        with self.lock:
+            self._make_writable()
+            if self.vector_store is None:
+                self.vector_store = create_empty_vector_store(self.embedding, len(vectors[0]))
+            self.vector_store.add_embeddings(
+                text_embeddings=[(doc.page_content, vector) for doc, vector in zip(documents, vectors)],
+                metadatas=[doc.metadata for doc in documents],
+                ids=[doc.id for doc in documents]
+            )
+
+    def delete(self, ids: List[str]) -> None:
+        with self.lock:
+            if self.vector_store and ids:
+                self._make_writable()
+                self.vector_store.delete(ids)
+
+    def rebuild_lexical_index(self) -> None:
+        with self.lock:
+            if self.vector_store:
+                self.lexical_index = LexicalIndex.from_vector_store(self.vector_store)
+            else:
+                self.lexical_index = LexicalIndex()
+
+    def save(self, index_dir: str) -> None:
+        """Атомарное сохранение: пишем во временный каталог и переименовываем"""
+        cache_dir = os.path.dirname(index_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix=".tmp-")
+        try:
+            vectors = None
+            with self.lock:
+                self._make_writable()
+                if self.vector_store:
+                    self.vector_store.save_local(tmp_dir)
+                    if ann_index_params() is not None:
+                        index = self.vector_store.index
+                        vectors = index.reconstruct_n(0, index.ntotal)
+                self.lexical_index.save(tmp_dir)
+                with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="UTF-8") as file:
+                    json.dump(self.manifest, file, ensure_ascii=False)
+            # Сжатый индекс строится по копии векторов без блокировки: поиск не ждёт
+            if vectors is not None:
+                ann_index = build_ann_index(vectors, ann_index_params())
+                if ann_index is not None:
+                    write_ann_index(ann_index, tmp_dir)
+            os.replace(tmp_dir, index_dir)
+        except OSError:
+            # Индекс с тем же ключом уже сохранил другой процесс
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, index_dir: str, embedding: CachedEmbeddings) -> "KnowledgeBase":
+        with open(os.path.join(index_dir, MANIFEST_FILE), encoding="UTF-8") as file:
+            manifest = json.load(file)
+
+        vector_store = None
+        if os.path.exists(os.path.join(index_dir, INDEX_FILE)):
+            vector_store = load_vector_store(index_dir, embedding, settings.VECTOR_INDEX_MMAP)
+        try:
+            lexical_index = LexicalIndex.load(index_dir)
+        except (OSError, ValueError, KeyError):
+            lexical_index = None
+
+        knowledge_base = cls(embedding, vector_store, lexical_index, manifest)
+        knowledge_base.index_dir = index_dir
+        if lexical_index is None:
+            knowledge_base.rebuild_lexical_index()
+        return knowledge_base
+
+def read_current(directory: Optional[str] = None) -> Optional[str]:
+    """Имя каталога актуального индекса в directory (по умолчанию - VECTOR_STORE_DIR)"""
+    try:
+        with open(os.path.join(directory or settings.VECTOR_STORE_DIR, CURRENT_FILE), encoding="UTF-8") as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+def write_current(name: str, directory: Optional[str] = None) -> None:
+    path = os.path.join(directory or settings.VECTOR_STORE_DIR, CURRENT_FILE)
+    with open(path + ".tmp", "w", encoding="UTF-8") as file:
+        file.write(name)
+    os.replace(path + ".tmp", path)
+
+def remove_stale_indexes(keep: str, directory: Optional[str] = None) -> None:
+    directory = directory or settings.VECTOR_STORE_DIR
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name != keep and os.path.isdir(path) and not name.startswith(".tmp-"):
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,125 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+from langchain_community.vectorstores import FAISS
+
+LEXICAL_INDEX_FILE = "lexical.json"
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = {
+    "и", "в", "во", "не", "что", "он", "на", "я", "с", "со", "как", "а", "то", "все",
+    "она", "так", "его", "но", "да", "ты", "к", "у", "же", "вы", "за", "бы", "по",
+    "только", "ее", "мне", "было", "вот", "от", "меня", "еще", "нет", "о", "из", "ему",
+    "ли", "если", "или", "ни", "быть", "был", "до", "вас", "нибудь", "уже", "вам",
+    "для", "мы", "их", "чем", "это", "этот", "при", "без", "под", "об", "мой", "где",
+}
+
+# Окончания для грубого стемминга русских слов (длинные проверяются первыми)
+ENDINGS = sorted((
+    "иями", "ями", "ами", "ией", "иях", "ого", "его", "ому", "ему", "ыми", "ими",
+    "ость", "ости", "ться", "тся", "ешь", "ете", "ишь", "ите", "ует", "уют",
+    "ая", "яя", "ое", "ее", "ие", "ые", "ой", "ей", "ий", "ый", "ым", "им", "ом",
+    "ем", "ах", "ях", "ам", "ям", "ов", "ев", "ых", "их", "ую", "юю", "ию", "ья",
+    "ье", "ия", "ть", "ет", "ют", "ут", "ат", "ят", "ла", "ли", "ло",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь",
+), key=len, reverse=True)
+
+def stem(word: str) -> str:
+    if len(word) <= 4:
+        return word
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+def tokenize(text: str) -> List[str]:
+    return [
+        stem(token) for token in TOKEN_RE.findall(text.lower().replace("ё", "е"))
+        if token not in STOPWORDS
+    ]
+
+class LexicalIndex():
+    """Инвертированный индекс BM25 по тем же чанкам, что и индекс FAISS"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids: List[str] = []
+        self.doc_lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.avg_length = 0.0
+
+    @classmethod
+    def from_vector_store(cls, vectore_store: FAISS) -> "LexicalIndex":
+        index = cls()
+        for doc_id in vectore_store.index_to_docstore_id.values():
+            index.add(doc_id, vectore_store.docstore.search(doc_id).page_content)
+        return index
+
+    def add(self, doc_id: str, text: str) -> None:
+        position = len(self.doc_ids)
+        terms = tokenize(text)
+        self.doc_ids.append(doc_id)
+        self.doc_lengths.append(len(terms))
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, []).append((position, tf))
+        self.avg_length += (len(terms) - self.avg_length) / len(self.doc_lengths)
+
+    def _idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.doc_ids) - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float, float]]:
+        """
+        Лучшие k документов: (doc_id, оценка BM25, доля терминов запроса,
+        найденных в документе)
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.doc_ids:
+            return []
+
+        scores: Dict[int, float] = {}
+        matched: Dict[int, int] = {}
+        for term in terms:
+            idf = self._idf(term)
+            for position, tf in self.postings.get(term, ()):
+                norm = 1 - self.b + self.b * self.doc_lengths[position] / self.avg_length
+                scores[position] = scores.get(position, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+                matched[position] = matched.get(position, 0) + 1
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [
+            (self.doc_ids[position], score, matched[position] / len(terms))
+            for position, score in best
+        ]
+
+    def save(self, index_dir: str) -> None:
+        path = os.path.join(index_dir, LEXICAL_INDEX_FILE)
+        with open(path + ".tmp", "w", encoding="UTF-8") as file:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "doc_ids": self.doc_ids,
+                "doc_lengths": self.doc_lengths,
+                "postings": self.postings,
+            }, file, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, index_dir: str) -> "LexicalIndex":
+        with open(os.path.join(index_dir, LEXICAL_INDEX_FILE), encoding="UTF-8") as file:
+            data = json.load(file)
+        index = cls(k1=data["k1"], b=data["b"])
+        index.doc_ids = data["doc_ids"]
+        index.doc_lengths = data["doc_lengths"]
+        index.postings = {
+            term: [tuple(posting) for posting in postings]
+            for term, postings in data["postings"].items()
+        }
+        if index.doc_lengths:
+            index.avg_length = sum(index.doc_lengths) / len(index.doc_lengths)
+        return index
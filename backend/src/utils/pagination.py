@@ -0,0 +1,27 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Tuple
+from fastapi import HTTPException
+
+def encode_cursor(*values: Any) -> str:
+    """Курсор для keyset-пагинации: значения ключа сортировки в base64"""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Any, ...]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return tuple(json.loads(raw))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def decode_time_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Курсор по паре (time, id)"""
+    values = decode_cursor(cursor)
+    try:
+        time, id = values
+        return datetime.fromisoformat(time), int(id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
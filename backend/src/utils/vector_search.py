@@ -1,19 +1,200 @@
-from langchain_community.vectorstores import FAISS
-from langchain_core.tools import Tool
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import StructuredTool
+from pydantic import BaseModel, Field
+from src.core.config import settings
+from src.core.tracing import span, stage
+from src.utils.knowledge_base import KnowledgeBase
+from src.utils.lexical_index import LexicalIndex
 
+# Поиск FAISS выполняется в отдельном пуле, а не в event loop
+_executor = ThreadPoolExecutor(
+    max_workers=settings.RETRIEVAL_WORKERS,
+    thread_name_prefix="faiss"
+)
 
-def vector_search_tool(vectore_store: FAISS) -> Tool:
-    retriever = vectore_store.as_retriever(search_kwargs={"k":3})
-    
-    def search_documents(query: str) -> str:
+class VectorSearchInput(BaseModel):
+    queries: List[str] = Field(
+        description="Один или несколько поисковых запросов. Несколько вопросов передавай сразу списком."
+    )
+
+def _fuse(rankings: List[List[Tuple[str, float]]], k: int) -> List[Tuple[str, float]]:
+    """Reciprocal rank fusion нескольких ранжирований одного запроса"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1 / (settings.HYBRID_RRF_K + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+def _is_confident(lexical_ranking: List[Tuple[str, float, float]]) -> bool:
+    """Лучший документ содержит все термины запроса и заметно опережает второй"""
+    if not settings.HYBRID_LEXICAL_SHORTCUT or not lexical_ranking:
+        return False
+    _, top_score, coverage = lexical_ranking[0]
+    if coverage < 1.0:
+        return False
+    if len(lexical_ranking) == 1:
+        return True
+    return top_score >= lexical_ranking[1][1] * settings.HYBRID_LEXICAL_CONFIDENCE_RATIO
+
+def _collect_results(
+    knowledge_base: KnowledgeBase,
+    rankings: List[List[Tuple[str, float]]]
+) -> List[Tuple[Document, float]]:
+    """Документы всех запросов без повторов с лучшей оценкой, по убыванию оценки"""
+    best: Dict[str, float] = {}
+    for ranking in rankings:
+        for doc_id, score in ranking:
+            best[doc_id] = max(score, best.get(doc_id, score))
+
+    results = []
+    for doc_id, score in sorted(best.items(), key=lambda item: item[1], reverse=True):
+        doc = knowledge_base.get_document(doc_id)
+        # Документ мог быть удалён переиндексацией, пока шёл поиск
+        if isinstance(doc, Document):
+            results.append((doc, score))
+    return results
+
+def _hybrid_plan(
+    lexical_index: Optional[LexicalIndex],
+    queries: List[str],
+    k: int
+) -> Tuple[List[List[Tuple[str, float, float]]], List[int]]:
+    """Лексический поиск по всем запросам и номера запросов, которым нужен эмбеддинг"""
+    if lexical_index is None:
+        return [[] for _ in queries], list(range(len(queries)))
+    lexical = [lexical_index.search(query, k * 2) for query in queries]
+    dense_needed = [i for i, ranking in enumerate(lexical) if not _is_confident(ranking)]
+    return lexical, dense_needed
+
+def _merge_rankings(
+    lexical: List[List[Tuple[str, float, float]]],
+    dense: Dict[int, List[Tuple[str, float]]],
+    k: int
+) -> List[List[Tuple[str, float]]]:
+    """
+    Ранжирования запросов в одной шкале RRF, из чего бы они ни состояли.
+    Отбор до слияния - у каждого источника свой: релевантность FAISS
+    (RETRIEVAL_SCORE_THRESHOLD, уже в KnowledgeBase.search) и доля терминов
+    запроса для BM25 (HYBRID_LEXICAL_MIN_COVERAGE)
+    """
+    rankings = []
+    for i, lexical_ranking in enumerate(lexical):
+        lexical_pairs = [
+            (doc_id, score) for doc_id, score, coverage in lexical_ranking
+            if coverage >= settings.HYBRID_LEXICAL_MIN_COVERAGE
+        ]
+        # Без dense[i] - уверенное лексическое совпадение, эмбеддинг не запрашивали
+        rankings.append(_fuse([ranking for ranking in (dense.get(i), lexical_pairs) if ranking], k))
+    return rankings
+
+async def asearch_many(
+    knowledge_base: KnowledgeBase,
+    queries: List[str],
+    k: int,
+    score_threshold: float = 0.0
+) -> List[Tuple[Document, float]]:
+    """
+    Гибридный поиск: BM25 по всем запросам, затем один запрос эмбеддингов
+    и один поиск FAISS для тех запросов, где лексика не дала уверенного ответа
+    """
+    if not len(knowledge_base):
+        return []
+    lexical, dense_needed = _hybrid_plan(knowledge_base.lexical_index, queries, k)
+    dense = {}
+    if dense_needed:
+        with span("embed_queries", queries=len(dense_needed)):
+            vectors = await knowledge_base.embedding.aembed_queries(
+                [queries[i] for i in dense_needed]
+            )
+        with span("faiss_search"):
+            rankings = await asyncio.get_running_loop().run_in_executor(
+                _executor, knowledge_base.search, vectors, k, score_threshold
+            )
+        dense = dict(zip(dense_needed, rankings))
+    return _collect_results(knowledge_base, _merge_rankings(lexical, dense, k))
+
+def search_many(
+    knowledge_base: KnowledgeBase,
+    queries: List[str],
+    k: int,
+    score_threshold: float = 0.0
+) -> List[Tuple[Document, float]]:
+    if not len(knowledge_base):
+        return []
+    lexical, dense_needed = _hybrid_plan(knowledge_base.lexical_index, queries, k)
+    dense = {}
+    if dense_needed:
+        vectors = knowledge_base.embedding.embed_queries([queries[i] for i in dense_needed])
+        rankings = knowledge_base.search(vectors, k, score_threshold)
+        dense = dict(zip(dense_needed, rankings))
+    return _collect_results(knowledge_base, _merge_rankings(lexical, dense, k))
+
+def format_results(results: List[Tuple[Document, float]]) -> str:
+    if not results:
+        return "В документах ничего не найдено."
+    # Оценка RRF: сравнима внутри выдачи, но не с релевантностью FAISS (0..1)
+    return "\n\n".join(
+        f"[{position}, оценка {score:.4f}]\n{doc.page_content}"
+        for position, (doc, score) in enumerate(results, 1)
+    )
+
+def format_sections(
+    results: List[Tuple[Document, float]],
+    user_results: List[Tuple[Document, float]]
+) -> str:
+    """Результаты из документов пользователя и из общей базы знаний отдельно"""
+    if not user_results:
+        return format_results(results)
+    sections = [f"Из документов пользователя:\n\n{format_results(user_results)}"]
+    if results:
+        sections.append(f"Из базы знаний:\n\n{format_results(results)}")
+    return "\n\n".join(sections)
+
+def vector_search_tool(
+    knowledge_base: KnowledgeBase,
+    k: Optional[int] = None,
+    score_threshold: Optional[float] = None,
+    user_collection: Optional[Callable[[int], Awaitable[Optional[KnowledgeBase]]]] = None
+) -> StructuredTool:
+    """
+    Инструмент поиска по базе знаний. Если задан user_collection, поиск идёт
+    также по коллекции пользователя из configurable["user_id"] запуска агента:
+    один агент обслуживает всех пользователей
+    """
+    k = k or settings.RETRIEVAL_K
+    if score_threshold is None:
+        score_threshold = settings.RETRIEVAL_SCORE_THRESHOLD
+
+    def search_documents(queries: List[str]) -> str:
         """Используй этот инструмент, когда нужно найти данные из документов."""
-        docs = retriever.invoke(query)
-        return "\n\n".join([doc.page_content for doc in docs])
-    
-    retriever_tool = Tool(
+        # Синхронный вызов (без event loop) ищет только по общей базе знаний
+        return format_results(search_many(knowledge_base, queries, k, score_threshold))
+
+    async def asearch_documents(queries: List[str], config: RunnableConfig) -> str:
+        user_id = config.get("configurable", {}).get("user_id")
+        with stage("retrieval", queries=len(queries)):
+            collection = None
+            if user_collection is not None and user_id is not None:
+                with span("user_collection"):
+                    collection = await user_collection(user_id)
+            if collection is None:
+                return format_results(await asearch_many(knowledge_base, queries, k, score_threshold))
+            # Последовательно: второй поиск берёт эмбеддинги запросов из кеша
+            results = await asearch_many(knowledge_base, queries, k, score_threshold)
+            user_results = await asearch_many(collection, queries, k, score_threshold)
+            return format_sections(results, user_results)
+
+    retriever_tool = StructuredTool.from_function(
+        func=search_documents,
+        coroutine=asearch_documents,
         name="VectorSearch",
-        description="Используй этот инструмент, когда нужно найти данные из документов.",
-        func=search_documents
+        description="Используй этот инструмент, когда нужно найти данные из документов. "
+                    "Если вопросов несколько, передай их все одним вызовом.",
+        args_schema=VectorSearchInput
     )
     
-    return retriever_tool
\ No newline at end of file
+    return retriever_tool
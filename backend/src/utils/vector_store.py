@@ -1,12 +1,227 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import pickle
+from typing import Optional
+import faiss
+import numpy as np
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from envparse import env
+from src.core.config import settings
+from src.utils.document import CHUNK_SIZE, CHUNK_OVERLAP
+from src.utils.embedding_cache import CachedEmbeddings
 
 env.read_envfile()
 
-def create_vectore_store(docs: list[Document]) -> FAISS:
-    embedding = OpenAIEmbeddings(api_key=env.str("OPENAI_API_KEY"))
+# Файлы индекса в каталоге базы знаний: точный индекс (основа для инкрементальных
+# изменений, формат FAISS.save_local) и построенный по нему сжатый индекс
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "index.pkl"
+ANN_INDEX_FILE = "ann.faiss"
+ANN_DATA_FILE = "ann.ivfdata"
+
+INDEX_TYPES = ("flat", "ivfpq", "hnsw")
+
+_embeddings: Optional[CachedEmbeddings] = None
+
+def embedding_model_name() -> str:
+    """Имя модели для ключей кеша и индекса: векторы fake не смешиваются с настоящими"""
+    if settings.LLM_BACKEND == "fake":
+        return f"fake-{settings.FAKE_EMBEDDING_SIZE}"
+    return settings.EMBEDDING_MODEL
+
+def _create_openai_embeddings() -> Embeddings:
+    if settings.LLM_BACKEND == "fake":
+        from src.utils.fake_models import FakeEmbeddings
+        return FakeEmbeddings(size=settings.FAKE_EMBEDDING_SIZE, latency=settings.FAKE_EMBEDDING_LATENCY)
+    return OpenAIEmbeddings(
+        model=settings.EMBEDDING_MODEL,
+        api_key=env.str("OPENAI_API_KEY")
+    )
+
+def _reset_client_after_fork() -> None:
+    # HTTP соединения родителя не должны делиться между воркерами
+    if _embeddings is not None:
+        _embeddings.underlying = _create_openai_embeddings()
+
+os.register_at_fork(after_in_child=_reset_client_after_fork)
+
+def get_embeddings() -> CachedEmbeddings:
+    """Эмбеддинги OpenAI за общим для индексации и поиска дисковым кешем"""
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = CachedEmbeddings(
+            _create_openai_embeddings(),
+            model=embedding_model_name(),
+            path=settings.EMBEDDING_CACHE_PATH,
+            query_cache_size=settings.EMBEDDING_QUERY_CACHE_SIZE,
+            query_disk_size=settings.EMBEDDING_QUERY_DISK_SIZE
+        )
+    return _embeddings
+
+def create_vectore_store(docs: list[Document], embedding: Optional[Embeddings] = None) -> FAISS:
+    embedding = embedding or get_embeddings()
     vectore_store = FAISS.from_documents(docs, embedding)
     
-    return vectore_store
\ No newline at end of file
+    return vectore_store
+
+def create_empty_vector_store(embedding: Embeddings, dimension: int) -> FAISS:
+    return FAISS(
+        embedding_function=embedding,
+        index=faiss.IndexFlatL2(dimension),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={}
+    )
+
+def ann_index_params() -> Optional[dict]:
+    """Параметры построения сжатого индекса из настроек (None - только flat)"""
+    index_type = settings.VECTOR_INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown VECTOR_INDEX_TYPE: {index_type}")
+    if index_type == "ivfpq":
+        return {
+            "type": index_type, "min_size": settings.VECTOR_INDEX_MIN_SIZE,
+            "nlist": settings.VECTOR_INDEX_NLIST, "pq_m": settings.VECTOR_INDEX_PQ_M
+        }
+    if index_type == "hnsw":
+        return {
+            "type": index_type, "min_size": settings.VECTOR_INDEX_MIN_SIZE,
+            "m": settings.VECTOR_INDEX_HNSW_M, "ef_construction": settings.VECTOR_INDEX_EF_CONSTRUCTION
+        }
+    return None
+
+def _pq_subvectors(dimension: int, pq_m: int = 0) -> int:
+    """Число подвекторов PQ: делитель размерности, по умолчанию около dimension / 16"""
+    if pq_m:
+        return pq_m
+    return next(m for m in range(max(dimension // 16, 1), 0, -1) if dimension % m == 0)
+
+def build_ann_index(vectors: np.ndarray, params: dict) -> Optional[faiss.Index]:
+    """
+    Сжатый индекс по векторам точного индекса в том же порядке (метки 0..N-1
+    совпадают с index_to_docstore_id). None, если векторов меньше min_size
+    """
+    count, dimension = vectors.shape
+    if count < max(params.get("min_size", 0), 1):
+        return None
+    if params["type"] == "ivfpq":
+        nlist = params.get("nlist") or int(4 * math.sqrt(count))
+        # Не меньше 39 векторов обучения на кластер
+        nlist = max(1, min(nlist, count // 39))
+        pq_m = _pq_subvectors(dimension, params.get("pq_m", 0))
+        index = faiss.index_factory(dimension, f"IVF{nlist},PQ{pq_m}x8", faiss.METRIC_L2)
+        sample = vectors
+        if count > nlist * 256:
+            rows = np.random.default_rng(0).choice(count, nlist * 256, replace=False)
+            sample = vectors[np.sort(rows)]
+        index.train(sample)
+    elif params["type"] == "hnsw":
+        index = faiss.index_factory(dimension, f"HNSW{params['m']}", faiss.METRIC_L2)
+        index.hnsw.efConstruction = params["ef_construction"]
+    else:
+        raise ValueError(f"Unknown index type: {params['type']}")
+    index.add(vectors)
+    return index
+
+def write_ann_index(index: faiss.Index, index_dir: str) -> None:
+    """
+    Сохранение сжатого индекса; списки IVF пишутся в отдельный файл,
+    который при загрузке отображается в память, а не читается целиком
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ondisk = faiss.OnDiskInvertedLists(ivf.nlist, ivf.code_size, os.path.join(index_dir, ANN_DATA_FILE))
+        lists = faiss.InvertedListsPtrVector()
+        lists.push_back(ivf.invlists)
+        ondisk.merge_from_multiple(lists.data(), lists.size(), False)
+        ivf.replace_invlists(ondisk, True)
+        ondisk.this.disown()
+    faiss.write_index(index, os.path.join(index_dir, ANN_INDEX_FILE))
+
+def set_search_params(index: faiss.Index) -> None:
+    """Параметры точности поиска, которые можно менять без перестроения индекса"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(settings.VECTOR_INDEX_NPROBE, ivf.nlist)
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = settings.VECTOR_INDEX_EF_SEARCH
+    if hasattr(index, "k_factor"):
+        index.k_factor = settings.VECTOR_INDEX_REFINE
+
+_mmap_warned = False
+
+def _read_flags(mmap: bool) -> int:
+    """Флаги чтения индекса: с mmap - только чтение и отображение в память"""
+    global _mmap_warned
+    if not mmap:
+        return 0
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if flag is None:
+        # Старые сборки faiss не умеют mmap для плоских индексов: индекс
+        # читается в память каждого процесса целиком
+        if not _mmap_warned:
+            logging.warning("faiss has no IO_FLAG_MMAP_IFC, vector index is loaded into memory instead of mmap")
+            _mmap_warned = True
+        flag = 0
+    return faiss.IO_FLAG_READ_ONLY | flag
+
+def _read_exact(index_dir: str, mmap: bool) -> faiss.Index:
+    return faiss.read_index(os.path.join(index_dir, INDEX_FILE), _read_flags(mmap))
+
+def read_index(index_dir: str, mmap: bool = True) -> faiss.Index:
+    """
+    Индекс для поиска: сжатый, если он построен, иначе точный. С mmap векторы
+    и списки IVF не копируются в память процесса, а читаются из page cache
+    """
+    path = os.path.join(index_dir, ANN_INDEX_FILE)
+    if not os.path.exists(path):
+        index = _read_exact(index_dir, mmap)
+    elif os.path.exists(os.path.join(index_dir, ANN_DATA_FILE)):
+        # Списки IVF отображаются в память всегда; путь к ним - относительно index_dir
+        index = faiss.read_index(path, faiss.IO_FLAG_ONDISK_SAME_DIR)
+        if settings.VECTOR_INDEX_REFINE:
+            # Кандидаты PQ переранжируются по точным векторам: читаются
+            # только их страницы точного индекса
+            index = faiss.IndexRefine(index, _read_exact(index_dir, mmap))
+    else:
+        index = faiss.read_index(path, _read_flags(mmap))
+    set_search_params(index)
+    return index
+
+def load_vector_store(index_dir: str, embedding: Embeddings, mmap: bool = True) -> FAISS:
+    """Загрузка сохранённого FAISS.save_local с индексом из read_index"""
+    with open(os.path.join(index_dir, DOCSTORE_FILE), "rb") as file:
+        docstore, index_to_docstore_id = pickle.load(file)
+    return FAISS(
+        embedding_function=embedding,
+        index=read_index(index_dir, mmap),
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id
+    )
+
+def read_exact_index(index_dir: str) -> faiss.Index:
+    """Точный индекс в памяти для добавления и удаления векторов"""
+    return faiss.read_index(os.path.join(index_dir, INDEX_FILE))
+
+def get_index_key() -> str:
+    """
+    Ключ параметров индекса: нарезка, модель эмбеддингов и параметры сжатого
+    индекса. При его изменении индекс перестраивается целиком (векторы берутся
+    из кеша эмбеддингов)
+    """
+    params = {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "embedding_model": embedding_model_name(),
+    }
+    ann = ann_index_params()
+    if ann is not None:
+        # Для flat ключ прежний: существующие индексы не перестраиваются
+        params["ann_index"] = ann
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:32]
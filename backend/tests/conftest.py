@@ -0,0 +1,6 @@
+import os
+
+# Settings читаются при импорте src.core.config: обязательные значения - до импорта модулей приложения
+os.environ.setdefault("DATABASE_URL", "sqlite://:memory:")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
@@ -0,0 +1,135 @@
+import asyncio
+import pytest
+from src.core.config import settings
+from src.services.llm_dispatcher import DispatcherBusy, LLMDispatcher, request_key
+
+def blocked_call(release: asyncio.Event, value="answer"):
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await release.wait()
+        return value
+
+    return factory, calls
+
+async def test_identical_requests_share_one_call():
+    dispatcher = LLMDispatcher(max_concurrency=2, max_queue_per_user=2, max_queue_total=10)
+    release = asyncio.Event()
+    factory, calls = blocked_call(release)
+    key = request_key(1, "привет", [])
+
+    leader = asyncio.create_task(dispatcher.submit(1, key, factory))
+    await asyncio.sleep(0)
+    assert dispatcher.joins(key)
+    follower = asyncio.create_task(dispatcher.submit(1, key, factory))
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(leader, follower) == ["answer", "answer"]
+    assert len(calls) == 1
+    assert not dispatcher.joins(key)
+
+def test_requests_with_different_context_are_not_joined():
+    assert request_key(1, "привет", []) != request_key(1, "привет", [{"user": "a", "bot": "b"}])
+    assert request_key(1, "привет", []) != request_key(2, "привет", [])
+
+async def test_joined_request_gets_leader_error():
+    dispatcher = LLMDispatcher(max_concurrency=1, max_queue_per_user=1, max_queue_total=1)
+    release = asyncio.Event()
+
+    async def failing():
+        await release.wait()
+        raise RuntimeError("agent failed")
+
+    leader = asyncio.create_task(dispatcher.submit(1, "key", failing))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(dispatcher.submit(2, "key", failing))
+    await asyncio.sleep(0)
+    release.set()
+
+    for task in (leader, follower):
+        with pytest.raises(RuntimeError, match="agent failed"):
+            await task
+
+async def test_full_user_queue_is_busy():
+    dispatcher = LLMDispatcher(max_concurrency=1, max_queue_per_user=1, max_queue_total=10)
+    release = asyncio.Event()
+    factory, calls = blocked_call(release)
+
+    running = asyncio.create_task(dispatcher.submit(1, None, factory))
+    await asyncio.sleep(0)
+    queued = asyncio.create_task(dispatcher.submit(1, None, factory))
+    await asyncio.sleep(0)
+    with pytest.raises(DispatcherBusy) as busy:
+        await dispatcher.submit(1, None, factory)
+    assert busy.value.retry_after == settings.LLM_BUSY_RETRY_AFTER
+
+    # Очередь другого пользователя не заполнена
+    other = asyncio.create_task(dispatcher.submit(2, None, factory))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(running, queued, other)
+    assert len(calls) == 3
+
+async def test_full_total_queue_is_busy():
+    dispatcher = LLMDispatcher(max_concurrency=1, max_queue_per_user=5, max_queue_total=1)
+    release = asyncio.Event()
+    factory, _ = blocked_call(release)
+
+    tasks = [asyncio.create_task(dispatcher.submit(user_id, None, factory)) for user_id in (1, 2)]
+    await asyncio.sleep(0)
+    with pytest.raises(DispatcherBusy):
+        await dispatcher.submit(3, None, factory)
+    release.set()
+    await asyncio.gather(*tasks)
+
+async def test_queued_request_reports_position_updates():
+    dispatcher = LLMDispatcher(max_concurrency=1, max_queue_per_user=5, max_queue_total=10)
+    releases = [asyncio.Event() for _ in range(3)]
+    positions = []
+
+    def call(release):
+        async def factory():
+            await release.wait()
+        return factory
+
+    async def on_queued(position):
+        positions.append(position)
+
+    first = asyncio.create_task(dispatcher.submit(1, None, call(releases[0])))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(dispatcher.submit(2, None, call(releases[1])))
+    await asyncio.sleep(0)
+    third = asyncio.create_task(dispatcher.submit(3, None, call(releases[2]), on_queued))
+    await asyncio.sleep(0)
+    assert positions == [2]
+
+    releases[0].set()
+    await first
+    await asyncio.sleep(0)
+    assert positions == [2, 1]
+
+    releases[1].set()
+    releases[2].set()
+    await asyncio.gather(second, third)
+
+async def test_cancelled_waiter_leaves_the_queue():
+    dispatcher = LLMDispatcher(max_concurrency=1, max_queue_per_user=1, max_queue_total=10)
+    release = asyncio.Event()
+    factory, calls = blocked_call(release)
+
+    running = asyncio.create_task(dispatcher.submit(1, None, factory))
+    await asyncio.sleep(0)
+    waiting = asyncio.create_task(dispatcher.submit(2, None, factory))
+    await asyncio.sleep(0)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+
+    # Место в очереди пользователя освободилось
+    queued = asyncio.create_task(dispatcher.submit(2, None, factory))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(running, queued)
+    assert len(calls) == 2
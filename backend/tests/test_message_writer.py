@@ -0,0 +1,99 @@
+import asyncio
+import pytest
+from tortoise import Tortoise
+from tortoise.exceptions import IntegrityError
+from src.models.chat import Chat
+from src.models.message import ChatMessage
+from src.models.user import User
+from src.services import message_writer as writer_module
+from src.services.message_writer import MessageWriter
+
+@pytest.fixture
+async def chat():
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["src.models"]})
+    await Tortoise.generate_schemas()
+    user = await User.create(username="user", hashed_password="x")
+    yield await Chat.create(name="Чат", user=user)
+    await Tortoise.close_connections()
+
+def make_writer(mode: str, **options) -> MessageWriter:
+    params = dict(batch_size=2, flush_interval=60.0, max_pending=100, id_block_size=10, write_retries=2)
+    params.update(options)
+    return MessageWriter(mode, **params)
+
+async def test_async_messages_are_written_in_batches(chat, monkeypatch):
+    batches = []
+    write = writer_module._write
+
+    async def recording_write(messages):
+        batches.append(len(messages))
+        await write(messages)
+
+    monkeypatch.setattr(writer_module, "_write", recording_write)
+    writer = make_writer("async")
+    for i in range(5):
+        await writer.add(chat, chat.user_id, f"вопрос {i}", f"ответ {i}")
+    await writer.close()
+
+    assert batches == [2, 2, 1]
+    messages = await ChatMessage.filter(chat=chat).order_by("id")
+    assert [message.user_message for message in messages] == [f"вопрос {i}" for i in range(5)]
+    chat = await Chat.get(id=chat.id)
+    assert chat.message_count == 5
+    assert chat.last_message_preview == "ответ 4"
+
+async def test_group_turn_waits_for_commit(chat):
+    writer = make_writer("group", batch_size=3, flush_interval=0.01)
+    turns = [writer.add(chat, chat.user_id, f"вопрос {i}", "ответ") for i in range(3)]
+    written = await asyncio.gather(*turns)
+    # Ход завершается только после фиксации своей пачки
+    assert await ChatMessage.filter(id__in=[message.id for message in written]).count() == 3
+    await writer.close()
+
+async def test_messages_of_deleted_chat_are_dropped(chat):
+    other = await Chat.create(name="Другой", user_id=chat.user_id)
+    writer = make_writer("async", batch_size=10)
+    await writer.add(chat, chat.user_id, "вопрос", "ответ")
+    await writer.add(other, chat.user_id, "вопрос", "ответ")
+    await Chat.filter(id=chat.id).delete()
+    await writer.flush()
+
+    assert await ChatMessage.filter(chat_id=other.id).count() == 1
+    assert not writer._pending
+    await writer.close()
+
+async def test_unavailable_database_is_retried_until_it_recovers(chat, monkeypatch):
+    write = writer_module._write
+    failures = 5
+
+    async def flaky_write(messages):
+        nonlocal failures
+        if failures:
+            failures -= 1
+            raise ConnectionError("database is down")
+        await write(messages)
+
+    monkeypatch.setattr(writer_module, "_write", flaky_write)
+    writer = make_writer("async", write_retries=1)
+    await writer.add(chat, chat.user_id, "вопрос", "ответ")
+    for _ in range(5):
+        with pytest.raises(ConnectionError):
+            await writer.flush()
+        assert len(writer._pending) == 1
+    await writer.flush()
+
+    assert await ChatMessage.filter(chat=chat).count() == 1
+    await writer.close()
+
+async def test_rejected_message_is_dropped_after_retries(chat):
+    writer = make_writer("async", write_retries=2)
+    message = await writer.add(chat, chat.user_id, "вопрос", "ответ")
+    # Строка с тем же id уже есть: БД будет отвергать сообщение при каждой попытке
+    await ChatMessage.create(id=message.id, chat=chat, user_id=chat.user_id, user_message="x", bot_response="y")
+
+    for _ in range(3):
+        with pytest.raises(IntegrityError):
+            await writer.flush()
+    assert not writer._pending
+    await writer.flush()
+    await writer.close()
@@ -0,0 +1,21 @@
+from datetime import datetime, timezone
+import pytest
+from fastapi import HTTPException
+from src.utils.pagination import decode_cursor, decode_time_cursor, encode_cursor
+
+def test_time_cursor_round_trip():
+    time = datetime(2024, 5, 17, 12, 30, 45, 123456, tzinfo=timezone.utc)
+    cursor = encode_cursor(time, 42)
+    assert decode_time_cursor(cursor) == (time, 42)
+
+def test_cursor_is_url_safe_without_padding():
+    cursor = encode_cursor("a?b/c+d", 1)
+    assert "=" not in cursor
+    assert not set(cursor) & set("+/")
+    assert decode_cursor(cursor) == ("a?b/c+d", 1)
+
+@pytest.mark.parametrize("cursor", ["not base64!", encode_cursor(1, 2, 3), encode_cursor("yesterday", 1)])
+def test_invalid_cursor_is_bad_request(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_time_cursor(cursor)
+    assert error.value.status_code == 400
@@ -0,0 +1,35 @@
+import pytest
+from src.core.config import settings
+from src.utils.vector_search import _merge_rankings
+
+def rrf(*ranks):
+    return sum(1 / (settings.HYBRID_RRF_K + rank + 1) for rank in ranks)
+
+def test_documents_found_by_both_rankings_come_first():
+    lexical = [[("a", 9.0, 1.0), ("b", 5.0, 1.0)]]
+    dense = {0: [("b", 0.9), ("c", 0.8)]}
+    ranking, = _merge_rankings(lexical, dense, k=10)
+    assert [doc_id for doc_id, _ in ranking] == ["b", "a", "c"]
+    assert ranking[0][1] == pytest.approx(rrf(0, 1))
+    assert ranking[1][1] == pytest.approx(rrf(0))
+
+def test_confident_lexical_query_without_dense_ranking():
+    lexical = [[("a", 9.0, 1.0), ("b", 1.0, 1.0)], [("c", 3.0, 1.0)]]
+    dense = {1: [("d", 0.9)]}
+    ranking = _merge_rankings(lexical, dense, k=10)
+    assert [doc_id for doc_id, _ in ranking[0]] == ["a", "b"]
+    assert [doc_id for doc_id, _ in ranking[1]] in (["c", "d"], ["d", "c"])
+
+def test_lexical_matches_below_min_coverage_are_dropped(monkeypatch):
+    monkeypatch.setattr(settings, "HYBRID_LEXICAL_MIN_COVERAGE", 0.5)
+    lexical = [[("a", 9.0, 0.25), ("b", 5.0, 0.75)]]
+    ranking = _merge_rankings(lexical, {0: [("c", 0.9)]}, k=10)
+    assert {doc_id for doc_id, _ in ranking[0]} == {"b", "c"}
+
+def test_ranking_is_cut_to_k():
+    lexical = [[(f"doc{i}", 10.0 - i, 1.0) for i in range(5)]]
+    ranking = _merge_rankings(lexical, {}, k=3)
+    assert [doc_id for doc_id, _ in ranking[0]] == ["doc0", "doc1", "doc2"]
+
+def test_query_without_matches_gets_empty_ranking():
+    assert _merge_rankings([[]], {}, k=5) == [[]]
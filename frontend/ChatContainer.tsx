@@ -8,7 +8,7 @@ import ChatInput from '@/ChatInput';
 import MoodTracker from '@/components/MoodTracker';
 import BreathingExercise from '@/components/BreathingExercise';
 import { WebSocketChatManager, type ChatMessage as WSChatMessage } from '@/lib/websocket';
-import { getChatHistory } from '@/lib/api';
+import { getChatHistory, type ChatHistoryPage } from '@/lib/api';
 import { cn } from '@/lib/utils';
 
 interface ChatContainerProps {
@@ -28,6 +28,8 @@ const ChatContainer: React.FC<ChatContainerProps> = ({
   const [wsManager, setWsManager] = useState<WebSocketChatManager | null>(null);
   const [error, setError] = useState<string | null>(null);
   const [isLoadingHistory, setIsLoadingHistory] = useState(false);
+  const [earlierCursor, setEarlierCursor] = useState<string | null>(null);
+  const [loadingEarlier, setLoadingEarlier] = useState(false);
   const [showMoodTracker, setShowMoodTracker] = useState(false);
   const [showBreathingExercise, setShowBreathingExercise] = useState(false);
   const [selectedMood, setSelectedMood] = useState<string | undefined>();
@@ -38,10 +40,25 @@ const ChatContainer: React.FC<ChatContainerProps> = ({
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
+  // При догрузке ранних сообщений прокрутка остаётся на месте
+  const skipScrollRef = useRef(false);
+
   useEffect(() => {
+    if (skipScrollRef.current) {
+      skipScrollRef.current = false;
+      return;
+    }
     scrollToBottom();
   }, [messages]);
 
+  const toChatMessages = (page: ChatHistoryPage): WSChatMessage[] =>
+    page.messages.map(msg => ({
+      id: msg.id,
+      content: msg.content,
+      isUser: msg.role === 'user',
+      timestamp: msg.timestamp ? new Date(msg.timestamp) : new Date()
+    }));
+
   // Инициализация WebSocket менеджера
   useEffect(() => {
     if (!token) return;
@@ -99,6 +116,7 @@ const ChatContainer: React.FC<ChatContainerProps> = ({
     if (!wsManager || !currentChatId) return;
 
     setMessages([]);
+    setEarlierCursor(null);
     setIsConnected(false);
 
     // Загружаем историю чата
@@ -109,21 +127,10 @@ const ChatContainer: React.FC<ChatContainerProps> = ({
       setError(null);
       
       try {
-        const history = await getChatHistory(currentChatId, token);
-        console.log('Loaded chat history:', history);
-        
-        if (Array.isArray(history) && history.length > 0) {
-          const convertedMessages: WSChatMessage[] = history.map((msg: any) => ({
-            id: msg.id,
-            content: msg.content,
-            isUser: msg.role === 'user',
-            timestamp: msg.timestamp ? new Date(msg.timestamp) : new Date()
-          }));
-          setMessages(convertedMessages);
-        } else {
-          // Если история пуста, устанавливаем пустой массив
-          setMessages([]);
-        }
+        // Последняя страница истории, более ранние сообщения - по кнопке
+        const page = await getChatHistory(currentChatId, token);
+        setMessages(toChatMessages(page));
+        setEarlierCursor(page.has_more ? page.before : null);
       } catch (err) {
         console.error('Failed to load chat history:', err);
         setError('Не удалось загрузить историю чата');
@@ -142,6 +149,26 @@ const ChatContainer: React.FC<ChatContainerProps> = ({
     };
   }, [wsManager, currentChatId, token]);
 
+  const loadEarlierMessages = async () => {
+    if (!token || !currentChatId || !earlierCursor || loadingEarlier) return;
+
+    setLoadingEarlier(true);
+    try {
+      const page = await getChatHistory(currentChatId, token, earlierCursor);
+      skipScrollRef.current = true;
+      setMessages(prev => {
+        const known = new Set(prev.map(m => m.id));
+        return [...toChatMessages(page).filter(m => !known.has(m.id)), ...prev];
+      });
+      setEarlierCursor(page.has_more ? page.before : null);
+    } catch (err) {
+      console.error('Failed to load earlier messages:', err);
+      setError('Не удалось загрузить историю чата');
+    } finally {
+      setLoadingEarlier(false);
+    }
+  };
+
   const handleSendMessage = (content: string) => {
     if (!wsManager || !wsManager.isConnected()) {
       setError('Нет соединения с сервером');
@@ -336,6 +363,19 @@ const ChatContainer: React.FC<ChatContainerProps> = ({
               </div>
             ) : (
               <div className="divide-y divide-border/30">
+                {earlierCursor && (
+                  <div className="flex justify-center py-3">
+                    <Button
+                      variant="ghost"
+                      size="sm"
+                      onClick={loadEarlierMessages}
+                      disabled={loadingEarlier}
+                      className="text-xs text-muted-foreground"
+                    >
+                      {loadingEarlier ? 'Загрузка...' : 'Показать более ранние сообщения'}
+                    </Button>
+                  </div>
+                )}
                 {messages.map((message) => (
                   <ChatMessage
                     key={message.id}
@@ -4,13 +4,15 @@ import { ScrollArea } from '@/components/ui/scroll-area';
 import { PlusIcon, HeartIcon, XIcon, MessageCircleIcon } from 'lucide-react';
 import { cn } from '@/lib/utils';
 import { useAuth } from '@/AuthContext';
-import { getUserChats, createNewChat, renameChat, deleteChat } from '@/lib/api';
+import { getUserChats, createNewChat, renameChat, deleteChat, type ChatListPage } from '@/lib/api';
 import { WebSocketChatManager } from '@/lib/websocket';
 import ChatActions from '@/components/ChatActions';
 
 interface ChatHistory {
   id: number;
   name: string;
+  messageCount: number;
+  preview: string;
   timestamp?: Date;
 }
 
@@ -33,18 +35,27 @@ const ChatSidebar: React.FC<ChatSidebarProps> = ({
   const [chatHistory, setChatHistory] = useState<ChatHistory[]>([]);
   const [loading, setLoading] = useState(false);
   const [creatingChat, setCreatingChat] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  const toChatHistory = (page: ChatListPage): ChatHistory[] =>
+    page.chats.map(chat => ({
+      id: chat.id,
+      name: chat.name,
+      messageCount: chat.message_count,
+      preview: chat.last_message_preview,
+      // Чат без сообщений показывается как "Недавно"
+      timestamp: chat.last_message_at ? new Date(chat.last_message_at) : undefined
+    }));
 
   const loadChats = async () => {
     if (!token) return;
     
     setLoading(true);
     try {
-      const chats = await getUserChats(token);
-      setChatHistory(chats.map((chat: any) => ({
-        id: chat.id,
-        name: chat.name,
-        timestamp: new Date() // API не возвращает timestamp, используем текущее время
-      })));
+      const page = await getUserChats(token);
+      setChatHistory(toChatHistory(page));
+      setNextCursor(page.next);
     } catch (error) {
       console.error('Failed to load chats:', error);
     } finally {
@@ -52,10 +63,39 @@ const ChatSidebar: React.FC<ChatSidebarProps> = ({
     }
   };
 
+  const loadMoreChats = async () => {
+    if (!token || !nextCursor || loadingMore) return;
+
+    setLoadingMore(true);
+    try {
+      const page = await getUserChats(token, nextCursor);
+      setChatHistory(prev => [...prev, ...toChatHistory(page)]);
+      setNextCursor(page.next);
+    } catch (error) {
+      console.error('Failed to load chats:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     loadChats();
   }, [token]);
 
+  useEffect(() => {
+    // Переименования приходят по WebSocket из любой открытой вкладки
+    const handleChatRenamed = (event: Event) => {
+      const { chatId, chatName } = (event as CustomEvent).detail;
+      setChatHistory(prev =>
+        prev.map(chat =>
+          chat.id === chatId ? { ...chat, name: chatName } : chat
+        )
+      );
+    };
+    window.addEventListener('chat_renamed', handleChatRenamed);
+    return () => window.removeEventListener('chat_renamed', handleChatRenamed);
+  }, []);
+
   const handleNewChat = async () => {
     if (!token || creatingChat) return;
 
@@ -231,8 +271,14 @@ const ChatSidebar: React.FC<ChatSidebarProps> = ({
                       <p className="text-sm text-sidebar-foreground truncate font-medium">
                         {chat.name}
                       </p>
+                      {chat.preview && (
+                        <p className="text-xs text-sidebar-foreground/60 truncate mt-0.5">
+                          {chat.preview}
+                        </p>
+                      )}
                       <p className="text-xs text-sidebar-foreground/50 mt-0.5">
                         {formatTime(chat.timestamp)}
+                        {chat.messageCount > 0 && ` · ${chat.messageCount} сообщ.`}
                       </p>
                     </div>
                     <div className="flex-shrink-0">
@@ -246,6 +292,16 @@ const ChatSidebar: React.FC<ChatSidebarProps> = ({
                     </div>
                   </div>
                 ))}
+                {nextCursor && (
+                  <Button
+                    variant="ghost"
+                    onClick={loadMoreChats}
+                    disabled={loadingMore}
+                    className="w-full text-xs text-sidebar-foreground/60"
+                  >
+                    {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+                  </Button>
+                )}
               </div>
             )}
           </ScrollArea>
@@ -50,25 +50,52 @@ export async function getMe(token: string) {
   return res.json()
 }
 
-export async function getUserChats(token: string) {
-  const res = await fetch(`${API_URL}/chat/my`, {
+export type ChatListPage = {
+  chats: {
+    id: number
+    name: string
+    message_count: number
+    last_message_at: string | null
+    last_message_preview: string
+  }[]
+  has_more: boolean
+  next: string | null
+}
+
+export async function getUserChats(token: string, before?: string): Promise<ChatListPage> {
+  // Чаты по последней активности, следующая страница - по курсору next
+  const query = before ? `?before=${encodeURIComponent(before)}` : ''
+  const res = await fetch(`${API_URL}/chat/my${query}`, {
     headers: { Authorization: `Bearer ${token}` },
   })
-  if (!res.ok && res.status !== 404) {
+  if (!res.ok) {
     throw new Error('Не удалось загрузить чаты')
   }
-  if (res.status === 404) return []
   return res.json()
 }
 
-export async function getChatHistory(chatId: number, token: string) {
-  const res = await fetch(`${API_URL}/chat/${chatId}/history`, {
+export type ChatHistoryPage = {
+  messages: {
+    id: string
+    role: 'user' | 'assistant'
+    content: string
+    timestamp: string
+  }[]
+  has_more: boolean
+  before: string | null
+  after: string | null
+}
+
+export async function getChatHistory(chatId: number, token: string, before?: string): Promise<ChatHistoryPage> {
+  // Последняя страница истории; более ранние сообщения - по курсору before
+  const query = before ? `?before=${encodeURIComponent(before)}` : ''
+  const res = await fetch(`${API_URL}/chat/${chatId}/history${query}`, {
     headers: { Authorization: `Bearer ${token}` },
   })
   if (!res.ok) {
     if (res.status === 404) {
-      // Чат не найден или нет доступа - возвращаем пустой массив
-      return []
+      // Чат не найден или нет доступа - возвращаем пустую историю
+      return { messages: [], has_more: false, before: null, after: null }
     }
     throw new Error('Не удалось загрузить историю чата')
   }
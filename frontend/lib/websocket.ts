@@ -4,19 +4,25 @@ export type WebSocketMessageType =
   | 'ai_thinking'
   | 'ai_response'
   | 'ai_streaming'
+  | 'queued'
+  | 'busy'
   | 'error'
   | 'chat_created'
+  | 'chat_renamed'
+  | 'ping'
 
 export interface WebSocketMessage {
   type: WebSocketMessageType
   message?: string
-  partial_message?: string
+  delta?: string
   is_complete?: boolean
   chat_id?: number
   chat_name?: string
   message_id?: number
   timestamp?: string
   redirect?: string
+  position?: number
+  retry_after?: number
 }
 
 export interface ChatMessage {
@@ -37,6 +43,9 @@ export class WebSocketChatManager {
   private onConnected: (chatId: number) => void
   private reconnectAttempts = 0
   private maxReconnectAttempts = 3
+  private pendingMessages: string[] = []
+  // Текст стримингового ответа: сервер присылает только приращения
+  private streamingText = ''
 
   constructor(
     token: string,
@@ -102,6 +111,10 @@ export class WebSocketChatManager {
     this.ws.onopen = () => {
       this.reconnectAttempts = 0
       console.log('WebSocket connected successfully')
+      // Сообщения, отправленные пока соединение восстанавливалось
+      for (const payload of this.pendingMessages.splice(0)) {
+        this.ws?.send(payload)
+      }
     }
 
     this.ws.onmessage = (event) => {
@@ -159,6 +172,7 @@ export class WebSocketChatManager {
 
       case 'ai_thinking':
         // Показываем индикатор "печатает"
+        this.streamingText = ''
         this.onMessage({
           id: `thinking_${Date.now()}`,
           content: data.message || 'AI обрабатывает запрос...',
@@ -168,12 +182,24 @@ export class WebSocketChatManager {
         })
         break
 
+      case 'queued':
+        // Запрос ждёт своей очереди к AI
+        this.onMessage({
+          id: `thinking_${Date.now()}`,
+          content: data.message || `В очереди: ${data.position}`,
+          isUser: false,
+          timestamp: new Date(),
+          isThinking: true
+        })
+        break
+
       case 'ai_streaming':
-        // Обновляем стриминговое сообщение
-        if (data.partial_message) {
+        // Дописываем приращение к стриминговому сообщению
+        if (data.delta) {
+          this.streamingText += data.delta
           this.onMessage({
             id: `streaming_${Date.now()}`,
-            content: data.partial_message,
+            content: this.streamingText,
             isUser: false,
             timestamp: new Date(),
             isStreaming: !data.is_complete
@@ -183,6 +209,7 @@ export class WebSocketChatManager {
 
       case 'ai_response':
         // Финальный ответ AI
+        this.streamingText = ''
         if (data.message) {
           this.onMessage({
             id: data.message_id ? `ai_${data.message_id}` : `ai_${Date.now()}`,
@@ -193,18 +220,50 @@ export class WebSocketChatManager {
         }
         break
 
+      case 'chat_renamed':
+        // Название чата изменилось (в этой или другой вкладке)
+        if (data.chat_id && data.chat_name) {
+          window.dispatchEvent(new CustomEvent('chat_renamed', {
+            detail: { chatId: data.chat_id, chatName: data.chat_name }
+          }))
+        }
+        break
+
+      case 'ping':
+        // Heartbeat: без ответа сервер закроет соединение
+        this.ws?.send(JSON.stringify({ type: 'pong' }))
+        break
+
+      case 'busy':
+        // Очередь к AI переполнена: запрос не обработан, его можно повторить
+        this.streamingText = ''
+        this.onError(
+          data.retry_after
+            ? `${data.message || 'Сервер перегружен'}. Повторите через ${Math.ceil(data.retry_after)} с`
+            : data.message || 'Сервер перегружен'
+        )
+        break
+
       case 'error':
+        this.streamingText = ''
         this.onError(data.message || 'Произошла ошибка')
         break
     }
   }
 
   sendMessage(message: string) {
+    const payload = JSON.stringify({
+      type: 'user_message',
+      message: message
+    })
     if (this.ws && this.ws.readyState === WebSocket.OPEN) {
-      this.ws.send(JSON.stringify({
-        type: 'user_message',
-        message: message
-      }))
+      this.ws.send(payload)
+    } else if (this.chatId) {
+      // Сервер закрывает простаивающие соединения - переподключаемся и отправляем
+      this.pendingMessages.push(payload)
+      if (!this.ws || this.ws.readyState !== WebSocket.CONNECTING) {
+        this.connectWebSocket()
+      }
     } else {
       this.onError('Соединение не установлено')
     }